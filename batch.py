@@ -0,0 +1,254 @@
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+import chunked
+import decimate
+from loader import iter_tsv, load
+from recording import CHANNELS, is_binary, read_header
+from summary import STATS, WindowStats
+from timing import IntervalHistogram
+
+# Headless analysis of every recording under a directory: python batch.py DIR [--png DIR] [--jobs N]. Each
+# recording is processed by a worker process chunk by chunk (summary statistics per channel, sample interval
+# jitter, gaps and optionally a PNG) and gets one row in a consolidated TSV table, which is appended to as
+# results come in. Files whose size and mtime match an 'ok' row of an existing table are skipped, so an
+# interrupted run picks up where it stopped. TSV recordings are parsed chunk by chunk on every run; with --cache
+# each is converted once into a binary .cache sidecar written next to it in the study tree (see loader.py), which
+# later runs memory-map instead.
+
+EXTENSIONS = ('.tsv', '.bin', chunked.EXT)
+FIELDS = ['path', 'size', 'mtime_ns', 'status', 'seconds', 'samples', 'duration_s', 'rate_hz', 'interval_mean_ms',
+          'interval_std_ms', 'interval_p50_ms', 'interval_p99_ms', 'interval_max_ms', 'gap_markers', 'gaps',
+          'gap_s', 'longest_gap_s', 'png'] + ['%s_%s' % (name, stat) for name in CHANNELS for stat in STATS[1:]]
+PANELS = [('Gyroscope', ['g_x', 'g_y', 'g_z']), ('Accelerometer', ['a_x', 'a_y', 'a_z']),
+          ('Temperature', ['t']), ('Pressure', ['p']), ('Light', ['l'])]
+
+
+def is_recording(fname):
+    if fname.endswith('.tsv'):
+        # time and sensor channels, e.g. not a results table or a WindowStats summary (time, end, <channel>_<stat>)
+        with open(fname) as f:
+            columns = f.readline().rstrip('\n').split('\t')
+        return columns[0] == 'time' and len(columns) > 1 and set(columns[1:]) <= set(CHANNELS)
+    return fname.endswith(EXTENSIONS)
+
+
+def find_recordings(root, exclude=()):
+    found = []
+    for path, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            fname = os.path.join(path, name)
+            if name.endswith(EXTENSIONS) and os.path.abspath(fname) not in exclude and is_recording(fname):
+                found.append(fname)
+    return found
+
+
+def count_rows(fname):
+    with open(fname) as f:
+        return sum(1 for line in f if line.strip() and not line.startswith('#')) - 1
+
+
+def read_chunks(fname, chunk_size, cache=False):
+    # (header, rows, iterator over record chunks): binary and cached TSV recordings are memory-mapped and
+    # sliced, .blz files and uncached TSV files are decoded a chunk at a time, so memory is bounded by the chunk
+    # size, not the file size
+    if chunked.is_chunked(fname):
+        with open(fname, 'rb') as f:
+            header = read_header(f, chunked.MAGIC)
+            index = chunked.read_index(f, header)
+
+        def blz():
+            with open(fname, 'rb') as f:
+                for entry in index:
+                    f.seek(int(entry['offset']))
+                    yield chunked.decode_chunk(f.read(int(entry['size'])), entry, header)
+        return header, int(index['n'].sum()), blz()
+    if not cache and not is_binary(fname):
+        header, chunks = iter_tsv(fname, chunk_size)
+        return header, count_rows(fname), chunks
+    header, records = load(fname, cache=cache)
+    return header, len(records), (records[start:start + chunk_size] for start in range(0, len(records), chunk_size))
+
+
+def analyze(fname, root, png_dir=None, chunk_size=1000000, cache=False, gap_factor=5.0, width=2000):
+    start = time.perf_counter()
+    stat = os.stat(fname)
+    row = {'path': os.path.relpath(fname, root), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    try:
+        header, rows, chunks = read_chunks(fname, chunk_size, cache)
+        channels = header['channels']
+        stats = WindowStats(channels, window=3600e3)
+        jitter = IntervalHistogram()
+        interval_sum = interval_sumsq = 0.0
+        gap_limit = None
+        gaps = markers = 0
+        gap_s = longest_gap = 0.0
+        first_t = last_t = None
+        traces = {name: ([], []) for name in channels}
+        for chunk in chunks:
+            t = np.asarray(chunk['time'], dtype=np.float64)
+            values = np.column_stack([chunk[name] for name in channels]).astype(np.float64)
+            gap = np.isnan(values).all(axis=1)
+            markers += int(gap.sum())
+            stats.update(t, values)
+            if png_dir is not None and len(t):
+                # min/max envelope per chunk, in proportion to the chunk's share of the file. Gap markers stay in
+                # so the traces break at gaps
+                buckets = max(1, int(width * len(t) / max(rows, 1)))
+                for idx, name in enumerate(channels):
+                    x, y = decimate.minmax(t, values[:, idx], buckets)
+                    traces[name][0].append(x)
+                    traces[name][1].append(y)
+            t = t[~gap]
+            values = values[~gap]
+            if not len(t):
+                continue
+            jitter.add(np.round(t * 1e6).astype(np.int64))
+            intervals = np.diff(t if last_t is None else np.concatenate(([last_t], t)))
+            if gap_limit is None and len(intervals):
+                gap_limit = gap_factor * float(np.median(intervals))
+            interval_sum += float(intervals.sum())
+            interval_sumsq += float((intervals * intervals).sum())
+            if gap_limit is not None:
+                long = intervals[intervals > gap_limit]
+                gaps += len(long)
+                gap_s += float(long.sum()) / 1e3
+                longest_gap = max(longest_gap, float(long.max()) / 1e3 if len(long) else 0.0)
+            if first_t is None:
+                first_t = float(t[0])
+            last_t = float(t[-1])
+        summary = stats.total()
+        samples = int(summary['count'].max()) if len(channels) else 0
+        duration = (last_t - first_t) / 1e3 if first_t is not None else 0.0
+        n_intervals = jitter.n
+        row.update(samples=samples, duration_s=duration, gap_markers=markers, gaps=gaps, gap_s=gap_s,
+                   longest_gap_s=longest_gap, rate_hz=(samples - 1) / duration if duration > 0 else 0.0)
+        if n_intervals:
+            mean = interval_sum / n_intervals
+            intervals = jitter.summary(percentiles=(50, 99))
+            row.update(interval_mean_ms=mean, interval_p50_ms=intervals['p50'], interval_p99_ms=intervals['p99'],
+                       interval_max_ms=intervals['max'],
+                       interval_std_ms=np.sqrt(max(interval_sumsq / n_intervals - mean * mean, 0.0)))
+        for idx, name in enumerate(channels):
+            if name in CHANNELS:
+                for stat_name in STATS[1:]:
+                    row['%s_%s' % (name, stat_name)] = float(summary[stat_name][idx])
+        if png_dir is not None:
+            png = os.path.join(png_dir, row['path'].replace(os.sep, '__') + '.png')
+            render(png, row['path'], {name: (np.concatenate(x) if x else np.empty(0),
+                                             np.concatenate(y) if y else np.empty(0))
+                                      for name, (x, y) in traces.items()}, jitter)
+            row['png'] = png
+        row['status'] = 'ok'
+    except Exception as e:
+        row['status'] = ('%s: %s' % (type(e).__name__, e)).replace('\t', ' ').replace('\n', ' ')
+    row['seconds'] = time.perf_counter() - start
+    return row
+
+
+def render(png, title, traces, jitter):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    panels = [(label, [name for name in names if name in traces]) for label, names in PANELS]
+    panels = [(label, names) for label, names in panels if names]
+    fig, axes = plt.subplots(len(panels) + 1, 1, figsize=(12, 2.5 * (len(panels) + 1)), squeeze=False)
+    for ax, (label, names) in zip(axes[:-1, 0], panels):
+        for name in names:
+            x, y = traces[name]
+            ax.plot(x / 1e3, y, linewidth=0.5, label=name)
+        ax.set_ylabel(label)
+        if len(names) > 1:
+            ax.legend(loc='upper right')
+    if panels:
+        axes[-2, 0].set_xlabel('Time (s)')
+    ax = axes[-1, 0]
+    counts = jitter.counts[1:-1]
+    ax.stairs(counts, jitter.edges / 1e6)
+    ax.set_xscale('log')
+    ax.set_xlabel('Sample interval (ms)')
+    ax.set_ylabel('Count')
+    axes[0, 0].set_title(title)
+    fig.tight_layout()
+    fig.savefig(png, dpi=80)
+    plt.close(fig)
+
+
+def read_results(fname):
+    try:
+        with open(fname, newline='') as f:
+            return {row['path']: row for row in csv.DictReader(f, delimiter='\t')}
+    except OSError:
+        return {}
+
+
+def format_row(row):
+    return '\t'.join('%.6g' % row[name] if isinstance(row.get(name), float) else str(row.get(name, ''))
+                     for name in FIELDS) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze every recording under a directory')
+    parser.add_argument('root')
+    parser.add_argument('--out', default=None, help='results table (default ROOT/batch_results.tsv)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--png', default=None, help='directory for one PNG per recording')
+    parser.add_argument('--chunk-size', type=int, default=1000000, help='rows in memory per worker')
+    parser.add_argument('--tasks-per-worker', type=int, default=50,
+                        help='recordings before a worker is replaced (Python 3.11+)')
+    parser.add_argument('--gap-factor', type=float, default=5.0, help='intervals this many times the median are gaps')
+    parser.add_argument('--cache', action='store_true',
+                        help='write a binary .cache sidecar next to every TSV recording, for faster reruns')
+    parser.add_argument('--force', action='store_true', help='reprocess recordings already in the table')
+    args = parser.parse_args()
+
+    out = args.out or os.path.join(args.root, 'batch_results.tsv')
+    if args.png is not None:
+        os.makedirs(args.png, exist_ok=True)
+    done = {} if args.force else read_results(out)
+    todo = []
+    for fname in find_recordings(args.root, exclude=(os.path.abspath(out),)):
+        stat = os.stat(fname)
+        previous = done.get(os.path.relpath(fname, args.root))
+        if previous is not None and previous['status'] == 'ok' and previous['size'] == str(stat.st_size) \
+                and previous['mtime_ns'] == str(stat.st_mtime_ns):
+            continue
+        todo.append(fname)
+    print('%d recordings to process, %d already done' % (len(todo), len(done)))
+
+    start = time.perf_counter()
+    results = dict(done)
+    with open(out, 'a') as f:
+        if f.tell() == 0:
+            f.write('\t'.join(FIELDS) + '\n')
+        # workers are only replaced from Python 3.11, before that each one lives for the whole run
+        options = {'max_tasks_per_child': args.tasks_per_worker} if sys.version_info >= (3, 11) else {}
+        with ProcessPoolExecutor(args.jobs, **options) as pool:
+            futures = [pool.submit(analyze, fname, args.root, args.png, args.chunk_size, args.cache,
+                                   args.gap_factor) for fname in todo]
+            for idx, future in enumerate(as_completed(futures)):
+                row = future.result()
+                f.write(format_row(row))
+                f.flush()
+                results[row['path']] = row
+                print('[%d/%d] %s %s' % (idx + 1, len(todo), row['path'], row['status']))
+
+    # one row per recording, the latest
+    tmp = out + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write('\t'.join(FIELDS) + '\n')
+        for path in sorted(results):
+            f.write(format_row(results[path]))
+    os.replace(tmp, out)
+    print('%d recordings in %.1f s, results in %s' % (len(todo), time.perf_counter() - start, out))
+
+
+if __name__=='__main__':
+    main()
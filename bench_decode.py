@@ -0,0 +1,52 @@
+import timeit
+
+import numpy as np
+
+from sensor import GyroAccelSensor, TempPressureSensor, AmbientLightSensor
+
+# Decode cost per packet of the int.from_bytes decoders the sensors used before and of the compiled
+# struct layouts they use now. Usage: python bench_decode.py [packets]
+
+
+def legacy_gyro_accel(data, gyro, accel):
+    for idx, iter in enumerate(range(6, 12, 2)):
+        gyro[0, idx] = int.from_bytes(data[iter:iter + 2], byteorder='big', signed=True) * GyroAccelSensor.gyro_scale
+    for idx, iter in enumerate(range(0, 6, 2)):
+        accel[0, idx] = int.from_bytes(data[iter:iter + 2], byteorder='big', signed=True) * GyroAccelSensor.acc_scale_2_g
+
+
+def legacy_temp_pressure(data, row):
+    row[0] = int.from_bytes(data[1:4], byteorder='big', signed=False) * TempPressureSensor.temp_scale
+    row[1] = int.from_bytes(data[4:8], byteorder='big', signed=False) * TempPressureSensor.pressure_scale
+
+
+def legacy_ambient_light(data, row):
+    row[0] = int.from_bytes(data, byteorder='big', signed=False) * AmbientLightSensor.light_scale
+
+
+if __name__=='__main__':
+    import sys
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    rng = np.random.default_rng(0)
+    gyro_data = rng.integers(-32768, 32768, 6).astype('>i2').tobytes()
+    temp_data = b'\x00' + int(20.0 * 5120).to_bytes(3, 'big') + int(101325).to_bytes(4, 'big')
+    light_data = int(1000).to_bytes(2, 'big')
+
+    gyro = np.zeros((1, 3))
+    accel = np.zeros((1, 3))
+    row = np.zeros(6)
+    cases = [
+        ('GyroAccelSensor', lambda: legacy_gyro_accel(gyro_data, gyro, accel),
+         lambda: GyroAccelSensor.layout.decode_into(gyro_data, row)),
+        ('TempPressureSensor', lambda: legacy_temp_pressure(temp_data, row),
+         lambda: TempPressureSensor.layout.decode_into(temp_data, row)),
+        ('AmbientLightSensor', lambda: legacy_ambient_light(light_data, row),
+         lambda: AmbientLightSensor.layout.decode_into(light_data, row)),
+    ]
+
+    print('%-20s %12s %12s %8s' % ('sensor', 'before ns', 'after ns', 'speedup'))
+    for name, before, after in cases:
+        before_ns = min(timeit.repeat(before, number=n, repeat=3)) / n * 1e9
+        after_ns = min(timeit.repeat(after, number=n, repeat=3)) / n * 1e9
+        print('%-20s %12.1f %12.1f %7.2fx' % (name, before_ns, after_ns, before_ns / after_ns))
@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from fake import FakeBleakClient
+from sensor import RecordingDevice
+
+# End-to-end acquisition benchmark against a simulated SENSOR_PRO. Every mode runs in its own process so peak
+# RSS is per mode, and the results are written as JSON so runs of different versions can be compared.
+# Usage: python bench.py [--duration s] [--rate Hz] [--latency s] [--jitter s] [--modes notify,poll,raw]
+#        [--format tsv|bin] [--out results.json]
+
+VARIANT = 'bleak'
+MODES = {'notify': {}, 'poll': {'notify': False}, 'raw': {'raw': True}}
+SENSORS = ['gyro_acc', 'temp_press', 'ambient_light']
+
+
+async def run_once(args):
+    client = FakeBleakClient(rate=args.rate, latency=args.latency, jitter=args.jitter, seed=0)
+    await client.connect()
+    dev = RecordingDevice(client, handle_cache=None, **MODES[args.single])
+    await dev.enable(rate=args.rate, **{name: name in args.sensors.split(',') for name in SENSORS})
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, 'bench.' + args.format)
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        acquisition = asyncio.ensure_future(dev.read(fname))
+        await asyncio.sleep(args.duration)
+        dev.stop()
+        await acquisition
+        capture_wall = time.perf_counter() - wall_start
+        capture_cpu = time.process_time() - cpu_start
+
+        disconnect_start = time.perf_counter()
+        await dev.disconnect()
+        await client.disconnect()
+        disconnect_time = time.perf_counter() - disconnect_start
+        file_bytes = os.path.getsize(fname)
+
+        export_start = time.perf_counter()
+        with open(os.path.join(tmp, 'export.tsv'), 'w') as f:
+            dev.store.write_tsv(f)
+        export_time = time.perf_counter() - export_start
+
+    stats = dev.stats()
+    samples = len(dev.store)
+    return {'variant': VARIANT, 'mode': args.single, 'format': args.format, 'sensors': args.sensors,
+            'target_rate': args.rate, 'latency': args.latency, 'jitter': args.jitter, 'duration': capture_wall,
+            'samples': samples, 'samples_per_s': samples / capture_wall, 'achieved_rate': stats['rate'],
+            'dropped': stats['dropped'], 'cpu_s': capture_cpu, 'cpu_us_per_sample': 1e6 * capture_cpu / max(samples, 1),
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            'disconnect_s': disconnect_time, 'tsv_export_s': export_time, 'file_bytes': file_bytes,
+            'jitter_ms': dev.jitter()}
+
+
+def version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--rate', type=float, default=100.0)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--modes', default='notify,poll,raw')
+    parser.add_argument('--sensors', default=','.join(SENSORS))
+    parser.add_argument('--format', default='tsv', choices=['tsv', 'bin'])
+    parser.add_argument('--out', default=None)
+    parser.add_argument('--single', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--result', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        with open(args.result, 'w') as f:
+            json.dump(asyncio.run(run_once(args)), f)
+        sys.exit(0)
+
+    results = []
+    for mode in args.modes.split(','):
+        with tempfile.NamedTemporaryFile(suffix='.json') as result:
+            cmd = [sys.executable, os.path.abspath(__file__), '--single', mode, '--result', result.name]
+            for name in ('duration', 'rate', 'latency', 'jitter', 'sensors', 'format'):
+                cmd += ['--' + name, str(getattr(args, name))]
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+            results.append(json.load(open(result.name)))
+        r = results[-1]
+        print('%-7s %9.1f samples/s %7.1f us CPU/sample %7.1f MB peak RSS %7.3f s export %5d dropped' %
+              (mode, r['samples_per_s'], r['cpu_us_per_sample'], r['peak_rss_mb'], r['tsv_export_s'], r['dropped']),
+              file=sys.stderr)
+
+    report = {'version': version(), 'time': time.time(), 'python': platform.python_version(),
+              'numpy': np.__version__, 'platform': platform.platform(), 'results': results}
+    if args.out is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
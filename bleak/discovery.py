@@ -0,0 +1,78 @@
+import asyncio
+import os
+import time
+from bleak import BleakClient, BleakScanner
+from bleak.exc import BleakError
+
+SENSOR_NAME = 'SENSOR_PRO'
+SENSOR_SERVICE_UUID = '6a800001-b5a3-f393-e0a9-e50e24dcca9e'
+# Last address connected to, tried directly before scanning on the next start
+CACHE_FILE = os.path.expanduser('~/.sensor_pro_address')
+
+
+def load_address(fname=CACHE_FILE):
+    try:
+        with open(fname) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def save_address(address, fname=CACHE_FILE):
+    try:
+        with open(fname, 'w') as f:
+            f.write(address + '\n')
+    except OSError:
+        pass
+
+
+def matches(adv, name=SENSOR_NAME, service_uuid=SENSOR_SERVICE_UUID):
+    return adv.local_name == name or service_uuid in [uuid.lower() for uuid in adv.service_uuids]
+
+
+async def scan(timeout=10.0, name=SENSOR_NAME, service_uuid=SENSOR_SERVICE_UUID):
+    # Returns the first device advertising name or service_uuid as soon as it is seen, None after timeout
+    device = await BleakScanner.find_device_by_filter(lambda d, adv: matches(adv, name, service_uuid),
+                                                      timeout=timeout)
+    if device is not None:
+        print('%s found: %s' % (name, device.address))
+    return device
+
+
+async def connect(address=None, timeout=10.0, connect_timeout=5.0, cache=CACHE_FILE, client_factory=BleakClient,
+                  **scan_kwargs):
+    # Connects to address, else to the cached last-known address, else to the first matching device found by
+    # scan(). Returns the connected client, or None if nothing was found within timeout
+    cached = address is None
+    if cached:
+        address = load_address(cache)
+    if address is not None:
+        client = client_factory(address, timeout=connect_timeout)
+        try:
+            print('Connecting to %s...' % address)
+            await client.connect()
+            save_address(address, cache)
+            return client
+        except (BleakError, asyncio.TimeoutError):
+            if not cached:
+                raise
+            print('%s not reachable, scanning...' % address)
+    else:
+        print('Scanning...')
+    device = await scan(timeout, **scan_kwargs)
+    if device is None:
+        return None
+    client = client_factory(device)
+    await client.connect()
+    save_address(device.address, cache)
+    return client
+
+
+def startup_logger(start):
+    # Listener printing the time from start (a time.perf_counter() value) to the first sample, once
+    def log(t, block):
+        if not log.done:
+            log.done = True
+            print('First sample after %.2f s' % (time.perf_counter() - start))
+    log.done = False
+    return log
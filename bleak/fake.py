@@ -0,0 +1,192 @@
+import asyncio
+import time
+import numpy as np
+from bleak.exc import BleakError
+
+SERVICE_UUID = '6a800001-b5a3-f393-e0a9-e50e24dcca9e'
+GYRO_ACC_UUID = '6a806050-b5a3-f393-e0a9-e50e24dcca9e'
+TEMP_PRESS_UUID = '6a80b280-b5a3-f393-e0a9-e50e24dcca9e'
+AMBIENT_LIGHT_UUID = '6a803216-b5a3-f393-e0a9-e50e24dcca9e'
+IO_SAMP_CHAR_UUID = '6a80ff0c-b5a3-f393-e0a9-e50e24dcca9e'
+DEVICE_INFO_UUID = '0000180a-0000-1000-8000-00805f9b34fb'
+FIRMWARE_UUID = '00002a26-0000-1000-8000-00805f9b34fb'
+CCCD_UUID = '00002902-0000-1000-8000-00805f9b34fb'
+
+
+def make_payload(uuid, rng, t=0.0):
+    # Plausible SENSOR_PRO readings at t seconds: slow rotation on the gyro, gravity plus a little motion on the
+    # accelerometer, a drifting temperature, sea level pressure and indoor light, all with sensor noise
+    if uuid == GYRO_ACC_UUID:
+        phase = 2 * np.pi * 0.5 * t + np.array([0.0, 2.0, 4.0])
+        accel = np.array([0.0, 0.0, 1.0]) + 0.05 * np.sin(phase) + rng.normal(0, 0.01, 3)
+        gyro = 30.0 * np.sin(phase) + rng.normal(0, 0.5, 3)
+        counts = np.concatenate((accel / (2.0 / 32768.0), gyro / (250.0 / 32768.0)))
+        return np.clip(np.round(counts), -32768, 32767).astype('>i2').tobytes()
+    if uuid == TEMP_PRESS_UUID:
+        temp = int((20.0 + 0.01 * t / 60.0 + rng.normal(0, 0.01)) * 5120)
+        press = int(101325 + rng.normal(0, 2))
+        return b'\x00' + temp.to_bytes(3, 'big') + press.to_bytes(4, 'big')
+    if uuid == AMBIENT_LIGHT_UUID:
+        light = 300.0 + 50.0 * np.sin(t / 10.0) + rng.normal(0, 2)
+        return int(max(light, 0) / 0.35).to_bytes(2, 'big')
+    return b'\x00\x00'
+
+
+class FakeDescriptor:
+
+    def __init__(self, uuid, handle):
+        self.uuid = uuid
+        self.handle = handle
+
+
+class FakeCharacteristic:
+
+    def __init__(self, uuid, handle=None):
+        self.uuid = uuid
+        self.handle = handle
+        self.descriptors = [FakeDescriptor(CCCD_UUID, handle + 1)] if handle is not None else []
+
+
+class FakeService:
+
+    def __init__(self, uuid, characteristics, start_handle):
+        # Each characteristic takes a declaration, a value and a CCCD handle
+        self.uuid = uuid
+        self.characteristics = [FakeCharacteristic(char_uuid, start_handle + 1 + 3 * i)
+                                for i, char_uuid in enumerate(characteristics)]
+
+
+class FakeBleakClient:
+    # Stands in for a BleakClient connected to a SENSOR_PRO, pushing notifications at rate Hz (each delivered
+    # up to a random extra delay with standard deviation jitter seconds) and answering reads/writes after
+    # latency seconds. Characteristics can be addressed by uuid, object or value handle; handle_offset shifts the
+    # GATT table as a firmware update would. With drop_every the link drops after every drop_every seconds connected
+    # and connect() is refused for the following down_time seconds. Writing the sampling characteristic sets rate,
+    # clamped to max_rate; with link_rate notifications beyond that many per second are lost on the way
+
+    def __init__(self, address='00:00:00:00:00:00', rate=100.0, latency=0.005, jitter=0.0, seed=None, timeout=10.0,
+                 firmware='1.0', handle_offset=0, drop_every=None, down_time=1.0, disconnected_callback=None,
+                 max_rate=None, link_rate=None):
+        self.address = address
+        self.rate = rate
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = np.random.default_rng(seed)
+        self.start_t = time.monotonic()
+        self.services = [FakeService(DEVICE_INFO_UUID, [FIRMWARE_UUID], 0x10),
+                         FakeService(SERVICE_UUID, [GYRO_ACC_UUID, TEMP_PRESS_UUID, AMBIENT_LIGHT_UUID,
+                                                    IO_SAMP_CHAR_UUID], 0x20 + handle_offset)]
+        self.handles = {char.handle: char.uuid for service in self.services for char in service.characteristics}
+        self.values = {IO_SAMP_CHAR_UUID: b'\x00\x64', FIRMWARE_UUID: firmware.encode()}
+        self.notify_tasks = {}
+        self.sent = {}
+        # GATT requests go over one bearer, one at a time, and are counted per uuid in reads
+        self.bearer = asyncio.Lock()
+        self.reads = {}
+        self.is_connected = False
+        self.drop_every = drop_every
+        self.down_time = down_time
+        self.disconnected_callback = disconnected_callback
+        self.drop_task = None
+        self.down_until = 0.0
+        self.drops = 0
+        self.max_rate = max_rate
+        self.link_rate = link_rate
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    async def connect(self):
+        await asyncio.sleep(self.latency)
+        if time.monotonic() < self.down_until:
+            raise BleakError('Device with address %s was not found' % self.address)
+        self.is_connected = True
+        if self.drop_every:
+            self.drop_task = asyncio.ensure_future(self.drop_after(self.drop_every))
+        return True
+
+    async def disconnect(self):
+        if self.drop_task is not None:
+            self.drop_task.cancel()
+            self.drop_task = None
+        for uuid in list(self.notify_tasks):
+            await self.stop_notify(uuid)
+        self.is_connected = False
+        return True
+
+    async def drop_after(self, delay):
+        await asyncio.sleep(delay)
+        self.drop_task = None
+        self.drops += 1
+        self.down_until = time.monotonic() + self.down_time
+        for uuid in list(self.notify_tasks):
+            await self.stop_notify(uuid)
+        self.is_connected = False
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+    def check_link(self):
+        if not self.is_connected:
+            raise BleakError('Not connected')
+
+    async def get_services(self):
+        return self.services
+
+    def uuid_of(self, char):
+        if isinstance(char, int):
+            return self.handles[char]
+        return getattr(char, 'uuid', char)
+
+    async def read_gatt_char(self, char):
+        self.check_link()
+        uuid = self.uuid_of(char)
+        async with self.bearer:
+            await asyncio.sleep(self.latency)
+        self.reads[uuid] = self.reads.get(uuid, 0) + 1
+        if uuid in self.values:
+            return self.values[uuid]
+        return make_payload(uuid, self.rng, time.monotonic() - self.start_t)
+
+    async def write_gatt_char(self, char, data, response=False):
+        self.check_link()
+        async with self.bearer:
+            await asyncio.sleep(self.latency)
+        uuid = self.uuid_of(char)
+        if uuid == IO_SAMP_CHAR_UUID:
+            self.rate = int.from_bytes(bytes(data[:2]), 'big')
+            if self.max_rate is not None:
+                self.rate = min(self.rate, self.max_rate)
+            data = self.rate.to_bytes(2, 'big')
+        self.values[uuid] = bytes(data)
+
+    async def start_notify(self, char, callback):
+        self.check_link()
+        uuid = self.uuid_of(char)
+        if uuid in self.notify_tasks:
+            await self.stop_notify(uuid)
+        self.sent[uuid] = 0
+        self.notify_tasks[uuid] = asyncio.ensure_future(self.notify_loop(uuid, callback))
+
+    async def stop_notify(self, char):
+        # Like BlueZ, stopping a subscription that was never started (or already ended by a drop) is an error
+        uuid = self.uuid_of(char)
+        if uuid not in self.notify_tasks:
+            raise BleakError('Characteristic %s is not notifying' % uuid)
+        self.notify_tasks.pop(uuid).cancel()
+
+    async def notify_loop(self, uuid, callback):
+        loop = asyncio.get_running_loop()
+        sender = FakeCharacteristic(uuid)
+        next_t = loop.time()
+        while True:
+            next_t += 1.0 / self.rate
+            delay = abs(self.rng.normal(0, self.jitter)) if self.jitter else 0.0
+            await asyncio.sleep(max(0.0, next_t + delay - loop.time()))
+            if self.link_rate is not None and self.rng.random() * self.rate > self.link_rate:
+                continue
+            callback(sender, make_payload(uuid, self.rng, time.monotonic() - self.start_t))
+            self.sent[uuid] += 1
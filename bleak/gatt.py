@@ -0,0 +1,87 @@
+import json
+import os
+
+SERVICE_UUID = '6a800001-b5a3-f393-e0a9-e50e24dcca9e'
+SAMPLE_INTERVAL_UUID = '6a80ff0c-b5a3-f393-e0a9-e50e24dcca9e'
+CCCD_UUID = '00002902-0000-1000-8000-00805f9b34fb'
+FIRMWARE_UUID = '00002a26-0000-1000-8000-00805f9b34fb'
+# Value and CCCD handles of each SENSOR_PRO, keyed by '<address>/<firmware revision>'
+CACHE_FILE = os.path.expanduser('~/.sensor_pro_gatt.json')
+
+
+def encode_rate(rate):
+    # The sampling characteristic holds the rate in Hz as a big-endian uint16 (0x0064 for 100 Hz)
+    rate = int(round(rate))
+    if not 0 < rate < 0x10000:
+        raise ValueError('Sampling rate out of range: %r' % rate)
+    return rate.to_bytes(2, 'big')
+
+
+def decode_rate(value):
+    return int.from_bytes(bytes(value[:2]), 'big')
+
+
+def load_cache(fname=CACHE_FILE):
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache, fname=CACHE_FILE):
+    try:
+        with open(fname + '.tmp', 'w') as f:
+            json.dump(cache, f, indent=1)
+        os.replace(fname + '.tmp', fname)
+    except OSError:
+        pass
+
+
+async def firmware(client, services):
+    # Firmware revision string from the device information service, '' if the device has none
+    for service in services:
+        for char in service.characteristics:
+            if char.uuid == FIRMWARE_UUID:
+                return (await client.read_gatt_char(char.handle)).decode('ascii', errors='replace').strip('\x00 ')
+    return ''
+
+
+def discover(services, service_uuid=SERVICE_UUID, notify_uuids=()):
+    # {uuid: {'value': value handle, 'cccd': CCCD handle or None}} for the characteristics of one service,
+    # CCCDs are only looked up for the characteristics in notify_uuids
+    handles = {}
+    for service in services:
+        if service.uuid != service_uuid:
+            continue
+        for char in service.characteristics:
+            cccd = None
+            if char.uuid in notify_uuids:
+                cccd = next((desc.handle for desc in char.descriptors if desc.uuid == CCCD_UUID), None)
+            handles[char.uuid] = {'value': char.handle, 'cccd': cccd}
+    return handles
+
+
+def validate(services, handles):
+    # bleak has already discovered the GATT table at connect, so every cached value handle is checked against it
+    # without a round trip; any mismatch means the table changed and the cached handles are stale
+    table = {char.handle: char.uuid for service in services for char in service.characteristics}
+    return SAMPLE_INTERVAL_UUID in handles and all(table.get(entry['value']) == uuid
+                                                   for uuid, entry in handles.items())
+
+
+async def resolve(client, address, notify_uuids=(), fname=CACHE_FILE):
+    # Handles for this connection: cached ones if they are still valid, otherwise from the discovered services,
+    # which then replace the cache entry. fname=None or an unknown address skips the cache
+    services = await client.get_services()
+    if fname is None or address is None:
+        return discover(services, SERVICE_UUID, notify_uuids)
+    key = '%s/%s' % (address, await firmware(client, services))
+    cache = load_cache(fname)
+    handles = cache.get(key)
+    if handles is not None and all(uuid in handles for uuid in notify_uuids) and validate(services, handles):
+        return handles
+    handles = discover(services, SERVICE_UUID, notify_uuids)
+    cache[key] = handles
+    save_cache(cache, fname)
+    return handles
@@ -0,0 +1,98 @@
+import asyncio
+import time
+from bleak import BleakClient
+from gatt import CACHE_FILE
+from sensor import RecordingDevice
+
+
+def device_fname(address, pattern='test_%s.tsv'):
+    return pattern % address.replace(':', '')
+
+
+class MultiRecorder:
+    # Records several SENSOR_PROs from one event loop: connects to all addresses concurrently, runs one
+    # RecordingDevice per client against a shared time.perf_counter_ns() start and writes one file per device,
+    # rotated into segments with segment_duration (ms) or segment_bytes (see RecordingDevice.read)
+
+    def __init__(self, addresses, fname_pattern='test_%s.tsv', client_factory=BleakClient,
+                 handle_cache=CACHE_FILE, segment_duration=None, segment_bytes=None, stop_timeout=5.0,
+                 **enable_kwargs):
+        self.addresses = list(addresses)
+        self.fname_pattern = fname_pattern
+        self.segment_duration = segment_duration
+        self.segment_bytes = segment_bytes
+        self.stop_timeout = stop_timeout
+        self.client_factory = client_factory
+        self.handle_cache = handle_cache
+        self.enable_kwargs = enable_kwargs or {'gyro_acc': True}
+        self.clients = []
+        self.devices = []
+
+    async def connect(self):
+        self.clients = [self.client_factory(address) for address in self.addresses]
+        await asyncio.gather(*[client.connect() for client in self.clients])
+        keep = self.segment_duration is None and self.segment_bytes is None
+        self.devices = [RecordingDevice(client, handle_cache=self.handle_cache, keep=keep) for client in self.clients]
+        await asyncio.gather(*[dev.enable(**self.enable_kwargs) for dev in self.devices])
+
+    async def record(self, duration=None):
+        start_t = time.perf_counter_ns()
+        tasks = [asyncio.ensure_future(dev.read(device_fname(address, self.fname_pattern), start_t=start_t,
+                                                segment_duration=self.segment_duration,
+                                                segment_bytes=self.segment_bytes))
+                 for address, dev in zip(self.addresses, self.devices)]
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=duration, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            # stopping rather than cancelling lets every read() drain what is still buffered, only reads that do not
+            # return within stop_timeout seconds are cancelled
+            for dev in self.devices:
+                dev.stop()
+            done, pending = await asyncio.wait(tasks, timeout=self.stop_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def disconnect(self):
+        await asyncio.gather(*[dev.disconnect() for dev in self.devices], return_exceptions=True)
+        await asyncio.gather(*[client.disconnect() for client in self.clients], return_exceptions=True)
+
+    async def run(self, duration=None):
+        await self.connect()
+        try:
+            await self.record(duration)
+        finally:
+            await self.disconnect()
+        return self.report()
+
+    def report(self):
+        return {address: dev.stats() for address, dev in zip(self.addresses, self.devices)}
+
+
+def print_report(report):
+    print('%-20s %10s %10s %8s' % ('address', 'samples', 'rate (Hz)', 'dropped'))
+    for address, stats in report.items():
+        print('%-20s %10d %10.1f %8d' % (address, stats['samples'], stats['rate'], stats['dropped']))
+
+
+if __name__=='__main__':
+    # Simulated run: python multi.py [devices] [seconds] [rate]
+    import sys
+    from fake import FakeBleakClient
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    rate = float(sys.argv[3]) if len(sys.argv) > 3 else 100.0
+    addresses = ['FA:KE:00:00:%02X:%02X' % (idx // 256, idx % 256) for idx in range(n)]
+    recorder = MultiRecorder(addresses, fname_pattern='/tmp/fake_%s.tsv',
+                             client_factory=FakeBleakClient, handle_cache='/tmp/fake_gatt.json', gyro_acc=True,
+                             rate=rate)
+    cpu_start = time.process_time()
+    report = asyncio.run(recorder.run(duration))
+    cpu = time.process_time() - cpu_start
+    print_report(report)
+    samples = sum(stats['samples'] for stats in report.values())
+    print('%d devices, %d samples, %.1f%% CPU, %.1f us CPU/sample' %
+          (n, samples, 100.0 * cpu / duration, 1e6 * cpu / max(samples, 1)))
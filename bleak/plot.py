@@ -1,45 +1,42 @@
-import csv
+import sys
 
 import matplotlib.pyplot as plt
 import numpy as np
 
+import shared
+import decimate
+from loader import load
+
 if __name__=='__main__':
     fname='test.tsv'
-    with open(fname) as filename:
-        read_tsv=csv.reader(filename,delimiter='\t')
-        header=None
-        data=[]
-        for row in read_tsv:
-            if header is None:
-                header=row
-            else:
-                row=[float(x) for x in row]
-                data.append(row)
-    data=np.array(data)
-
+    if len(sys.argv)>1:
+        fname=sys.argv[1]
+    header, data = load(fname)
 
     print('')
 
-    dts = np.diff(data[:, 0])
+    t = data['time']
+    dts = np.diff(t)
 
+    # Traces are min/max decimated to the axis width and re-decimated when zooming
     plt.figure()
-    plt.subplot(2,2,1)
-    plt.plot(data[:, 0], data[:, 1])
-    plt.plot(data[:, 0], data[:, 2])
-    plt.plot(data[:, 0], data[:, 3])
+    ax=plt.subplot(2,2,1)
+    decimate.plot(ax, t, data['g_x'])
+    decimate.plot(ax, t, data['g_y'])
+    decimate.plot(ax, t, data['g_z'])
     plt.ylabel('Gyroscope')
     plt.legend(['x','y','z'])
 
-    plt.subplot(2, 2, 3)
-    plt.plot(data[:, 0], data[:, 4])
-    plt.plot(data[:, 0], data[:, 5])
-    plt.plot(data[:, 0], data[:, 6])
+    ax=plt.subplot(2, 2, 3, sharex=ax)
+    decimate.plot(ax, t, data['a_x'])
+    decimate.plot(ax, t, data['a_y'])
+    decimate.plot(ax, t, data['a_z'])
     plt.xlabel('Time (ms)')
     plt.ylabel('Accelerometer')
     plt.legend(['x', 'y', 'z'])
 
-    plt.subplot(2,2,2)
-    plt.hist(dts,100)
+    ax=plt.subplot(2,2,2)
+    decimate.hist(ax, dts, 100)
     plt.xlabel('DT')
     plt.ylabel('Count')
-    plt.show()
\ No newline at end of file
+    plt.show()
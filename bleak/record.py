@@ -1,29 +1,71 @@
+import argparse
 import asyncio
+import os
+import time
 from bleak import BleakScanner
-from bleak import BleakClient
+from discovery import SENSOR_NAME, connect, startup_logger
 from sensor import RecordingDevice
+from multi import MultiRecorder, print_report
 
 async def main():
 
-    print('Scanning...')
+    # One address on the command line (or none: the last-known address, then the first SENSOR_PRO seen) is
+    # recorded on its own. Several addresses, or --all to scan for every SENSOR_PRO, are recorded together, each
+    # to --out with the address appended. For unattended runs --segment-minutes/--segment-mb rotate the output into
+    # numbered segments listed in a manifest (see rotation.py), and samples are not kept in memory
+    parser = argparse.ArgumentParser(description='Record one or more SENSOR_PROs')
+    parser.add_argument('addresses', nargs='*')
+    parser.add_argument('--all', action='store_true', help='scan for every SENSOR_PRO')
+    parser.add_argument('--out', default='test.tsv', help='output file, .tsv, .bin or .blz')
+    parser.add_argument('--segment-minutes', type=float, default=None, help='start a new segment every N minutes')
+    parser.add_argument('--segment-mb', type=float, default=None, help='start a new segment after M MB')
+    args = parser.parse_args()
+    segment_duration = args.segment_minutes * 60e3 if args.segment_minutes is not None else None
+    segment_bytes = int(args.segment_mb * 1e6) if args.segment_mb is not None else None
+    start = time.perf_counter()
+    addresses = list(args.addresses)
+    if args.all:
+        print('Scanning...')
 
-    address = None
-    devices = await BleakScanner.discover()
-    for d in devices:
-        if d.name == 'SENSOR_PRO':
-            address = d.address
-            print('SENSOR_PRO found: %s' % address)
+        devices = await BleakScanner.discover()
+        for d in devices:
+            if d.name == SENSOR_NAME:
+                addresses.append(d.address)
+                print('SENSOR_PRO found: %s' % d.address)
 
-    if address is None:
+        if not addresses:
+            print('SENSOR_PRO not found')
+            return
+
+    if len(addresses) > 1:
+        recorder = MultiRecorder(addresses, fname_pattern='%s_%%s%s' % os.path.splitext(args.out),
+                                 segment_duration=segment_duration, segment_bytes=segment_bytes, gyro_acc=True,
+                                 temp_press=False, ambient_light=False)
+        try:
+            await recorder.run()
+        finally:
+            print_report(recorder.report())
+        return
+
+    client = await connect(addresses[0] if addresses else None)
+    if client is None:
         print('SENSOR_PRO not found')
-    else:
-        async with BleakClient(address) as client:
-            dev=RecordingDevice(client)
-            await dev.enable(gyro_acc=True, temp_press=False, ambient_light=False)
+        return
+    print('Connected after %.2f s' % (time.perf_counter() - start))
+
+    # Reconnects to the same device if the link drops, the gaps are recorded in the output
+    address = client.address
+    rotate = segment_duration is not None or segment_bytes is not None
+    dev=RecordingDevice(client, reconnect=lambda: connect(address), keep=not rotate)
+    try:
+        await dev.enable(gyro_acc=True, temp_press=False, ambient_light=False)
+        dev.add_listener(startup_logger(start))
 
-            try:
-                await dev.read('test.tsv')
-            finally:
-                await dev.disconnect()
+        try:
+            await dev.read(args.out, segment_duration=segment_duration, segment_bytes=segment_bytes)
+        finally:
+            await dev.disconnect()
+    finally:
+        await dev.client.disconnect()
 
-asyncio.run(main())
\ No newline at end of file
+asyncio.run(main())
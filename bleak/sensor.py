@@ -1,180 +1,687 @@
+import asyncio
 import datetime
+import time
 import numpy as np
-import matplotlib.pyplot as plt
 
-IO_SAMP_CHAR_UUID = "6a80ff0c-b5a3-f393-e0a9-e50e24dcca9e"
+from bleak.exc import BleakError
+
+import shared
+import chunked
+from gatt import CACHE_FILE, SAMPLE_INTERVAL_UUID, decode_rate, discover, encode_rate, resolve
+from packets import PacketLayout
+from profiling import StageProfiler
+from rotation import Segments
+from recording import RecordEncoder, update_header, write_header
+from store import RawArena, SampleStore
+from summary import WindowStats
+from timing import IntervalHistogram
+from writer import AsyncStreamWriter
+
+class LinkLost(Exception):
+    pass
+
 
 class RecordingDevice:
 
-    def __init__(self, client):
+    def __init__(self, client, notify=True, drain_interval=0.05, raw=False, handle_cache=CACHE_FILE, reconnect=None,
+                 backoff=0.5, max_backoff=10.0, poll_rates=None, keep=True):
         self.client = client
+        # GATT handles are resolved once per connection in enable() and shared by all sensors, from
+        # handle_cache when it still matches the device (None to skip the cache)
+        self.handle_cache = handle_cache
+        self.handles = None
+        # With reconnect (a coroutine function returning a new connected client, or None if it failed) read()
+        # survives link loss: it marks the gap in the output, retries with exponential backoff from backoff up to
+        # max_backoff seconds and re-enables the same sensors
+        self.reconnect = reconnect
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.gaps = []
+        self.enable_kwargs = {}
+        self.header = None
+        # In notify mode each sensor decodes pushed payloads into its own buffer and read() drains them,
+        # otherwise read() polls each enabled sensor with read_gatt_char from its own task, at most at
+        # poll_rates[name] Hz (e.g. {'gyro_acc': 100, 'temp_press': 1}). Reads share one bearer, so by default the
+        # IMU is read at the confirmed sampling rate and the slow temperature/pressure and light sensors at 10 Hz
+        # (reading faster than the device samples only repeats payloads under new timestamps). Either way
+        # rows are clocked by the first enabled sensor. In raw mode payloads are only stored and are decoded in
+        # one pass per sensor at disconnect
+        self.notify = notify or raw
+        self.raw = raw
+        self.start_t = None
+        self.received = 0
+        self.first_sample_t = None
+        self.last_sample_t = None
+        self.drain_interval = drain_interval
         self.gyro_acc = GyroAccelSensor(self.client)
         self.temp_press = TempPressureSensor(self.client)
         self.ambient_light = AmbientLightSensor(self.client)
+        self.sensors = [self.gyro_acc, self.temp_press, self.ambient_light]
+        for name, rate in (poll_rates or {}).items():
+            getattr(self, name).poll_rate = rate
         self.data=[]
-        self.t_log=[]
-        self.data_log=[]
+        # rate is the sampling rate the device confirmed, requested_rate the one asked for in enable()
+        self.rate = None
+        self.requested_rate = None
+        self.calibration = None
+        # keep=False only counts samples instead of holding them in self.store, so memory stays constant on long
+        # runs that only need the file, listeners or summarize()
+        self.keep = keep
+        self.store = SampleStore(0)
+        self.writer = None
+        self.listeners = []
+        self.summary = None
+        # Per-stage latency histograms, see profile(). None costs one check per stage in the hot loop
+        self.profiler = None
+        self.running = False
+
+    async def enable(self, gyro_acc=False, temp_press=False, ambient_light=False, rate=100):
+        self.enable_kwargs = {'gyro_acc': gyro_acc, 'temp_press': temp_press, 'ambient_light': ambient_light,
+                              'rate': rate}
+        if self.handles is None:
+            self.handles = await resolve(self.client, self.client.address,
+                                         [sensor.dataUUID for sensor in self.sensors], self.handle_cache)
+            for sensor in self.sensors:
+                sensor.use_handles(self.handles)
 
-    async def enable(self, gyro_acc=False, temp_press=False, ambient_light=False):
-        # Set sampling rate to 100
         print('Setting sampling rate')
-        write_value = b"\x00\x64"
-        value = await self.client.read_gatt_char(IO_SAMP_CHAR_UUID)
-        await self.client.write_gatt_char(IO_SAMP_CHAR_UUID, write_value)
-        value = await self.client.read_gatt_char(IO_SAMP_CHAR_UUID)
-        assert value == write_value
+        if not self.running:
+            self.requested_rate = rate
+        await self.set_rate(rate)
 
         print('Enabling sensors')
         dim=0
         if gyro_acc:
-            await self.gyro_acc.enable()
+            await self.gyro_acc.enable(notify=self.notify, raw=self.raw)
             dim=dim+6
         else:
             await self.gyro_acc.disable()
         if temp_press:
-            await self.temp_press.enable()
+            await self.temp_press.enable(notify=self.notify, raw=self.raw)
             dim=dim+2
         else:
             await self.temp_press.disable()
         if ambient_light:
-            await self.ambient_light.enable()
+            await self.ambient_light.enable(notify=self.notify, raw=self.raw)
             dim=dim+1
         else:
             await self.ambient_light.disable()
-        self.data=np.zeros((1,dim))
-        self.data_log=[]#np.zeros((self.n,dim))
-
-    async def read(self, fname=None):
+        # Re-enabling after a reconnect keeps the samples recorded so far
+        if not self.running:
+            # NaN until each sensor has reported, rows are only emitted from then on (see drain())
+            self.data=np.full((1,dim), np.nan)
+            self.store = SampleStore(dim, keep=self.keep)
+
+    async def set_rate(self, rate):
+        # Writes the sampling rate and reads it back, the device may settle on a different one
+        handle = self.handles[SAMPLE_INTERVAL_UUID]['value']
+        await self.client.write_gatt_char(handle, encode_rate(rate), response=True)
+        self.rate = decode_rate(await self.client.read_gatt_char(handle))
+        if self.rate != int(round(rate)):
+            print('Device set sampling rate to %d Hz instead of %d Hz' % (self.rate, rate))
+        return self.rate
+
+    async def calibrate(self, duration=2.0, step_down=True, step=0.8, min_rate=10, max_dropped=0.01):
+        # Measures the rate actually delivered over a short capture that is not kept. With step_down the rate is
+        # lowered by step until at most max_dropped of the expected samples go missing or min_rate is reached
+        steps = []
+        while True:
+            capture = asyncio.ensure_future(self.read())
+            await asyncio.sleep(duration)
+            self.stop()
+            await capture
+            if self.raw:
+                await self.flush_raw()
+            stats = self.stats()
+            dropped = stats['dropped'] / max(stats['samples'] + stats['dropped'], 1)
+            steps.append({'rate': self.rate, 'achieved_rate': stats['rate'], 'dropped': dropped})
+            self.reset()
+            if not step_down or dropped <= max_dropped or self.rate <= min_rate:
+                break
+            await self.set_rate(max(min_rate, int(self.rate * step)))
+        print('Sampling at %d Hz, %.1f Hz delivered' % (self.rate, steps[-1]['achieved_rate']))
+        self.enable_kwargs['rate'] = self.rate
+        self.calibration = steps
+        return steps[-1]
+
+    def reset(self):
+        # Forgets everything captured so far, e.g. during calibration
+        self.store.clear()
+        self.received = 0
+        self.first_sample_t = None
+        self.last_sample_t = None
+        self.gaps = []
+        for sensor in self.sensors:
+            sensor.jitter = IntervalHistogram()
+            sensor.jitter_n = 0
+            sensor.malformed = 0
+            if sensor.buffer is not None:
+                sensor.buffer.drain()
+            if sensor.arena is not None:
+                sensor.arena.clear()
+
+    async def read(self, fname=None, start_t=None, segment_duration=None, segment_bytes=None):
         print('Recording data')
+        # Samples are timestamped with time.perf_counter_ns() relative to start_t, which several devices can share,
+        # and start_wall_t is the wall-clock anchor written to the file header (a '# start_time' line in TSV).
+        # With segment_duration (ms) or segment_bytes the file is rotated into numbered segments with a manifest,
+        # see rotation.py. keep=False then keeps memory bounded on unattended runs of any length
+        self.start_wall_t = time.time()
+        self.start_t = start_t if start_t is not None else time.perf_counter_ns()
+        self.resumed_t = self.start_t
+        self.running = True
+        self.header = None
         if fname is not None:
-            self.log_file=open(fname, 'w')
-            self.log_file.write('time')
-            if self.gyro_acc.enabled:
-                self.log_file.write('\tg_x\tg_y\tg_z\ta_x\ta_y\ta_z')
-            if self.temp_press.enabled:
-                self.log_file.write('\tt\tp')
-            if self.ambient_light.enabled:
-                self.log_file.write('\tl')
-            self.log_file.write('\n')
-
-        start_t = datetime.datetime.now()
-        #last_t=start_t
+            if segment_duration is None and segment_bytes is None:
+                log_file, encode = self.open_log(fname)
+                self.writer = AsyncStreamWriter(log_file, self.data.shape[1], encode=encode)
+            else:
+                segments = Segments(fname, self.open_log, segment_duration, segment_bytes, self.write_metadata,
+                                    channels=self.channels(), rate=self.rate, requested_rate=self.requested_rate,
+                                    start_time=self.start_wall_t)
+                self.writer = AsyncStreamWriter(None, self.data.shape[1], segments=segments)
+            self.writer.start()
+
         while True:
-            idx=0
-            if self.gyro_acc.enabled:
-                (gyro, accel) = await self.gyro_acc.read()
-                self.data[0,idx:idx+3]=gyro
-                self.data[0,idx+3:idx+6]=accel
-                idx=idx+6
-            if self.temp_press.enabled:
-                (temp, press) = await self.temp_press.read()
-                self.data[0,idx+6]=temp
-                self.data[0,idx+7]=press
-                idx=idx+2
-            if self.ambient_light.enabled:
-                amb_light = await self.ambient_light.read()
-                self.data[0,idx]=amb_light
-            t=datetime.datetime.now()
-            #dt=(t-last_t).total_seconds()*1000.0
-            #print('%.2f' % dt)
-            #last_t=t
-            #print('%.2f:' % ((t - start_t).total_seconds() * 1000.0))
-            #print(self.data)
-            self.t_log.append((t - start_t).total_seconds() * 1000.0)
-            self.data_log.append(np.copy(self.data))
-        # plt.figure()
-        # plt.hist(self.dts, 100)
-        # plt.show()
+            try:
+                await self.acquire()
+                break
+            except (LinkLost, BleakError):
+                if self.reconnect is None:
+                    raise
+                await self.recover()
+
+    async def acquire(self):
+        if self.raw:
+            while self.running:
+                await asyncio.sleep(self.drain_interval)
+                self.check_link()
+
+        elif self.notify:
+            while self.running:
+                await asyncio.sleep(self.drain_interval)
+                self.check_link()
+                await self.publish(*self.drain())
+            await self.publish(*self.drain())
+
+        else:
+            tasks = [asyncio.ensure_future(self.poll(sensor)) for sensor in self.enabled_sensors()]
+            try:
+                while self.running:
+                    await asyncio.sleep(self.drain_interval)
+                    for task in tasks:
+                        if task.done():
+                            task.result()
+                    await self.publish(*self.drain())
+                await self.publish(*self.drain())
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def poll(self, sensor):
+        # Reads one sensor on a fixed schedule at sensor.poll_rate, or at the confirmed sampling rate if it has
+        # none, into its buffer. Falling behind restarts the schedule rather than bursting to catch up
+        next_t = time.perf_counter_ns()
+        while self.running:
+            # the rate can change while running, e.g. in calibrate()
+            rate = sensor.poll_rate or self.rate
+            period = int(1e9 / rate) if rate else 0
+            await sensor.read()
+            t = time.perf_counter_ns()
+            sensor.fill(sensor.buffer.next_row(t))
+            if self.profiler is not None:
+                self.profiler.lap('fill', t, sensor.name)
+            if period:
+                next_t += period
+                delay = next_t - time.perf_counter_ns()
+                if delay > 0:
+                    await asyncio.sleep(delay / 1e9)
+                else:
+                    next_t = time.perf_counter_ns()
+
+    def check_link(self):
+        # Notifications just stop when the link drops, so the notify loops poll the connection state
+        if not self.client.is_connected:
+            raise LinkLost()
+
+    def open_log(self, fname, segment=None):
+        # Opens fname in the format its extension selects and writes its header, returns the file and the
+        # writer's encode step
+        channels = self.channels()
+        fields = {} if segment is None else {'segment': segment}
+        if fname.endswith('.bin'):
+            self.log_file=open(fname, 'wb')
+            self.header = write_header(self.log_file, channels, rate=self.rate, start_time=self.start_wall_t,
+                                       requested_rate=self.requested_rate, reserve=4096, **fields)
+            encode = RecordEncoder(channels)
+        elif fname.endswith(chunked.EXT):
+            # compressed chunks with a time index, see chunked.py
+            self.log_file=open(fname, 'wb')
+            self.header = chunked.write_header(self.log_file, channels, rate=self.rate, start_time=self.start_wall_t,
+                                               requested_rate=self.requested_rate, reserve=4096, **fields)
+            encode = chunked.ChunkEncoder(self.header)
+        else:
+            self.log_file=open(fname, 'w')
+            self.log_file.write('\t'.join(['time'] + channels) + '\n')
+            self.log_file.write('# start_time\t%.6f\n' % self.start_wall_t)
+            encode = None
+        return self.log_file, encode
+
+    async def recover(self):
+        # Keeps what was received before the link dropped, marks the gap with a row of NaNs from the last sample
+        # received, then reconnects and re-enables the same sensors at the same rate
+        print('Link lost, reconnecting...')
+        if self.raw:
+            await self.flush_raw()
+        else:
+            await self.publish(*self.drain())
+        lost_t = time.perf_counter_ns()
+        if self.last_sample_t is not None:
+            lost_t = int(max(self.last_sample_t, self.resumed_t))
+        await self.mark_gap(lost_t)
+        try:
+            await self.client.disconnect()
+        except (BleakError, asyncio.TimeoutError, OSError):
+            pass
+        delay = self.backoff
+        attempts = 0
+        client = None
+        while self.running and client is None:
+            attempts += 1
+            try:
+                client = await self.reconnect()
+            except (BleakError, asyncio.TimeoutError, OSError):
+                client = None
+            if client is None:
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, self.max_backoff)
+        if client is not None:
+            self.client = client
+            for sensor in self.sensors:
+                sensor.client = client
+                sensor.handle = None
+                sensor.notifying = False
+            self.handles = None
+            await self.enable(**self.enable_kwargs)
+        restored_t = time.perf_counter_ns()
+        self.resumed_t = restored_t
+        self.gaps.append({'lost': (lost_t - self.start_t) / 1e6, 'restored': (restored_t - self.start_t) / 1e6,
+                          'attempts': attempts})
+        if client is not None:
+            print('Reconnected after %.2f s, %d attempts' % ((restored_t - lost_t) / 1e9, attempts))
+
+    async def mark_gap(self, t):
+        t = np.array([(t - self.start_t) / 1e6])
+        block = np.full((1, self.data.shape[1]), np.nan)
+        self.store.extend(t, block)
+        if self.writer is not None:
+            await self.writer.extend(t, block)
+
+    def downtime(self):
+        # Gap statistics of a supervised recording, durations in seconds
+        durations = [(gap['restored'] - gap['lost']) / 1e3 for gap in self.gaps]
+        return {'gaps': len(self.gaps), 'downtime': sum(durations), 'longest_gap': max(durations, default=0.0),
+                'reconnect_attempts': sum(gap['attempts'] for gap in self.gaps)}
+
+    def write_metadata(self, f):
+        # Requested, confirmed and achieved sampling rates and, if the link dropped, the gap list and downtime go
+        # in the reserved header space of binary files and in trailing '#' comment lines of TSV files
+        fields = {'requested_rate': self.requested_rate, 'rate': self.rate, 'achieved_rate': self.stats()['rate']}
+        if self.gaps:
+            fields.update(self.downtime())
+        if self.header is not None:
+            if not update_header(f, self.header, calibration=self.calibration, gap_list=self.gaps, **fields):
+                update_header(f, self.header, **fields)
+            return
+        f.write('# rate\t%d\t%d\t%.2f\n' % (fields['requested_rate'], fields['rate'], fields['achieved_rate']))
+        if self.gaps:
+            summary = self.downtime()
+            for gap in self.gaps:
+                f.write('# gap\t%.2f\t%.2f\t%d\n' % (gap['lost'], gap['restored'], gap['attempts']))
+            f.write('# downtime\t%.3f\t%d\t%.3f\t%d\n' % (summary['downtime'], summary['gaps'],
+                                                          summary['longest_gap'], summary['reconnect_attempts']))
+
+    async def publish(self, t, block):
+        if self.profiler is not None:
+            lap = time.perf_counter_ns()
+        if self.writer is not None:
+            await self.writer.extend(t, block)
+            if self.profiler is not None:
+                lap = self.profiler.lap('write', lap)
+        for listener in self.listeners:
+            listener(t, block)
+        if self.profiler is not None and self.listeners:
+            self.profiler.lap('listeners', lap)
+
+    def add_listener(self, listener):
+        # listener(t, block) is called with every batch of new rows (times in ms, one row per sample)
+        self.listeners.append(listener)
+
+    def summarize(self, window=1000.0, step=None, callback=None, fname=None):
+        # Per-channel count/mean/std/min/max/RMS over tumbling windows of window ms and a window sliding by step ms,
+        # see summary.WindowStats. Call after enable(), the open window is emitted at disconnect
+        self.summary = WindowStats(self.channels(), window=window, step=step, callback=callback, fname=fname)
+        self.add_listener(self.summary.update)
+        return self.summary
+
+    def profile(self, fname=None, interval=10.0, format=None):
+        # Latency histograms of each stage of read() per sensor: the read_gatt_char round trip including event
+        # loop scheduling ('read'), payload decoding ('decode'), copying into the sensor buffer ('fill'), merging
+        # the buffers into the sample store ('drain'), the file writer ('write') and listeners ('listeners'). With
+        # fname they are written every interval s and at disconnect, see profiling.StageProfiler
+        self.profiler = StageProfiler()
+        for sensor in self.sensors:
+            sensor.profiler = self.profiler
+        if fname is not None:
+            self.profiler.start(fname, interval, format)
+        return self.profiler
+
+    def stop(self):
+        self.running = False
+
+    def enabled_sensors(self):
+        return [sensor for sensor in self.sensors if sensor.enabled]
+
+    def channels(self):
+        return [column for sensor in self.enabled_sensors() for column in sensor.columns]
+
+    def drain(self):
+        # The first enabled sensor clocks the output rows, the other sensors hold their latest value received at
+        # or before each row. Rows from before every sensor has reported once are held back rather than filled with
+        # readings that were never taken
+        sensors = self.enabled_sensors()
+        if not sensors:
+            return np.empty(0), self.data[:0]
+        if self.profiler is not None:
+            lap = time.perf_counter_ns()
+        drained = [sensor.buffer.drain() for sensor in sensors]
+        t = drained[0][0]
+        block = np.empty((len(t), self.data.shape[1]))
+        idx=0
+        for sensor, (sensor_t, values) in zip(sensors, drained):
+            sensor.jitter.add(sensor_t)
+            if sensor is sensors[0]:
+                block[:, idx:idx+sensor.dim] = values
+            else:
+                pos = np.searchsorted(sensor_t, t, side='right') - 1
+                block[:, idx:idx+sensor.dim] = self.data[0, idx:idx+sensor.dim]
+                block[pos >= 0, idx:idx+sensor.dim] = values[pos[pos >= 0]]
+            if len(sensor_t):
+                self.data[0, idx:idx+sensor.dim] = values[-1]
+            idx=idx+sensor.dim
+        if len(t) and np.isnan(block[0]).any():
+            reported = ~np.isnan(block).any(axis=1)
+            t = t[reported]
+            block = block[reported]
+        self.count_samples(t)
+        t = (t - self.start_t) / 1e6
+        self.store.extend(t, block)
+        if self.profiler is not None:
+            self.profiler.lap('drain', lap)
+        return t, block
+
+    def decode_raw(self):
+        # One vectorized decode per sensor arena, rows are clocked by the first enabled sensor and the other
+        # sensors contribute the latest payload received at or before each row. As in drain(), rows from before
+        # every sensor has reported once are held back
+        sensors = self.enabled_sensors()
+        if not sensors:
+            return np.empty(0), self.data[:0]
+        self.update_jitter()
+        decoded = [sensor.decode_batch() for sensor in sensors]
+        t = decoded[0][0]
+        block = np.empty((len(t), self.data.shape[1]))
+        idx=0
+        for sensor, (sensor_t, values) in zip(sensors, decoded):
+            if sensor is sensors[0]:
+                block[:, idx:idx+sensor.dim] = values
+            else:
+                pos = np.searchsorted(sensor_t, t, side='right') - 1
+                block[:, idx:idx+sensor.dim] = self.data[0, idx:idx+sensor.dim]
+                block[pos >= 0, idx:idx+sensor.dim] = values[pos[pos >= 0]]
+            if len(sensor_t):
+                self.data[0, idx:idx+sensor.dim] = values[-1]
+            idx=idx+sensor.dim
+        if len(t) and np.isnan(block[0]).any():
+            reported = ~np.isnan(block).any(axis=1)
+            t = t[reported]
+            block = block[reported]
+        self.count_samples(t)
+        start_t = self.start_t
+        if start_t is None:
+            start_t = t[0] if len(t) else 0.0
+        return (t - start_t) / 1e6, block
+
+    def update_jitter(self):
+        # Raw arenas are only timestamped during capture, their intervals are added here on demand
+        if self.raw:
+            for sensor in self.enabled_sensors():
+                sensor.jitter.add(sensor.arena.t[sensor.jitter_n:len(sensor.arena)])
+                sensor.jitter_n = len(sensor.arena)
+
+    def jitter(self):
+        # Inter-sample interval statistics (ms) per enabled sensor, available while recording
+        self.update_jitter()
+        return {type(sensor).__name__: sensor.jitter.summary() for sensor in self.sensors
+                if sensor.enabled or sensor.jitter.n}
+
+    def count_samples(self, t):
+        if len(t):
+            if self.first_sample_t is None:
+                self.first_sample_t = t[0]
+            self.last_sample_t = t[-1]
+            self.received += len(t)
+
+    def stats(self):
+        # Drops are estimated from how many samples the configured rate should have produced between the
+        # first and last received sample, which is robust to notifications arriving in bursts. Time spent
+        # reconnecting is not counted as dropped samples
+        if self.received < 2:
+            return {'samples': self.received, 'rate': 0.0, 'dropped': 0, 'malformed': self.malformed()}
+        duration = float(self.last_sample_t - self.first_sample_t) / 1e9
+        downtime = self.downtime()
+        expected = int(round((duration - downtime['downtime']) * self.rate)) + 1
+        return {'samples': self.received, 'duration': duration, 'rate': (self.received - 1) / duration,
+                'dropped': max(0, expected - self.received), 'gaps': downtime['gaps'],
+                'downtime': downtime['downtime'], 'malformed': self.malformed()}
+
+    def malformed(self):
+        # Notifications too short for their sensor's layout, dropped on arrival
+        return sum(sensor.malformed for sensor in self.sensors)
+
+    async def flush_raw(self):
+        if self.profiler is not None:
+            lap = time.perf_counter_ns()
+        t, block = self.decode_raw()
+        if self.profiler is not None:
+            lap = self.profiler.lap('decode_raw', lap)
+        self.store.extend(t, block)
+        if self.profiler is not None:
+            lap = self.profiler.lap('store', lap)
+        if self.writer is not None:
+            await self.writer.extend(t, block)
+            if self.profiler is not None:
+                self.profiler.lap('write', lap)
+        for sensor in self.enabled_sensors():
+            sensor.arena.clear()
+            sensor.jitter_n = 0
 
     async def disconnect(self):
 
-        for t,row in zip(self.t_log, self.data_log):
-            self.log_file.write('%.2f' % t)
-            idx=0
-            if self.gyro_acc.enabled:
-                self.log_file.write('\t%.3f\t%.3f\t%.3f\t%.3f\t%.3f\t%.3f' % (row[0,idx],row[0,idx+1],row[0,idx+2],row[0,idx+3],row[0,idx+4],row[0,idx+5]))
-                idx=idx+6
-            if self.temp_press.enabled:
-                self.log_file.write('\t%.3f\t%.3f' % (row[0, idx], row[0, idx + 1]))
-                idx=idx+2
-            if self.ambient_light.enabled:
-                self.log_file.write('\t%.3f' % (row[0, idx]))
-            self.log_file.write('\n')
-        self.log_file.close()
-        if self.gyro_acc is not None:
-            await self.gyro_acc.disable()
-        if self.temp_press is not None:
-            await self.temp_press.disable()
-        if self.ambient_light is not None:
-            await self.ambient_light.disable()
+        if self.raw:
+            await self.flush_raw()
+        if self.writer is not None:
+            await self.writer.close(finish=self.write_metadata)
+            self.writer = None
+        if self.summary is not None:
+            self.summary.close()
+        if self.profiler is not None:
+            self.profiler.stop()
+        try:
+            if self.gyro_acc is not None:
+                await self.gyro_acc.disable()
+            if self.temp_press is not None:
+                await self.temp_press.disable()
+            if self.ambient_light is not None:
+                await self.ambient_light.disable()
+        except BleakError:
+            # the link was already lost, e.g. stopped while reconnecting
+            pass
+
+
+class SampleBuffer:
+
+    def __init__(self, dim, size=1024):
+        self.t = np.zeros(size, dtype=np.int64)
+        self.values = np.zeros((size, dim))
+        self.n = 0
+
+    def next_row(self, t):
+        if self.n == len(self.t):
+            self.t = np.resize(self.t, 2 * len(self.t))
+            self.values = np.resize(self.values, (2 * len(self.values), self.values.shape[1]))
+        self.t[self.n] = t
+        self.n += 1
+        return self.values[self.n - 1]
+
+    def drain(self):
+        t = self.t[:self.n].copy()
+        values = self.values[:self.n].copy()
+        self.n = 0
+        return t, values
 
 
 class SensorBase:
+    dim = 0
+    columns = []
+    layout = None
+    min_size = None
+    poll_rate = None
+
     def __init__(self, client, svcUUID, dataUUID):
         self.client = client
         self.svcUUID = svcUUID
         self.dataUUID = dataUUID
-        self.service = None
-        self.data = None
+        self.handle = None
+        self.cccd = None
         self.data_bytes = None
         self.last_data_bytes = None
         self.last_t = datetime.datetime.now()
+        self.values = np.zeros((1, self.dim))
+        self.buffer = None
+        self.notify = False
+        # whether start_notify was called on the current client, so disable() only stops subscriptions it made
+        self.notifying = False
+        self.arena = None
+        self.jitter = IntervalHistogram()
+        self.jitter_n = 0
+        # shorter payloads cannot be decoded and are only counted in malformed, see collect_data()
+        if self.min_size is None:
+            self.min_size = self.layout.size
+        self.malformed = 0
+        self.name = type(self).__name__
+        self.profiler = None
         self.enabled=False
 
-    async def enable(self):
-        if self.service is None:
-            svcs = await self.client.get_services()
-            for service in svcs:
-                if service.uuid==self.svcUUID:
-                    self.service=service
-        if self.service is not None and self.data is None:
-            for characteristic in self.service.characteristics:
-                if characteristic.uuid==self.dataUUID:
-                    self.data=characteristic
-        if self.data is not None:
-            async def collect_data(sender, data):
-                pass
-            await self.client.start_notify(self.dataUUID, collect_data)
+    async def enable(self, notify=False, raw=False):
+        if self.handle is None:
+            self.use_handles(discover(await self.client.get_services(), self.svcUUID, [self.dataUUID]))
+        # Polled sensors also buffer their rows, without subscribing: notifications would compete with the reads
+        self.notify = notify
+        if raw:
+            self.arena = self.new_arena()
+        else:
+            self.buffer = SampleBuffer(self.dim)
+        if self.handle is not None and notify:
+            await self.client.start_notify(self.handle, self.collect_data)
+            self.notifying = True
         self.enabled=True
 
-
+    def use_handles(self, handles):
+        if self.dataUUID in handles:
+            self.handle = handles[self.dataUUID]['value']
+            self.cccd = handles[self.dataUUID]['cccd']
+
+    def collect_data(self, sender, data):
+        # An exception here would only be logged by the event loop, malformed payloads are counted and dropped
+        if len(data) < self.min_size:
+            self.malformed += 1
+            return
+        if self.arena is not None:
+            self.arena.append(time.perf_counter_ns(), data)
+        elif self.buffer is not None and self.notify:
+            t = time.perf_counter_ns()
+            self.decode_into(data, self.buffer.next_row(t))
+            if self.profiler is not None:
+                self.profiler.lap('decode', t, self.name)
 
     async def read(self):
-        self.data_bytes = await self.client.read_gatt_char(self.data)
+        if self.profiler is None:
+            self.data_bytes = await self.client.read_gatt_char(self.handle)
+            return self.decode(self.data_bytes)
+        lap = time.perf_counter_ns()
+        self.data_bytes = await self.client.read_gatt_char(self.handle)
+        lap = self.profiler.lap('read', lap, self.name)
+        values = self.decode(self.data_bytes)
+        self.profiler.lap('decode', lap, self.name)
+        return values
+
+    def decode(self, data):
+        self.data_bytes = data
+        self.decode_into(data, self.values[0])
+
+    def decode_into(self, data, row):
+        self.layout.decode_into(data, row)
+
+    def fill(self, row):
+        row[:] = self.values[0]
+
+    def new_arena(self):
+        # Payloads are decoded field by field from their start, shorter ones cannot be
+        return RawArena(min_size=self.min_size)
+
+    def decode_batch(self):
+        return self.arena.t[:len(self.arena)], self.layout.decode_batch(self.arena.payloads(), self.arena.record_size)
 
     async def disable(self):
-        if self.data is not None:
-            await self.client.stop_notify(self.data)
+        if self.notifying:
+            self.notifying = False
+            await self.client.stop_notify(self.handle)
+        self.buffer = None
         self.enabled=False
 
 
 class GyroAccelSensor(SensorBase):
+    dim = 6
+    columns = ['g_x', 'g_y', 'g_z', 'a_x', 'a_y', 'a_z']
     gyro_scale = 250.0 / 32768.0
     acc_scale_2_g = 2.0 / 32768.0
+    # Acceleration in bytes 0-6, gyro in bytes 6-12, big-endian int16
+    layout = PacketLayout([('a_x', 'h', acc_scale_2_g, None), ('a_y', 'h', acc_scale_2_g, None),
+                           ('a_z', 'h', acc_scale_2_g, None), ('g_x', 'h', gyro_scale, None),
+                           ('g_y', 'h', gyro_scale, None), ('g_z', 'h', gyro_scale, None)], columns)
 
     def __init__(self, client):
         SensorBase.__init__(self, client, '6a800001-b5a3-f393-e0a9-e50e24dcca9e',
                             '6a806050-b5a3-f393-e0a9-e50e24dcca9e')
-        self.gyro = np.zeros((1, 3))
-        self.accel = np.zeros((1, 3))
-
-    async def read(self):
-        await SensorBase.read(self)
-
-        # Compute gyro
-        for idx, iter in enumerate(range(6, 12, 2)):
-            self.gyro[0, idx] = int.from_bytes(self.data_bytes[iter:iter + 2], byteorder='big', signed=True) * self.gyro_scale
-
-        # Compute acceleraton
-        for idx, iter in enumerate(range(0, 6, 2)):
-            self.accel[0, idx] = int.from_bytes(self.data_bytes[iter:iter + 2], byteorder='big', signed=True) * self.acc_scale_2_g
+        self.gyro = self.values[:, 0:3]
+        self.accel = self.values[:, 3:6]
 
+    def decode(self, data):
+        SensorBase.decode(self, data)
         return self.gyro, self.accel
 
 
 
 class AmbientLightSensor(SensorBase):
+    dim = 1
+    columns = ['l']
     light_scale = 0.35
+    layout = PacketLayout([('l', 'H', light_scale, None)], columns)
+    # any length holds the whole value, only an empty payload has none
+    min_size = 1
+    poll_rate = 10
 
     def __init__(self, client):
         SensorBase.__init__(self, client, '6a800001-b5a3-f393-e0a9-e50e24dcca9e',
@@ -182,19 +689,41 @@ class AmbientLightSensor(SensorBase):
 
         self.light=0
 
-    async def read(self):
-        await SensorBase.read(self)
+    def decode(self, data):
+        SensorBase.decode(self, data)
+        self.light = self.values[0, 0]
+        return self.light
 
-        self.light = int.from_bytes(self.data_bytes, byteorder='big', signed=False) * self.light_scale
+    def decode_into(self, data, row):
+        # The whole payload is one unsigned value, only the usual 2 byte payload goes through the struct
+        if len(data) == self.layout.size:
+            self.layout.decode_into(data, row)
+        else:
+            row[0] = int.from_bytes(data, byteorder='big', signed=False) * self.light_scale
 
-        return self.light
+    def new_arena(self):
+        return RawArena(align='right', min_size=self.min_size)
+
+    def decode_batch(self):
+        if self.arena.record_size in (None, self.layout.size):
+            return SensorBase.decode_batch(self)
+        raw = np.frombuffer(self.arena.payloads(), dtype=np.uint8).reshape(-1, self.arena.record_size)
+        value = np.zeros(len(raw), dtype=np.uint64)
+        for col in range(raw.shape[1]):
+            value = value * 256 + raw[:, col]
+        return self.arena.t[:len(self.arena)], (value.astype(np.float64) * self.light_scale)[:, np.newaxis]
 
 
 class TempPressureSensor(SensorBase):
+    dim = 2
+    columns = ['t', 'p']
     sensorOn = b"\x01\x01"
     sensorOff = b"\x00\x00"
+    poll_rate = 10
     temp_scale=1/5120
     pressure_scale=1
+    # Temperature is the unsigned 24 bit value in bytes 1-4, pressure the unsigned 32 bit value in bytes 4-8
+    layout = PacketLayout([('t', 'I', temp_scale, 0xFFFFFF), ('p', 'I', pressure_scale, None)], columns)
 
     def __init__(self, client):
         SensorBase.__init__(self, client, '6a800001-b5a3-f393-e0a9-e50e24dcca9e',
@@ -202,11 +731,8 @@ class TempPressureSensor(SensorBase):
         self.temp=0
         self.pressure=0
 
-    async def read(self):
-        await SensorBase.read(self)
-
-        self.temp = int.from_bytes(self.data_bytes[1:4], byteorder='big', signed=False) * self.temp_scale
-
-        self.pressure=int.from_bytes(self.data_bytes[4:8], byteorder='big', signed=False)*self.pressure_scale
-
+    def decode(self, data):
+        SensorBase.decode(self, data)
+        self.temp, self.pressure = self.values[0]
         return self.temp, self.pressure
+
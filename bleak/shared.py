@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The modules that do not depend on the BLE library (store, writer, recording, loader, summary, ...) live in the
+# parent directory and are shared with the bluepy scripts. Importing this first makes them importable from the
+# bleak scripts, whose own sensor, fake, gatt and discovery modules still come first on the path.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
@@ -0,0 +1,207 @@
+import lzma
+import os
+import struct
+import sys
+import time
+import zlib
+import numpy as np
+
+from recording import read_header, record_dtype, write_header as write_recording_header
+
+# Chunked compressed recordings (.blz): the header of recording.py under its own magic, then one chunk per
+# chunk_duration ms of samples and an index of the chunks at the end. A chunk holds the timestamps as
+# microsecond deltas and every channel as deltas of its raw sensor integer (value / scale, as decoded by the
+# sensor classes), compressed on its own with zlib or lzma, so reading a time window only reads and decompresses
+# the chunks it overlaps. NaNs (gap markers) are kept as a list of positions, channels without a known scale as
+# float64. Every chunk starts with its own small header, so the index can be rebuilt if the file was not closed.
+
+MAGIC = b'BLESENZ1'
+EXT = '.blz'
+SCALES = {'g_x': 250.0 / 32768.0, 'g_y': 250.0 / 32768.0, 'g_z': 250.0 / 32768.0,
+          'a_x': 2.0 / 32768.0, 'a_y': 2.0 / 32768.0, 'a_z': 2.0 / 32768.0,
+          't': 1 / 5120, 'p': 1, 'l': 0.35}
+# Deltas wrap around in the raw integer width, which decoding undoes exactly
+RAW_DTYPES = {'g_x': '<i2', 'g_y': '<i2', 'g_z': '<i2', 'a_x': '<i2', 'a_y': '<i2', 'a_z': '<i2',
+              't': '<i4', 'p': '<i4', 'l': '<i4'}
+CODECS = {'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+          'lzma': (lambda data: lzma.compress(data, preset=6), lzma.decompress)}
+# first and last time (ms), rows, NaNs, compressed size
+CHUNK = struct.Struct('<ddIII')
+INDEX_DTYPE = np.dtype([('t0', '<f8'), ('t1', '<f8'), ('offset', '<u8'), ('n', '<u4'), ('nans', '<u4'),
+                        ('size', '<u4')])
+# index offset, chunks, magic
+FOOTER = struct.Struct('<QI8s')
+
+
+def is_chunked(fname):
+    with open(fname, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_header(f, channels, chunk_duration=60000.0, codec='zlib', **fields):
+    if codec not in CODECS:
+        raise ValueError('Unknown codec: %r' % codec)
+    return write_recording_header(f, channels, value_dtype='<f8', magic=MAGIC, chunk_duration=chunk_duration,
+                                  codec=codec, scales=[SCALES.get(name) for name in channels],
+                                  raw_dtypes=[RAW_DTYPES.get(name, '<f8') for name in channels], **fields)
+
+
+def encode_chunk(t, values, header):
+    t0 = float(np.nanmin(t))
+    ticks = np.round((t - t0) * 1e3).astype(np.int64)
+    parts = [np.diff(ticks, prepend=0).astype('<i8').tobytes()]
+    nans = np.flatnonzero(np.isnan(values))
+    for idx, (scale, dtype) in enumerate(zip(header['scales'], header['raw_dtypes'])):
+        column = values[:, idx]
+        if scale is None:
+            parts.append(column.astype('<f8').tobytes())
+            continue
+        raw = np.round(np.nan_to_num(column) / scale).astype(np.int64).astype(dtype)
+        parts.append(np.diff(raw, prepend=raw.dtype.type(0)).tobytes())
+    parts.append(nans.astype('<u4').tobytes())
+    data = CODECS[header['codec']][0](b''.join(parts))
+    return CHUNK.pack(t0, float(np.nanmax(t)), len(t), len(nans), len(data)) + data
+
+
+def decode_chunk(data, entry, header):
+    data = CODECS[header['codec']][1](data)
+    n = int(entry['n'])
+    records = np.empty(n, dtype=record_dtype(header['channels'], '<f8'))
+    pos = 8 * n
+    records['time'] = entry['t0'] + np.cumsum(np.frombuffer(data, '<i8', n)) / 1e3
+    for name, scale, dtype in zip(header['channels'], header['scales'], header['raw_dtypes']):
+        dtype = np.dtype(dtype)
+        column = np.frombuffer(data, dtype, n, pos)
+        pos += dtype.itemsize * n
+        records[name] = column if scale is None else np.cumsum(column, dtype=dtype) * scale
+    nans = np.frombuffer(data, '<u4', int(entry['nans']), pos)
+    if len(nans):
+        rows, cols = np.divmod(nans, len(header['channels']))
+        for col in np.unique(cols):
+            records[header['channels'][col]][rows[cols == col]] = np.nan
+    return records
+
+
+class ChunkEncoder:
+    # StreamWriter encode step for .blz files: buffers batches and returns each chunk's bytes once
+    # chunk_duration ms of samples have come in, close() returns the last chunk and the index
+
+    def __init__(self, header):
+        self.header = header
+        self.duration = header['chunk_duration']
+        self.offset = header['offset']
+        self.index = []
+        self.pending_t = []
+        self.pending_values = []
+        self.start_t = None
+
+    def __call__(self, t, values):
+        out = []
+        while len(t):
+            if self.start_t is None:
+                self.start_t = t[0]
+            cut = int(np.searchsorted(t, self.start_t + self.duration))
+            self.pending_t.append(t[:cut])
+            self.pending_values.append(values[:cut])
+            if cut == len(t):
+                break
+            out.append(self.flush())
+            t, values = t[cut:], values[cut:]
+        return b''.join(out)
+
+    def flush(self):
+        t = np.concatenate(self.pending_t)
+        values = np.concatenate(self.pending_values)
+        self.pending_t = []
+        self.pending_values = []
+        self.start_t = None
+        if not len(t):
+            return b''
+        chunk = encode_chunk(t, values, self.header)
+        t0, t1, n, nans, size = CHUNK.unpack_from(chunk)
+        self.index.append((t0, t1, self.offset + CHUNK.size, n, nans, size))
+        self.offset += len(chunk)
+        return chunk
+
+    def close(self):
+        chunk = self.flush() if self.pending_t else b''
+        index = np.array(self.index, dtype=INDEX_DTYPE)
+        return chunk + index.tobytes() + FOOTER.pack(self.offset, len(index), MAGIC)
+
+
+def read_index(f, header):
+    f.seek(0, 2)
+    size = f.tell()
+    if size >= header['offset'] + FOOTER.size:
+        f.seek(size - FOOTER.size)
+        offset, count, magic = FOOTER.unpack(f.read(FOOTER.size))
+        if magic == MAGIC:
+            f.seek(offset)
+            return np.frombuffer(f.read(count * INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)
+    # not closed properly: walk the chunk headers, a truncated last chunk is ignored
+    index = []
+    offset = header['offset']
+    while offset + CHUNK.size <= size:
+        f.seek(offset)
+        t0, t1, n, nans, length = CHUNK.unpack(f.read(CHUNK.size))
+        if offset + CHUNK.size + length > size:
+            break
+        index.append((t0, t1, offset + CHUNK.size, n, nans, length))
+        offset += CHUNK.size + length
+    return np.array(index, dtype=INDEX_DTYPE)
+
+
+def load(fname, t0=None, t1=None):
+    # (header, records) like loader.load(), limited to samples with t0 <= time <= t1 (ms, None for open ends).
+    # Only the chunks overlapping the window are read and decompressed
+    with open(fname, 'rb') as f:
+        header = read_header(f, MAGIC)
+        index = read_index(f, header)
+        select = np.ones(len(index), dtype=bool)
+        if t0 is not None:
+            select &= index['t1'] >= t0
+        if t1 is not None:
+            select &= index['t0'] <= t1
+        chunks = []
+        for entry in index[select]:
+            f.seek(int(entry['offset']))
+            chunks.append(decode_chunk(f.read(int(entry['size'])), entry, header))
+    if not chunks:
+        return header, np.empty(0, dtype=record_dtype(header['channels'], '<f8'))
+    records = np.concatenate(chunks)
+    keep = np.ones(len(records), dtype=bool)
+    if t0 is not None:
+        keep &= records['time'] >= t0
+    if t1 is not None:
+        keep &= records['time'] <= t1
+    return header, records[keep]
+
+
+def convert(src, dst, chunk_duration=60000.0, codec='zlib', chunk_size=65536):
+    # Any recording loader.load() reads (TSV or binary) into a .blz file, chunk_size rows at a time
+    from loader import load as load_recording
+    header, records = load_recording(src)
+    channels = header['channels']
+    fields = {name: value for name, value in header.items()
+              if name not in ('version', 'channels', 'time_units', 'value_dtype', 'offset', 'scales', 'raw_dtypes')}
+    fields.update(chunk_duration=chunk_duration, codec=codec)
+    with open(dst, 'wb') as f:
+        encode = ChunkEncoder(write_header(f, channels, **fields))
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start:start + chunk_size]
+            f.write(encode(np.asarray(chunk['time'], dtype=np.float64),
+                           np.column_stack([chunk[name] for name in channels]).astype(np.float64)))
+        f.write(encode.close())
+
+
+if __name__=='__main__':
+    # python chunked.py recording out.blz [zlib|lzma] converts a recording,
+    # python chunked.py file.blz t0 t1 reads the samples between t0 and t1 ms
+    if sys.argv[1].endswith(EXT):
+        start = time.perf_counter()
+        header, records = load(sys.argv[1], float(sys.argv[2]), float(sys.argv[3]))
+        print('%d samples in %.3f s' % (len(records), time.perf_counter() - start))
+    else:
+        convert(sys.argv[1], sys.argv[2], codec=sys.argv[3] if len(sys.argv) > 3 else 'zlib')
+        print('%s: %d bytes, %s: %d bytes' % (sys.argv[1], os.path.getsize(sys.argv[1]), sys.argv[2],
+                                              os.path.getsize(sys.argv[2])))
@@ -0,0 +1,98 @@
+import numpy as np
+
+
+def minmax(x, y, n_buckets):
+    # Min/max envelope: x is split into n_buckets equal ranges (one per pixel column) and each non-empty bucket
+    # contributes its minimum and maximum at the bucket centre, so spikes survive decimation
+    if len(x) <= 2 * n_buckets:
+        return np.asarray(x), np.asarray(y)
+    edges = np.linspace(x[0], x[-1], n_buckets + 1)
+    starts = np.unique(np.searchsorted(x, edges[:-1], side='left'))
+    starts = starts[starts < len(x)]
+    y = np.asarray(y)
+    low = np.minimum.reduceat(y, starts)
+    high = np.maximum.reduceat(y, starts)
+    ends = np.append(starts[1:], len(x)) - 1
+    centres = (np.asarray(x[starts]) + np.asarray(x[ends])) / 2.0
+    return np.repeat(centres, 2), np.column_stack((low, high)).ravel()
+
+
+def lttb(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: keeps the first and last point and, from each of n_out - 2 equal-count
+    # buckets, the point forming the largest triangle with the previously kept point and the mean of the next
+    # bucket. The area is evaluated for a whole bucket at once
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.asarray(x), np.asarray(y)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    bounds = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # Mean of every bucket, plus the last point as the "next bucket" of the final bucket
+    sums_x = np.add.reduceat(x[1:n - 1], bounds[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], bounds[:-1] - 1)
+    counts = np.diff(bounds)
+    mean_x = np.append(sums_x / counts, x[-1])
+    mean_y = np.append(sums_y / counts, y[-1])
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for idx in range(n_out - 2):
+        start, end = bounds[idx], bounds[idx + 1]
+        area = np.abs((x[a] - mean_x[idx + 1]) * (y[start:end] - y[a]) -
+                      (x[a] - x[start:end]) * (mean_y[idx + 1] - y[a]))
+        a = start + int(np.argmax(area))
+        keep[idx + 1] = a
+    return x[keep], y[keep]
+
+
+METHODS = {'minmax': lambda x, y, width: minmax(x, y, width),
+           'lttb': lambda x, y, width: lttb(x, y, 2 * width)}
+
+
+class DecimatedLine:
+    # Line that only ever holds about two points per pixel of the visible x range. The full-resolution x/y
+    # (which may be memory-mapped) are kept and re-decimated when the axis limits change
+
+    def __init__(self, ax, x, y, method='minmax', **kwargs):
+        self.ax = ax
+        self.x = x
+        self.y = y
+        self.decimate = METHODS[method]
+        (self.line,) = ax.plot([], [], **kwargs)
+        # fmin/fmax skip the NaN rows that mark gaps, a trace of nothing but gaps leaves the limits alone
+        low, high = (np.fmin.reduce(y), np.fmax.reduce(y)) if len(x) else (np.nan, np.nan)
+        if np.isfinite([low, high]).all():
+            ax.update_datalim([(x[0], low), (x[-1], high)])
+            ax.autoscale_view()
+        self.update()
+        ax.callbacks.connect('xlim_changed', self.on_xlim)
+
+    def visible(self):
+        if not len(self.x):
+            return 0, 0
+        low, high = self.ax.get_xlim()
+        # One point of margin either side so the line reaches the axis edges
+        start = max(int(np.searchsorted(self.x, low, side='left')) - 1, 0)
+        end = min(int(np.searchsorted(self.x, high, side='right')) + 1, len(self.x))
+        return start, end
+
+    def update(self):
+        start, end = self.visible()
+        width = max(int(self.ax.bbox.width), 100)
+        x, y = self.decimate(self.x[start:end], self.y[start:end], width)
+        self.line.set_data(x, y)
+
+    def on_xlim(self, ax):
+        self.update()
+        ax.figure.canvas.draw_idle()
+
+
+def plot(ax, x, y, method='minmax', **kwargs):
+    return DecimatedLine(ax, x, y, method, **kwargs)
+
+
+def hist(ax, values, bins=100, **kwargs):
+    # Histogram from one np.histogram pass, drawn as a single stairs artist whatever the number of values
+    counts, edges = np.histogram(values, bins)
+    return ax.stairs(counts, edges, fill=True, **kwargs)
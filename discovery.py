@@ -0,0 +1,104 @@
+import os
+import time
+from bluepy import btle
+
+SENSOR_NAME = 'SENSOR_PRO'
+SENSOR_SERVICE_UUID = '6a800001-b5a3-f393-e0a9-e50e24dcca9e'
+# Last address connected to, tried directly before scanning on the next start
+CACHE_FILE = os.path.expanduser('~/.sensor_pro_address')
+
+# Advertising data types holding the short/complete local name and the incomplete/complete 128-bit service UUIDs
+NAME_ADTYPES = (8, 9)
+UUID_ADTYPES = (6, 7)
+
+
+def load_address(fname=CACHE_FILE):
+    try:
+        with open(fname) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def save_address(address, fname=CACHE_FILE):
+    try:
+        with open(fname, 'w') as f:
+            f.write(address + '\n')
+    except OSError:
+        pass
+
+
+def matches(dev, name=SENSOR_NAME, service_uuid=SENSOR_SERVICE_UUID):
+    for adtype, desc, value in dev.getScanData():
+        if adtype in NAME_ADTYPES and value == name:
+            return True
+        if adtype in UUID_ADTYPES and service_uuid in value.lower():
+            return True
+    return False
+
+
+class FirstMatchDelegate(btle.DefaultDelegate):
+
+    def __init__(self, name=SENSOR_NAME, service_uuid=SENSOR_SERVICE_UUID):
+        btle.DefaultDelegate.__init__(self)
+        self.name = name
+        self.service_uuid = service_uuid
+        self.found = None
+
+    def handleDiscovery(self, dev, isNewDev, isNewData):
+        if self.found is None and matches(dev, self.name, self.service_uuid):
+            self.found = dev
+
+
+def scan(timeout=10.0, name=SENSOR_NAME, service_uuid=SENSOR_SERVICE_UUID, step=0.1):
+    # Scans in short process() steps and stops on the first advertisement matching by name or service UUID
+    # instead of waiting out the whole scan window
+    delegate = FirstMatchDelegate(name, service_uuid)
+    scanner = btle.Scanner().withDelegate(delegate)
+    scanner.start()
+    try:
+        deadline = time.perf_counter() + timeout
+        while delegate.found is None and time.perf_counter() < deadline:
+            scanner.process(step)
+    finally:
+        scanner.stop()
+    if delegate.found is None:
+        return None
+    print('%s found: %s' % (name, delegate.found.addr))
+    return delegate.found.addr
+
+
+def connect(address=None, timeout=10.0, cache=CACHE_FILE, **scan_kwargs):
+    # Connects to address, else to the cached last-known address, else to the first matching device found by
+    # scan(). Returns (address, peripheral), or (None, None) if nothing was found within timeout
+    cached = address is None
+    if cached:
+        address = load_address(cache)
+    if address is not None:
+        try:
+            print('Connecting to %s...' % address)
+            dev = btle.Peripheral(address, 'random')
+            save_address(address, cache)
+            return address, dev
+        except btle.BTLEException:
+            if not cached:
+                raise
+            print('%s not reachable, scanning...' % address)
+    else:
+        print('Scanning...')
+    address = scan(timeout, **scan_kwargs)
+    if address is None:
+        return None, None
+    dev = btle.Peripheral(address, 'random')
+    save_address(address, cache)
+    return address, dev
+
+
+def startup_logger(start):
+    # Listener printing the time from start (a time.perf_counter() value) to the first sample, once
+    def log(t, block):
+        if not log.done:
+            log.done = True
+            print('First sample after %.2f s' % (time.perf_counter() - start))
+    log.done = False
+    return log
@@ -0,0 +1,199 @@
+import time
+import numpy as np
+from bluepy import btle
+
+SERVICE_UUID = '6a800001-b5a3-f393-e0a9-e50e24dcca9e'
+GYRO_ACC_UUID = '6a806050-b5a3-f393-e0a9-e50e24dcca9e'
+TEMP_PRESS_UUID = '6a80b280-b5a3-f393-e0a9-e50e24dcca9e'
+AMBIENT_LIGHT_UUID = '6a803216-b5a3-f393-e0a9-e50e24dcca9e'
+IO_SAMP_CHAR_UUID = '6a80ff0c-b5a3-f393-e0a9-e50e24dcca9e'
+DEVICE_INFO_UUID = '0000180a-0000-1000-8000-00805f9b34fb'
+FIRMWARE_UUID = '00002a26-0000-1000-8000-00805f9b34fb'
+
+
+def make_payload(uuid, rng, t=0.0):
+    # Plausible SENSOR_PRO readings at t seconds: slow rotation on the gyro, gravity plus a little motion on the
+    # accelerometer, a drifting temperature, sea level pressure and indoor light, all with sensor noise
+    if uuid == GYRO_ACC_UUID:
+        phase = 2 * np.pi * 0.5 * t + np.array([0.0, 2.0, 4.0])
+        accel = np.array([0.0, 0.0, 1.0]) + 0.05 * np.sin(phase) + rng.normal(0, 0.01, 3)
+        gyro = 30.0 * np.sin(phase) + rng.normal(0, 0.5, 3)
+        counts = np.concatenate((accel / (2.0 / 32768.0), gyro / (250.0 / 32768.0)))
+        return np.clip(np.round(counts), -32768, 32767).astype('>i2').tobytes()
+    if uuid == TEMP_PRESS_UUID:
+        temp = int((20.0 + 0.01 * t / 60.0 + rng.normal(0, 0.01)) * 5120)
+        press = int(101325 + rng.normal(0, 2))
+        return b'\x00' + temp.to_bytes(3, 'big') + press.to_bytes(4, 'big')
+    if uuid == AMBIENT_LIGHT_UUID:
+        light = 300.0 + 50.0 * np.sin(t / 10.0) + rng.normal(0, 2)
+        return int(max(light, 0) / 0.35).to_bytes(2, 'big')
+    return b'\x00\x00'
+
+
+class FakeDescriptor:
+
+    def __init__(self, characteristic, handle):
+        self.characteristic = characteristic
+        self.handle = handle
+
+    def write(self, val, withResponse=False):
+        self.characteristic.periph.writeCharacteristic(self.handle, val, withResponse)
+
+
+class FakeCharacteristic:
+
+    def __init__(self, periph, uuid, valHandle):
+        self.periph = periph
+        self.uuid = uuid
+        self.valHandle = valHandle
+        self.descriptor = FakeDescriptor(self, valHandle + 1)
+        self.next_t = None
+
+    def set_notify(self, on):
+        if on and self.periph.notify:
+            self.next_t = time.monotonic() + 1.0 / self.periph.rate
+        else:
+            self.next_t = None
+
+    def read(self):
+        self.periph.request()
+        if self.uuid in self.periph.values:
+            return self.periph.values[self.uuid]
+        return make_payload(self.uuid, self.periph.rng, time.monotonic() - self.periph.start_t)
+
+    def getDescriptors(self, forUUID=None):
+        self.periph.request()
+        return [self.descriptor]
+
+
+class FakeService:
+
+    def __init__(self, uuid, characteristics):
+        self.uuid = uuid
+        self.characteristics = characteristics
+
+    def getCharacteristics(self, forUUID=None):
+        self.characteristics[0].periph.request()
+        return [c for c in self.characteristics if forUUID is None or c.uuid == str(forUUID)]
+
+
+class FakePeripheral:
+    # Stands in for a btle.Peripheral connected to a SENSOR_PRO. Enabled characteristics fire notifications
+    # at rate Hz from waitForNotifications (each delivered up to a random extra delay with standard deviation
+    # jitter seconds), reads take latency seconds. notify=False mimics firmware that never notifies. Each GATT
+    # request takes latency seconds and is counted in requests. Every characteristic is laid out as declaration,
+    # value and CCCD handles; handle_offset shifts the table as a firmware update would. With drop_every the link
+    # drops after every drop_every seconds connected and connect() is refused for the following down_time seconds.
+    # Writing the sampling characteristic sets rate, clamped to max_rate; with link_rate notifications beyond that
+    # many per second are lost on the way
+
+    def __init__(self, deviceAddr=None, addrType='random', rate=100.0, latency=0.005, jitter=0.0, notify=True,
+                 seed=None, firmware='1.0', handle_offset=0, drop_every=None, down_time=1.0,
+                 max_rate=None, link_rate=None):
+        self.addr = deviceAddr
+        self.addrType = addrType
+        self.rate = rate
+        self.latency = latency
+        self.jitter = jitter
+        self.notify = notify
+        self.rng = np.random.default_rng(seed)
+        self.start_t = time.monotonic()
+        self.delegate = None
+        self.values = {IO_SAMP_CHAR_UUID: b'\x00\x64', FIRMWARE_UUID: firmware.encode()}
+        self.characteristics = [FakeCharacteristic(self, uuid, 0x21 + handle_offset + 3 * i) for i, uuid in
+                                enumerate([GYRO_ACC_UUID, TEMP_PRESS_UUID, AMBIENT_LIGHT_UUID, IO_SAMP_CHAR_UUID])]
+        self.service = FakeService(SERVICE_UUID, self.characteristics)
+        self.info = FakeService(DEVICE_INFO_UUID, [FakeCharacteristic(self, FIRMWARE_UUID, 0x11)])
+        self.sent = {}
+        self.requests = 0
+        self.connected = True
+        self.drop_every = drop_every
+        self.down_time = down_time
+        self.drop_t = time.monotonic() + drop_every if drop_every else None
+        self.down_until = 0.0
+        self.drops = 0
+        self.max_rate = max_rate
+        self.link_rate = link_rate
+
+    def withDelegate(self, delegate):
+        self.delegate = delegate
+        return self
+
+    def request(self):
+        self.check_link()
+        self.requests += 1
+        time.sleep(self.latency)
+
+    def check_link(self):
+        if self.connected and self.drop_t is not None and time.monotonic() >= self.drop_t:
+            # the peripheral forgets its CCCDs with the connection
+            self.connected = False
+            self.drops += 1
+            self.down_until = time.monotonic() + self.down_time
+            for c in self.characteristics:
+                c.next_t = None
+        if not self.connected:
+            raise btle.BTLEDisconnectError('Device disconnected')
+
+    def connect(self, deviceAddr=None, addrType='random'):
+        time.sleep(self.latency)
+        if time.monotonic() < self.down_until:
+            raise btle.BTLEDisconnectError('Failed to connect to peripheral %s' % self.addr)
+        self.connected = True
+        if self.drop_every:
+            self.drop_t = time.monotonic() + self.drop_every
+
+    def getServiceByUUID(self, uuid):
+        self.request()
+        return self.service if str(uuid) == SERVICE_UUID else self.info
+
+    def getCharacteristics(self, startHnd=1, endHnd=0xFFFF, uuid=None):
+        self.request()
+        return [c for c in self.info.characteristics + self.characteristics
+                if startHnd <= c.valHandle - 1 and c.valHandle <= endHnd and (uuid is None or c.uuid == str(uuid))]
+
+    def readCharacteristic(self, handle):
+        for c in self.characteristics:
+            if c.valHandle == handle:
+                return c.read()
+        self.request()
+        return b''
+
+    def writeCharacteristic(self, handle, val, withResponse=False):
+        self.request()
+        for c in self.characteristics:
+            if c.valHandle == handle and c.uuid == IO_SAMP_CHAR_UUID:
+                self.rate = int.from_bytes(bytes(val[:2]), 'big')
+                if self.max_rate is not None:
+                    self.rate = min(self.rate, self.max_rate)
+                self.values[c.uuid] = self.rate.to_bytes(2, 'big')
+            elif c.valHandle == handle:
+                self.values[c.uuid] = bytes(val)
+            elif c.descriptor.handle == handle:
+                c.set_notify(val != b'\x00\x00')
+
+    def waitForNotifications(self, timeout):
+        self.check_link()
+        deadline = time.monotonic() + timeout
+        while True:
+            pending = [c for c in self.characteristics if c.next_t is not None]
+            if not pending:
+                time.sleep(max(0.0, deadline - time.monotonic()))
+                return False
+            c = min(pending, key=lambda c: c.next_t)
+            if c.next_t > deadline:
+                time.sleep(max(0.0, deadline - time.monotonic()))
+                return False
+            delay = abs(self.rng.normal(0, self.jitter)) if self.jitter else 0.0
+            time.sleep(max(0.0, c.next_t + delay - time.monotonic()))
+            c.next_t += 1.0 / self.rate
+            if self.link_rate is None or self.rng.random() * self.rate <= self.link_rate:
+                break
+        self.sent[c.uuid] = self.sent.get(c.uuid, 0) + 1
+        if self.delegate is not None:
+            self.delegate.handleNotification(c.valHandle, make_payload(c.uuid, self.rng,
+                                                                       time.monotonic() - self.start_t))
+        return True
+
+    def disconnect(self):
+        self.connected = False
@@ -0,0 +1,90 @@
+import json
+import os
+from bluepy import btle
+from bluepy.btle import AssignedNumbers
+
+SERVICE_UUID = '6a800001-b5a3-f393-e0a9-e50e24dcca9e'
+SAMPLE_INTERVAL_UUID = '6a80ff0c-b5a3-f393-e0a9-e50e24dcca9e'
+# Value and CCCD handles of each SENSOR_PRO, keyed by '<address>/<firmware revision>'
+CACHE_FILE = os.path.expanduser('~/.sensor_pro_gatt.json')
+
+
+def encode_rate(rate):
+    # The sampling characteristic holds the rate in Hz as a big-endian uint16 (0x0064 for 100 Hz)
+    rate = int(round(rate))
+    if not 0 < rate < 0x10000:
+        raise ValueError('Sampling rate out of range: %r' % rate)
+    return rate.to_bytes(2, 'big')
+
+
+def decode_rate(value):
+    return int.from_bytes(bytes(value[:2]), 'big')
+
+
+def load_cache(fname=CACHE_FILE):
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache, fname=CACHE_FILE):
+    try:
+        with open(fname + '.tmp', 'w') as f:
+            json.dump(cache, f, indent=1)
+        os.replace(fname + '.tmp', fname)
+    except OSError:
+        pass
+
+
+def firmware(dev):
+    # Firmware revision string from the device information service, '' if the device has none
+    chars = dev.getCharacteristics(uuid=AssignedNumbers.firmware_revision_string)
+    if not chars:
+        return ''
+    return chars[0].read().decode('ascii', errors='replace').strip('\x00 ')
+
+
+def discover(dev, service_uuid=SERVICE_UUID, notify_uuids=()):
+    # Full discovery of one service: {uuid: {'value': value handle, 'cccd': CCCD handle or None}}, descriptors
+    # are only looked up for the characteristics in notify_uuids
+    handles = {}
+    service = dev.getServiceByUUID(service_uuid)
+    for char in service.getCharacteristics():
+        uuid = str(char.uuid)
+        cccd = None
+        if uuid in notify_uuids:
+            cccd = char.getDescriptors(AssignedNumbers.client_characteristic_configuration)[0].handle
+        handles[uuid] = {'value': char.valHandle, 'cccd': cccd}
+    return handles
+
+
+def validate(dev, handles, uuid=SAMPLE_INTERVAL_UUID):
+    # One round trip: the characteristic declared just before the cached value handle must still be uuid,
+    # otherwise the GATT table has changed and the cached handles are stale
+    if uuid not in handles:
+        return False
+    value = handles[uuid]['value']
+    try:
+        chars = dev.getCharacteristics(startHnd=value - 1, endHnd=value)
+    except btle.BTLEException:
+        return False
+    return any(str(char.uuid) == uuid and char.valHandle == value for char in chars)
+
+
+def resolve(dev, address, notify_uuids=(), fname=CACHE_FILE):
+    # Handles for this connection: cached ones if they are still valid, otherwise from a full discovery that
+    # then replaces the cache entry. fname=None or an unknown address skips the cache
+    if fname is None or address is None:
+        return discover(dev, SERVICE_UUID, notify_uuids)
+    key = '%s/%s' % (address, firmware(dev))
+    cache = load_cache(fname)
+    handles = cache.get(key)
+    if handles is not None and all(uuid in handles for uuid in notify_uuids) and validate(dev, handles):
+        return handles
+    print('Discovering services')
+    handles = discover(dev, SERVICE_UUID, notify_uuids)
+    cache[key] = handles
+    save_cache(cache, fname)
+    return handles
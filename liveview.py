@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+
+# Plot panels: title, channels, fixed y-limits (None tracks the data)
+PANELS = [('gyro', ['g_x', 'g_y', 'g_z'], (-250, 250)),
+          ('acc', ['a_x', 'a_y', 'a_z'], (-2, 2)),
+          ('temp', ['t'], None),
+          ('pressure', ['p'], None),
+          ('light', ['l'], None)]
+
+
+class RingBuffer:
+    # Fixed-size circular buffer of the latest size samples per channel, written at a moving index instead of
+    # shifting the whole array on every sample
+
+    def __init__(self, dim, size):
+        self.data = np.zeros((dim, size))
+        self.size = size
+        self.idx = 0
+        self.n = 0
+
+    def extend(self, block):
+        # block holds one row per sample
+        if len(block) > self.size:
+            block = block[-self.size:]
+        count = len(block)
+        first = min(count, self.size - self.idx)
+        self.data[:, self.idx:self.idx + first] = block[:first].T
+        self.data[:, :count - first] = block[first:].T
+        self.idx = (self.idx + count) % self.size
+        self.n = min(self.n + count, self.size)
+
+    def ordered(self):
+        # Oldest to newest copy, taken once per frame
+        return np.concatenate((self.data[:, self.idx:], self.data[:, :self.idx]), axis=1)
+
+
+class RangeTracker:
+    # y-limits that widen as soon as the data leaves them and are only narrowed back to the buffer contents
+    # every shrink_every frames, so most frames keep the cached background
+
+    def __init__(self, limits=None, margin=0.1, shrink_every=50):
+        self.fixed = limits is not None
+        self.limits = limits
+        self.margin = margin
+        self.shrink_every = shrink_every
+        self.frames = 0
+
+    def pad(self, low, high):
+        span = high - low
+        if span == 0:
+            span = max(abs(high), 1.0) * 1e-3
+        return low - self.margin * span, high + self.margin * span
+
+    def update(self, low, high, window_low, window_high):
+        # low/high cover the samples added since the last frame, window_low/window_high the whole buffer.
+        # Returns True when the limits changed. Limits that are not finite (nothing new, or only NaN gap rows) leave
+        # the range as it is
+        if self.fixed or not np.isfinite([low, high, window_low, window_high]).all():
+            return False
+        self.frames += 1
+        if self.limits is None or low < self.limits[0] or high > self.limits[1]:
+            self.limits = self.pad(min(low, window_low), max(high, window_high))
+            return True
+        if self.frames % self.shrink_every == 0:
+            limits = self.pad(window_low, window_high)
+            if limits != self.limits:
+                self.limits = limits
+                return True
+        return False
+
+
+class LivePlot:
+    # Live view of the channels a RecordingDevice produces. Acquisition hands batches to extend() from its own
+    # thread or task, and the figure is refreshed at a fixed frame rate by blitting only the lines
+
+    def __init__(self, channels, size=500, fps=20):
+        self.channels = list(channels)
+        self.ring = RingBuffer(len(self.channels), size)
+        self.fps = fps
+        self.lock = threading.Lock()
+        self.new_low = np.full(len(self.channels), np.inf)
+        self.new_high = np.full(len(self.channels), -np.inf)
+        self.samples = 0
+        self.frames = 0
+
+        panels = [(title, [self.channels.index(c) for c in names], limits)
+                  for title, names, limits in PANELS if set(names) <= set(self.channels)]
+        self.fig = plt.figure()
+        self.panels = []
+        for idx, (title, cols, limits) in enumerate(panels):
+            ax = self.fig.add_subplot((len(panels) + 1) // 2, 2, idx + 1)
+            lines = [ax.plot(np.zeros(size), animated=True)[0] for col in cols]
+            ax.set_xlim(0, size - 1)
+            if limits is not None:
+                ax.set_ylim(*limits)
+            ax.legend(['%s %s' % (title, self.channels[col]) for col in cols], loc='upper left')
+            self.panels.append((ax, cols, lines, RangeTracker(limits)))
+        self.background = None
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def extend(self, t, block):
+        with self.lock:
+            self.ring.extend(block)
+            if len(block):
+                # fmin/fmax skip the NaN rows written for gaps
+                np.fmin(self.new_low, np.fmin.reduce(block, axis=0), out=self.new_low)
+                np.fmax(self.new_high, np.fmax.reduce(block, axis=0), out=self.new_high)
+            self.samples += len(block)
+
+    def on_draw(self, event):
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_lines()
+
+    def draw_lines(self):
+        for ax, cols, lines, tracker in self.panels:
+            for line in lines:
+                ax.draw_artist(line)
+
+    def update(self):
+        with self.lock:
+            data = self.ring.ordered()
+            n = self.ring.n
+            new_low, new_high = self.new_low.copy(), self.new_high.copy()
+            self.new_low.fill(np.inf)
+            self.new_high.fill(-np.inf)
+        if not n:
+            return
+        window_low = np.fmin.reduce(data[:, -n:], axis=1)
+        window_high = np.fmax.reduce(data[:, -n:], axis=1)
+        redraw = False
+        for ax, cols, lines, tracker in self.panels:
+            for col, line in zip(cols, lines):
+                line.set_ydata(data[col])
+            if tracker.update(np.fmin.reduce(new_low[cols]), np.fmax.reduce(new_high[cols]),
+                              np.fmin.reduce(window_low[cols]), np.fmax.reduce(window_high[cols])):
+                ax.set_ylim(*tracker.limits)
+                redraw = True
+        if redraw or self.background is None:
+            # Full draw, on_draw grabs the new background and draws the lines on it
+            self.fig.canvas.draw()
+        else:
+            self.fig.canvas.restore_region(self.background)
+            self.draw_lines()
+        self.fig.canvas.blit(self.fig.bbox)
+        self.fig.canvas.flush_events()
+        self.frames += 1
+
+    def is_open(self):
+        return plt.fignum_exists(self.fig.number)
+
+    def run(self):
+        # Refresh at fps until the window is closed
+        plt.show(block=False)
+        while self.is_open():
+            frame_t = time.perf_counter()
+            self.update()
+            remaining = 1.0 / self.fps - (time.perf_counter() - frame_t)
+            if remaining > 0:
+                self.fig.canvas.start_event_loop(remaining)
+
+    async def run_async(self):
+        plt.show(block=False)
+        while self.is_open():
+            frame_t = time.perf_counter()
+            self.update()
+            await asyncio.sleep(max(0.0, 1.0 / self.fps - (time.perf_counter() - frame_t)))
@@ -0,0 +1,77 @@
+import os
+import numpy as np
+
+import chunked
+import rotation
+from recording import is_binary, open_recording, read_start_time, record_dtype, tsv_to_binary
+
+# Loads recordings as (header, records): records is a structured array with a 'time' field and one field per
+# channel named as in the TSV header. TSV files are converted once into a float64 binary sidecar next to them,
+# keyed on the size and mtime of the TSV, so later loads just memory-map the sidecar. The manifest of a rotated
+# recording loads as one recording (see rotation.py).
+
+
+def cache_fname(fname):
+    return fname + '.cache'
+
+
+def iter_tsv(fname, chunk_size=65536):
+    # (header, iterator over record chunks) of a TSV recording, parsed chunk_size lines at a time so memory is
+    # bounded by the chunk size, not the file size
+    with open(fname) as f:
+        channels = f.readline().strip().split('\t')[1:]
+        header = {'channels': channels, 'start_time': read_start_time(f.readline())}
+    dtype = record_dtype(channels, '<f8')
+
+    def chunks():
+        with open(fname) as f:
+            f.readline()
+            while True:
+                lines = [line for _, line in zip(range(chunk_size), f)]
+                if not lines:
+                    break
+                lines = [line for line in lines if line.strip() and not line.startswith('#')]
+                if not lines:
+                    continue
+                rows = np.loadtxt(lines, delimiter='\t', ndmin=2)
+                records = np.empty(len(rows), dtype=dtype)
+                for idx, name in enumerate(dtype.names):
+                    records[name] = rows[:, idx]
+                yield records
+    return header, chunks()
+
+
+def read_tsv(fname):
+    header, chunks = iter_tsv(fname)
+    parts = list(chunks)
+    if not parts:
+        return header, np.empty(0, dtype=record_dtype(header['channels'], '<f8'))
+    return header, np.concatenate(parts)
+
+
+def load(fname, cache=True):
+    if fname.endswith(rotation.MANIFEST_EXT):
+        return rotation.load(fname)
+    if is_binary(fname):
+        return open_recording(fname)
+    if chunked.is_chunked(fname):
+        return chunked.load(fname)
+    stat = os.stat(fname)
+    key = {'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+    sidecar = cache_fname(fname)
+    if cache:
+        try:
+            header, records = open_recording(sidecar)
+            if all(header.get(name) == value for name, value in key.items()):
+                return header, records
+        except (OSError, ValueError):
+            pass
+        try:
+            tmp = sidecar + '.%d.tmp' % os.getpid()
+            tsv_to_binary(fname, tmp, value_dtype='<f8', **key)
+            os.replace(tmp, sidecar)
+            return open_recording(sidecar)
+        except OSError:
+            # e.g. a read-only directory
+            pass
+    return read_tsv(fname)
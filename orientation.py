@@ -0,0 +1,322 @@
+import math
+import sys
+import time
+import numpy as np
+
+# Orientation from the GyroAccelSensor channels (gyro in deg/s, acceleration in g). Angles are roll, pitch and
+# yaw in degrees about x, y and z; without a magnetometer yaw is integrated gyro and drifts. Streaming filters
+# update per sample with O(1) state, e.g. as a RecordingDevice listener; complementary() and madgwick() run
+# over whole recordings. Rows with NaNs (gaps of a supervised recording) come out as NaN and integration
+# restarts after them.
+
+GYRO = ['g_x', 'g_y', 'g_z']
+ACCEL = ['a_x', 'a_y', 'a_z']
+
+
+def accel_tilt(ax, ay, az):
+    # Roll and pitch (radians) of the gravity vector, works on floats and arrays
+    return np.arctan2(ay, az), np.arctan2(-ax, np.sqrt(ay * ay + az * az))
+
+
+def tilt_quaternion(roll, pitch):
+    cr, sr = np.cos(roll / 2), np.sin(roll / 2)
+    cp, sp = np.cos(pitch / 2), np.sin(pitch / 2)
+    return cr * cp, sr * cp, cr * sp, -sr * sp
+
+
+def madgwick_step(q0, q1, q2, q3, gx, gy, gz, ax, ay, az, dt, beta):
+    # One Madgwick IMU update (gyro in rad/s), written so the same code runs on floats and on arrays of
+    # independent filters. The accelerometer correction is skipped for a zero acceleration
+    norm = (ax * ax + ay * ay + az * az) ** 0.5
+    valid = norm > 0
+    norm = norm + (norm == 0)
+    ax, ay, az = ax / norm, ay / norm, az / norm
+    f1 = 2 * (q1 * q3 - q0 * q2) - ax
+    f2 = 2 * (q0 * q1 + q2 * q3) - ay
+    f3 = 1 - 2 * (q1 * q1 + q2 * q2) - az
+    s0 = -2 * q2 * f1 + 2 * q1 * f2
+    s1 = 2 * q3 * f1 + 2 * q0 * f2 - 4 * q1 * f3
+    s2 = -2 * q0 * f1 + 2 * q3 * f2 - 4 * q2 * f3
+    s3 = 2 * q1 * f1 + 2 * q2 * f2
+    snorm = (s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3) ** 0.5
+    step = beta * valid / (snorm + (snorm == 0))
+    q0, q1, q2, q3 = (q0 + (0.5 * (-q1 * gx - q2 * gy - q3 * gz) - step * s0) * dt,
+                      q1 + (0.5 * (q0 * gx + q2 * gz - q3 * gy) - step * s1) * dt,
+                      q2 + (0.5 * (q0 * gy - q1 * gz + q3 * gx) - step * s2) * dt,
+                      q3 + (0.5 * (q0 * gz + q1 * gy - q2 * gx) - step * s3) * dt)
+    norm = (q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3) ** 0.5
+    return q0 / norm, q1 / norm, q2 / norm, q3 / norm
+
+
+def euler(q):
+    # (n, 4) quaternions (w, x, y, z) to (n, 3) roll, pitch, yaw in degrees
+    q0, q1, q2, q3 = np.asarray(q, dtype=np.float64).T
+    roll = np.arctan2(2 * (q0 * q1 + q2 * q3), 1 - 2 * (q1 * q1 + q2 * q2))
+    pitch = np.arcsin(np.clip(2 * (q0 * q2 - q3 * q1), -1, 1))
+    yaw = np.arctan2(2 * (q0 * q3 + q1 * q2), 1 - 2 * (q2 * q2 + q3 * q3))
+    return np.degrees(np.column_stack((roll, pitch, yaw)))
+
+
+class StreamingFilter:
+
+    def listener(self, channels, callback=None, calibrate=None):
+        # RecordingDevice listener feeding every row through the filter, callback(t, angles) gets the angles
+        # after each batch. With calibrate the sensor is taken to be still for the first calibrate seconds:
+        # those rows are held back until the gyro bias has been estimated from them with gyro_bias(), then
+        # filtered with it like the rest
+        cols = [channels.index(name) for name in GYRO + ACCEL]
+        held = []
+
+        def update(t, block):
+            rows = block[:, cols]
+            if calibrate is not None and self.bias_window is None:
+                held.append((t, rows))
+                t = np.concatenate([held_t for held_t, held_rows in held])
+                rows = np.concatenate([held_rows for held_t, held_rows in held])
+                if not len(t) or t[-1] - t[0] < calibrate * 1e3:
+                    return
+                bias, self.bias_window = gyro_bias(t, rows[:, :3], length=calibrate)
+                self.bias = tuple(bias.tolist())
+                del held[:]
+            for row_t, row in zip(t.tolist(), rows.tolist()):
+                self.update(row_t, row[:3], row[3:])
+            if callback is not None and len(t):
+                callback(t[-1], self.angles())
+        return update
+
+
+class ComplementaryFilter(StreamingFilter):
+    # Integrates the gyro and pulls roll and pitch towards the accelerometer tilt with weight 1 - alpha
+
+    def __init__(self, alpha=0.96, bias=(0.0, 0.0, 0.0)):
+        self.alpha = alpha
+        self.bias = tuple(bias)
+        # sample indices of the stationary rows the bias was estimated from, see listener(calibrate=...)
+        self.bias_window = None
+        self.roll = self.pitch = self.yaw = 0.0
+        self.last_t = None
+        self.started = False
+
+    def update(self, t, gyro, accel):
+        # t in ms, gyro in deg/s, accel in g
+        if math.isnan(gyro[0]) or math.isnan(accel[0]):
+            self.last_t = None
+            return self.angles()
+        acc_roll, acc_pitch = accel_tilt(*accel)
+        if not self.started:
+            self.roll, self.pitch = math.degrees(acc_roll), math.degrees(acc_pitch)
+            self.started = True
+        else:
+            # no integration across a gap, the accelerometer still pulls
+            dt = 0.0 if self.last_t is None else (t - self.last_t) / 1e3
+            a = self.alpha
+            self.roll = a * (self.roll + (gyro[0] - self.bias[0]) * dt) + (1 - a) * math.degrees(acc_roll)
+            self.pitch = a * (self.pitch + (gyro[1] - self.bias[1]) * dt) + (1 - a) * math.degrees(acc_pitch)
+            self.yaw = self.yaw + (gyro[2] - self.bias[2]) * dt
+        self.last_t = t
+        return self.angles()
+
+    def angles(self):
+        return self.roll, self.pitch, self.yaw
+
+
+class MadgwickFilter(StreamingFilter):
+    # Madgwick gradient-descent IMU filter, beta (rad/s) sets how fast gyro drift is corrected towards gravity
+
+    def __init__(self, beta=0.1, bias=(0.0, 0.0, 0.0)):
+        self.beta = beta
+        self.bias = tuple(bias)
+        self.bias_window = None
+        self.q = None
+        self.last_t = None
+
+    def update(self, t, gyro, accel):
+        if math.isnan(gyro[0]) or math.isnan(accel[0]):
+            self.last_t = None
+            return self.angles()
+        if self.q is None:
+            self.q = tilt_quaternion(*[float(angle) for angle in accel_tilt(*accel)])
+        elif self.last_t is not None:
+            gx, gy, gz = [math.radians(g - b) for g, b in zip(gyro, self.bias)]
+            self.q = madgwick_step(*self.q, gx, gy, gz, accel[0], accel[1], accel[2], (t - self.last_t) / 1e3,
+                                   self.beta)
+        self.last_t = t
+        return self.angles()
+
+    def angles(self):
+        if self.q is None:
+            return 0.0, 0.0, 0.0
+        q0, q1, q2, q3 = self.q
+        return (math.degrees(math.atan2(2 * (q0 * q1 + q2 * q3), 1 - 2 * (q1 * q1 + q2 * q2))),
+                math.degrees(math.asin(max(-1.0, min(1.0, 2 * (q0 * q2 - q3 * q1))))),
+                math.degrees(math.atan2(2 * (q0 * q3 + q1 * q2), 1 - 2 * (q2 * q2 + q3 * q3))))
+
+
+def gyro_bias(t, gyro, length=2.0, window=None):
+    # Mean gyro reading (deg/s) over a stationary stretch: window=(start, stop) sample indices, otherwise the
+    # length second window with the least gyro variance. Returns the bias and the window used
+    gyro = np.asarray(gyro, dtype=np.float64)
+    if window is None:
+        valid = ~np.isnan(gyro).any(axis=1)
+        n = max(2, int(round(length * 1e3 / np.median(np.diff(t[valid])))))
+        if valid.sum() <= n:
+            window = (0, len(gyro))
+        else:
+            g = np.where(valid[:, np.newaxis], gyro, 0.0)
+            s1 = np.concatenate((np.zeros((1, 3)), np.cumsum(g, axis=0)))
+            s2 = np.concatenate((np.zeros((1, 3)), np.cumsum(g * g, axis=0)))
+            gaps = np.concatenate(([0], np.cumsum(~valid)))
+            var = ((s2[n:] - s2[:-n]) / n - ((s1[n:] - s1[:-n]) / n) ** 2).sum(axis=1)
+            var[gaps[n:] != gaps[:-n]] = np.inf
+            start = int(np.argmin(var))
+            window = (start, start + n)
+    return np.nanmean(gyro[window[0]:window[1]], axis=0), window
+
+
+def linear_recurrence(u, alpha, y0=0.0, block=256):
+    # y[k] = alpha * y[k-1] + u[k] with y[-1] = y0, exactly: one matrix product within blocks and one carry per
+    # block instead of a Python step per sample
+    n = len(u)
+    m = -(-n // block)
+    padded = np.zeros(m * block)
+    padded[:n] = u
+    k = np.arange(block)
+    lag = k[:, np.newaxis] - k[np.newaxis, :]
+    weights = np.where(lag >= 0, alpha ** np.maximum(lag, 0), 0.0)
+    y = padded.reshape(m, block) @ weights.T
+    powers = alpha ** (k + 1)
+    carries = np.empty(m)
+    carry = y0
+    for idx in range(m):
+        carries[idx] = carry
+        carry = y[idx, -1] + powers[-1] * carry
+    y += carries[:, np.newaxis] * powers[np.newaxis, :]
+    return y.ravel()[:n]
+
+
+def prepare(t, gyro, accel, bias):
+    # Drops NaN rows and zeroes the time step of the first sample and of every sample after a gap
+    t = np.asarray(t, dtype=np.float64)
+    gyro = np.asarray(gyro, dtype=np.float64)
+    accel = np.asarray(accel, dtype=np.float64)
+    valid = ~(np.isnan(gyro).any(axis=1) | np.isnan(accel).any(axis=1) | np.isnan(t))
+    dt = np.zeros(len(t))
+    dt[1:] = np.diff(t) / 1e3
+    dt[1:][~valid[:-1]] = 0.0
+    dt[0] = 0.0
+    return valid, dt[valid], gyro[valid] - np.asarray(bias), accel[valid]
+
+
+def complementary(t, gyro, accel, alpha=0.96, bias=(0.0, 0.0, 0.0)):
+    # Offline ComplementaryFilter: the same angles (n, 3), vectorized through linear_recurrence()
+    valid, dt, gyro, accel = prepare(t, gyro, accel, bias)
+    angles = np.full((len(valid), 3), np.nan)
+    if not len(dt):
+        return angles
+    acc = np.degrees(np.column_stack(accel_tilt(accel[:, 0], accel[:, 1], accel[:, 2])))
+    out = np.empty((len(dt), 3))
+    for axis in range(2):
+        u = alpha * gyro[1:, axis] * dt[1:] + (1 - alpha) * acc[1:, axis]
+        out[0, axis] = acc[0, axis]
+        out[1:, axis] = linear_recurrence(u, alpha, acc[0, axis])
+    out[:, 2] = np.cumsum(gyro[:, 2] * dt)
+    angles[valid] = out
+    return angles
+
+
+def gravity(q):
+    # (n, 4) quaternions to the (n, 3) unit gravity direction in the sensor frame, as the Madgwick step sees it
+    q0, q1, q2, q3 = np.asarray(q, dtype=np.float64).T
+    return np.column_stack((2 * (q1 * q3 - q0 * q2), 2 * (q0 * q1 + q2 * q3), 1 - 2 * (q1 * q1 + q2 * q2)))
+
+
+def madgwick(t, gyro, accel, beta=0.1, bias=(0.0, 0.0, 0.0), segment=2000, warmup=2000, tolerance=0.1):
+    # Offline MadgwickFilter returning (n, 4) quaternions. The recording is cut into segments of segment
+    # samples that are filtered side by side as arrays, each starting warmup samples early from the
+    # accelerometer tilt so it has converged onto the sequential solution when its own samples begin. The
+    # IMU-only filter is symmetric about the vertical, so each segment's yaw is then rotated to continue
+    # from the end of the previous one. Convergence takes roughly the initial tilt error over beta seconds, so
+    # with a small beta or a high rate warmup samples may not be enough: where a segment's tilt at its start is
+    # more than tolerance degrees from the end of the previous one, the rest of the recording is filtered
+    # sample by sample like MadgwickFilter (slower, but never off by more than rounding)
+    valid, dt, gyro, accel = prepare(t, gyro, accel, bias)
+    q = np.full((len(valid), 4), np.nan)
+    n = len(dt)
+    if not n:
+        return q
+    gyro = np.radians(gyro)
+    segments = -(-n // segment)
+    warmup = warmup if segments > 1 else 0
+    starts = np.arange(segments) * segment
+    first = np.maximum(starts - warmup, 0)
+    roll, pitch = accel_tilt(accel[first, 0], accel[first, 1], accel[first, 2])
+    state = tilt_quaternion(roll, pitch)
+    out = np.empty((n, 4))
+    joins = np.empty((segments, 4))
+    for step in range(warmup + segment):
+        idx = starts + step - warmup
+        active = (idx >= 0) & (idx < n)
+        pos = np.clip(idx, 0, n - 1)
+        new = madgwick_step(*state, gyro[pos, 0], gyro[pos, 1], gyro[pos, 2], accel[pos, 0], accel[pos, 1],
+                            accel[pos, 2], dt[pos] * active, beta)
+        # a segment's first sample only sets its starting tilt
+        keep = active & (idx > first)
+        state = tuple(np.where(keep, new_c, old_c) for new_c, old_c in zip(new, state))
+        if step == warmup - 1:
+            joins[:] = np.column_stack(state)
+        if step >= warmup:
+            out[pos[active]] = np.column_stack(state)[active]
+    # segments[:good] joined onto the sequential solution, the rest is redone below
+    good = segments
+    if segments > 1:
+        # yaw of previous segment's last sample relative to this segment's estimate of the same sample
+        prev = out[starts[1:] - 1]
+        cur = joins[1:]
+        tilt = np.degrees(np.arccos(np.clip((gravity(prev) * gravity(cur)).sum(axis=1), -1, 1)))
+        missed = np.nonzero(tilt > tolerance)[0]
+        if len(missed):
+            good = int(missed[0]) + 1
+        w = prev[:, 0] * cur[:, 0] + (prev[:, 1:] * cur[:, 1:]).sum(axis=1)
+        z = -prev[:, 0] * cur[:, 3] + cur[:, 0] * prev[:, 3] - prev[:, 1] * cur[:, 2] + prev[:, 2] * cur[:, 1]
+        turn = np.concatenate(([0.0], np.cumsum(2 * np.arctan2(z, w))))
+        turn = np.repeat(turn, segment)[:n]
+        cw, sz = np.cos(turn / 2), np.sin(turn / 2)
+        w0, x0, y0, z0 = out.T.copy()
+        out = np.column_stack((cw * w0 - sz * z0, cw * x0 - sz * y0, cw * y0 + sz * x0, cw * z0 + sz * w0))
+    if good < segments:
+        start = int(starts[good])
+        state = tuple(out[start - 1].tolist())
+        for idx, (g, a, step_dt) in enumerate(zip(gyro[start:].tolist(), accel[start:].tolist(),
+                                                   dt[start:].tolist())):
+            state = madgwick_step(*state, g[0], g[1], g[2], a[0], a[1], a[2], step_dt, beta)
+            out[start + idx] = state
+    q[valid] = out
+    return q
+
+
+if __name__=='__main__':
+    # python orientation.py recording [madgwick|complementary] plots roll, pitch and yaw of a recording
+    import matplotlib.pyplot as plt
+    import decimate
+    from loader import load
+
+    header, records = load(sys.argv[1])
+    method = sys.argv[2] if len(sys.argv) > 2 else 'madgwick'
+    t = np.asarray(records['time'], dtype=np.float64)
+    gyro = np.column_stack([records[name] for name in GYRO])
+    accel = np.column_stack([records[name] for name in ACCEL])
+    bias, window = gyro_bias(t, gyro)
+    print('Gyro bias %.3f %.3f %.3f deg/s from samples %d-%d' % (tuple(bias) + window))
+    start = time.perf_counter()
+    if method == 'madgwick':
+        angles = euler(madgwick(t, gyro, accel, bias=bias))
+    else:
+        angles = complementary(t, gyro, accel, bias=bias)
+    print('%d samples in %.2f s' % (len(t), time.perf_counter() - start))
+    fig, ax = plt.subplots(1, 1)
+    for idx, name in enumerate(['roll', 'pitch', 'yaw']):
+        decimate.plot(ax, t / 1e3, angles[:, idx], label=name)
+    ax.set_xlabel('time (s)')
+    ax.set_ylabel('angle (deg)')
+    ax.legend()
+    plt.show()
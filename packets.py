@@ -0,0 +1,56 @@
+import struct
+import numpy as np
+
+NUMPY_CODES = {'b': 'i1', 'B': 'u1', 'h': 'i2', 'H': 'u2', 'i': 'i4', 'I': 'u4', 'q': 'i8', 'Q': 'u8'}
+
+
+class PacketLayout:
+    # Declarative packet layout: fields are (column, struct code, scale, mask) in payload order, column None
+    # skips the field. Compiled once into a big-endian struct.Struct plus a plan of (row index, field, scale,
+    # mask) so a payload decodes with one unpack_from straight into a caller-supplied row, and into the
+    # equivalent big-endian numpy record dtype for decoding many payloads at once.
+
+    def __init__(self, fields, columns):
+        self.fields = fields
+        self.columns = columns
+        self.struct = struct.Struct('>' + ''.join(field[1] for field in fields))
+        self.size = self.struct.size
+        self.plan = tuple((columns.index(name), pos, scale, mask)
+                          for pos, (name, code, scale, mask) in enumerate(fields) if name is not None)
+        offsets = []
+        offset = 0
+        for name, code, scale, mask in fields:
+            offsets.append(offset)
+            offset += struct.calcsize('>' + code)
+        self.dtype = np.dtype({'names': ['f%d' % pos for pos in range(len(fields))],
+                               'formats': ['>' + NUMPY_CODES.get(field[1], 'V%d' % struct.calcsize(field[1]))
+                                           for field in fields],
+                               'offsets': offsets, 'itemsize': self.size})
+
+    def decode_into(self, data, row):
+        values = self.struct.unpack_from(data)
+        for idx, pos, scale, mask in self.plan:
+            if mask is None:
+                row[idx] = values[pos] * scale
+            else:
+                row[idx] = (values[pos] & mask) * scale
+        return row
+
+    def decode_batch(self, payloads, record_size=None):
+        # payloads holds n records of record_size bytes back to back (only the first self.size bytes of each
+        # are decoded), returns an (n, len(columns)) float64 array with the same values as decode_into
+        if record_size is None:
+            record_size = self.size
+        n = len(payloads) // record_size
+        dtype = self.dtype
+        if record_size != self.size:
+            dtype = np.dtype({'names': dtype.names, 'formats': [dtype.fields[name][0] for name in dtype.names],
+                              'offsets': [dtype.fields[name][1] for name in dtype.names], 'itemsize': record_size})
+        records = np.frombuffer(payloads, dtype=dtype, count=n)
+        out = np.empty((n, len(self.columns)))
+        for idx, pos, scale, mask in self.plan:
+            values = records['f%d' % pos]
+            if mask is not None:
+                values = values & mask
+            out[:, idx] = values.astype(np.float64) * scale
+        return out
@@ -0,0 +1,111 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+
+from timing import LatencyHistogram
+
+# Per-stage latency of the acquisition loop: one log-binned histogram per (stage, sensor), sensor '' for stages
+# of the whole device. Stages are timed with time.perf_counter_ns() by the caller, lap(stage, t0) records the
+# time since t0 and returns the current time so consecutive stages can be chained. Snapshots can be written as
+# JSON (times in ms, like IntervalHistogram.summary) or in the Prometheus text format (histograms in seconds,
+# e.g. for node_exporter's textfile collector), once or every interval seconds from a background thread.
+# Recording never locks, so a snapshot taken while sampling may be off by the samples being recorded.
+
+FORMATS = ['json', 'prometheus']
+
+
+class StageProfiler:
+
+    def __init__(self, bins_per_decade=40, min_ns=1e2, max_ns=1e11, prefix='ble_sensor'):
+        self.bins_per_decade = bins_per_decade
+        self.min_ns = min_ns
+        self.max_ns = max_ns
+        self.prefix = prefix
+        self.histograms = {}
+        self.start_wall_t = time.time()
+        self.fname = None
+        self.format = None
+        self.interval = None
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def histogram(self, stage, sensor=''):
+        histogram = self.histograms.get((stage, sensor))
+        if histogram is None:
+            histogram = LatencyHistogram(self.bins_per_decade, self.min_ns, self.max_ns)
+            self.histograms[(stage, sensor)] = histogram
+        return histogram
+
+    def record(self, stage, duration, sensor=''):
+        self.histogram(stage, sensor).record(duration)
+
+    def lap(self, stage, t0, sensor=''):
+        t = time.perf_counter_ns()
+        self.histogram(stage, sensor).record(t - t0)
+        return t
+
+    def reset(self):
+        self.histograms = {}
+        self.start_wall_t = time.time()
+
+    def snapshot(self, percentiles=(50, 90, 99, 99.9)):
+        # One summary per (stage, sensor), in ms
+        return [dict(stage=stage, sensor=sensor, **histogram.summary(percentiles))
+                for (stage, sensor), histogram in sorted(self.histograms.items())]
+
+    def to_json(self, percentiles=(50, 90, 99, 99.9)):
+        return json.dumps({'start_time': self.start_wall_t, 'time': time.time(),
+                           'stages': self.snapshot(percentiles)}, indent=1)
+
+    def to_prometheus(self, buckets_per_decade=4):
+        # Cumulative buckets on every bins_per_decade / buckets_per_decade-th bin edge, so the text stays small
+        name = self.prefix + '_stage_latency_seconds'
+        lines = ['# HELP %s Latency of each stage of RecordingDevice.read()' % name, '# TYPE %s histogram' % name]
+        for (stage, sensor), histogram in sorted(self.histograms.items()):
+            labels = 'stage="%s",sensor="%s"' % (stage, sensor)
+            cumulative = np.cumsum(histogram.counts)
+            step = max(1, self.bins_per_decade // buckets_per_decade)
+            # cumulative[k] counts the durations below edges[k]
+            for k in range(0, len(histogram.edges), step):
+                lines.append('%s_bucket{%s,le="%.6g"} %d' % (name, labels, histogram.edges[k] / 1e9, cumulative[k]))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, histogram.n))
+            lines.append('%s_sum{%s} %.9f' % (name, labels, histogram.total / 1e9))
+            lines.append('%s_count{%s} %d' % (name, labels, histogram.n))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, fname, format=None):
+        # Replaces fname in one step, so readers never see half a file. The format defaults to JSON for .json
+        # files and Prometheus text otherwise
+        if format is None:
+            format = 'json' if fname.endswith('.json') else 'prometheus'
+        if format not in FORMATS:
+            raise ValueError('Unknown profile format: %r' % format)
+        text = self.to_json() if format == 'json' else self.to_prometheus()
+        tmp = fname + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, fname)
+
+    def start(self, fname, interval=10.0, format=None):
+        # Writes fname every interval seconds until stop()
+        self.fname = fname
+        self.format = format
+        self.interval = interval
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.dump(self.fname, self.format)
+
+    def stop(self):
+        # Stops the periodic dumps and writes the final numbers
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        self.dump(self.fname, self.format)
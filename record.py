@@ -1,33 +1,37 @@
-import datetime
-import sys
+import argparse
+import time
 
-from bluepy import btle
-
-from sensor import GyroAccelSensor, TempPressureSensor, AmbientLightSensor, RecordingDevice
+from discovery import connect, startup_logger
+from sensor import RecordingDevice
 
 if __name__=='__main__':
 
-    print('Scanning...')
-
-    scanner = btle.Scanner()
+    # An address on the command line is connected to directly, otherwise the last-known address is tried
+    # before scanning. For unattended runs --segment-minutes/--segment-mb rotate the output into numbered
+    # segments listed in a manifest (see rotation.py), and samples are not kept in memory
+    parser = argparse.ArgumentParser(description='Record a SENSOR_PRO')
+    parser.add_argument('address', nargs='?')
+    parser.add_argument('--out', default='test.tsv', help='output file, .tsv, .bin or .blz')
+    parser.add_argument('--segment-minutes', type=float, default=None, help='start a new segment every N minutes')
+    parser.add_argument('--segment-mb', type=float, default=None, help='start a new segment after M MB')
+    args = parser.parse_args()
+    segment_duration = args.segment_minutes * 60e3 if args.segment_minutes is not None else None
+    segment_bytes = int(args.segment_mb * 1e6) if args.segment_mb is not None else None
+    rotate = segment_duration is not None or segment_bytes is not None
+    start=time.perf_counter()
+    address=args.address
 
     sensor_address=None
-
     while sensor_address is None:
-        devices = scanner.scan(10.0)
-        for dev in devices:
-            addr=dev.addr
-            name=dev.getValueText(9)
-            if name=='SENSOR_PRO':
-                print('%s: %s' %  (name, addr))
-                sensor_address=addr
-                break
-
-    if sensor_address is not None:
-        dev=RecordingDevice(sensor_address)
-        dev.enable(gyro_acc=True, temp_press=False, ambient_light=False)
-
-        try:
-            dev.read('test.tsv')
-        finally:
-            dev.disconnect()
+        sensor_address, periph=connect(address)
+    print('Connected after %.2f s' % (time.perf_counter() - start))
+
+    # Reconnects to the same device if the link drops, the gaps are recorded in the output
+    dev=RecordingDevice(sensor_address, dev=periph, reconnect=lambda: connect(sensor_address)[1], keep=not rotate)
+    dev.enable(gyro_acc=True, temp_press=False, ambient_light=False)
+    dev.add_listener(startup_logger(start))
+
+    try:
+        dev.read(args.out, segment_duration=segment_duration, segment_bytes=segment_bytes)
+    finally:
+        dev.disconnect()
@@ -0,0 +1,128 @@
+import json
+import struct
+import numpy as np
+
+# Binary recording layout: MAGIC, little-endian uint32 header length, JSON header padded to 8 bytes, then
+# fixed-width little-endian records of float64 time (ms) followed by one value per channel
+MAGIC = b'BLESENS1'
+CHANNELS = ['g_x', 'g_y', 'g_z', 'a_x', 'a_y', 'a_z', 't', 'p', 'l']
+
+
+def record_dtype(channels, value_dtype='<f4'):
+    return np.dtype([('time', '<f8')] + [(name, value_dtype) for name in channels])
+
+
+def write_header(f, channels, rate=None, start_time=None, value_dtype='<f4', reserve=0, magic=MAGIC, **extra):
+    # reserve pads the JSON to at least that many bytes so update_header() can add fields once recording ends
+    header = {'version': 1, 'channels': list(channels), 'rate': rate, 'start_time': start_time,
+              'time_units': 'ms', 'value_dtype': value_dtype}
+    header.update(extra)
+    text = json.dumps(header).encode('utf-8')
+    text = text + b' ' * max(reserve - len(text), 0)
+    pad = -(len(MAGIC) + 4 + len(text)) % 8
+    text = text + b' ' * pad
+    f.write(magic + struct.pack('<I', len(text)) + text)
+    header['offset'] = len(magic) + 4 + len(text)
+    return header
+
+
+def update_header(f, header, **fields):
+    # Rewrites the header returned by write_header() in place with fields added, returns False if it no longer
+    # fits the space written (or reserved) for it
+    header = dict(header, **fields)
+    offset = header.pop('offset')
+    text = json.dumps(header).encode('utf-8')
+    length = offset - len(MAGIC) - 4
+    if len(text) > length:
+        return False
+    pos = f.tell()
+    f.seek(len(MAGIC) + 4)
+    f.write(text + b' ' * (length - len(text)))
+    f.seek(pos)
+    return True
+
+
+def read_header(f, magic=MAGIC):
+    if f.read(len(magic)) != magic:
+        raise ValueError('Not a binary recording')
+    (length,) = struct.unpack('<I', f.read(4))
+    header = json.loads(f.read(length).decode('utf-8'))
+    header['offset'] = len(magic) + 4 + length
+    return header
+
+
+class RecordEncoder:
+    # Packs (t, values) batches into fixed-width records, used as the encode step of StreamWriter
+
+    def __init__(self, channels, value_dtype='<f4'):
+        self.channels = list(channels)
+        self.dtype = record_dtype(self.channels, value_dtype)
+
+    def __call__(self, t, values):
+        records = np.empty(len(t), dtype=self.dtype)
+        records['time'] = t
+        for idx, name in enumerate(self.channels):
+            records[name] = values[:, idx]
+        return records.tobytes()
+
+
+def open_recording(fname):
+    # Returns the header and a read-only np.memmap of the records, the data itself is only paged in on access
+    with open(fname, 'rb') as f:
+        header = read_header(f)
+    dtype = record_dtype(header['channels'], header['value_dtype'])
+    with open(fname, 'rb') as f:
+        f.seek(0, 2)
+        n = (f.tell() - header['offset']) // dtype.itemsize
+    if n == 0:
+        return header, np.zeros(0, dtype=dtype)
+    # A truncated last record (e.g. after a crash) is ignored
+    return header, np.memmap(fname, dtype=dtype, mode='r', offset=header['offset'], shape=(n,))
+
+
+def is_binary(fname):
+    with open(fname, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_start_time(line):
+    # The wall-clock anchor of a TSV recording, a '# start_time' comment line right after the column names
+    if line.startswith('# start_time\t'):
+        return float(line.split('\t')[1])
+    return None
+
+
+def tsv_to_binary(tsv_fname, bin_fname, rate=None, start_time=None, value_dtype='<f4', chunk_size=65536,
+                  **extra):
+    with open(tsv_fname) as src, open(bin_fname, 'wb') as dst:
+        channels = src.readline().strip().split('\t')[1:]
+        lines = [src.readline()]
+        if start_time is None:
+            start_time = read_start_time(lines[0])
+        write_header(dst, channels, rate, start_time, value_dtype, **extra)
+        encode = RecordEncoder(channels, value_dtype)
+        while True:
+            lines += [line for _, line in zip(range(chunk_size), src)]
+            if not lines:
+                break
+            # '#' comment lines, e.g. the gap list at the end of a supervised recording, may fill a whole chunk
+            rows = [line for line in lines if line.strip() and not line.startswith('#')]
+            lines = []
+            if not rows:
+                continue
+            rows = np.loadtxt(rows, delimiter='\t', ndmin=2)
+            dst.write(encode(rows[:, 0], rows[:, 1:]))
+
+
+def binary_to_tsv(bin_fname, tsv_fname, chunk_size=65536):
+    header, records = open_recording(bin_fname)
+    channels = header['channels']
+    row_fmt = '%.2f' + '\t%.3f' * len(channels) + '\n'
+    with open(tsv_fname, 'w') as dst:
+        dst.write('\t'.join(['time'] + channels) + '\n')
+        if header.get('start_time') is not None:
+            dst.write('# start_time\t%.6f\n' % header['start_time'])
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start:start + chunk_size]
+            rows = np.column_stack([chunk['time']] + [chunk[name] for name in channels])
+            dst.write((row_fmt * len(rows)) % tuple(rows.ravel().tolist()))
@@ -0,0 +1,210 @@
+import os
+import sys
+import numpy as np
+
+from loader import load
+from recording import RecordEncoder, write_header
+
+# Puts recorded channels onto a uniform time grid of rate Hz, the grid times being multiples of 1000 / rate ms.
+# Rows are clocked by the first enabled sensor and slower sensors repeat their latest value (see
+# RecordingDevice.drain()), so each held sensor is resampled from the rows where its values change, i.e. from
+# when each new reading arrived. 'linear' interpolates between samples, 'antialias' averages the linear
+# interpolant over each grid interval (a box filter, for grids coarser than the sampling rate). Nothing is
+# interpolated across NaN rows (gap markers) or, with max_gap, across samples more than max_gap ms apart: the
+# grid points they touch are NaN. Resampler works incrementally on (t, block) batches, as a RecordingDevice
+# listener or through resample_file(), which goes through recordings chunk by chunk.
+
+SENSORS = [['g_x', 'g_y', 'g_z', 'a_x', 'a_y', 'a_z'], ['t', 'p'], ['l']]
+METHODS = ['linear', 'antialias']
+
+
+def sensor_groups(channels):
+    # Column indices of each sensor in channels in column order, unknown channels are groups of their own
+    groups = [[channels.index(name) for name in sensor if name in channels] for sensor in SENSORS]
+    groups = [cols for cols in groups if cols]
+    known = [idx for cols in groups for idx in cols]
+    groups += [[idx] for idx in range(len(channels)) if idx not in known]
+    return sorted(groups, key=min)
+
+
+def interpolate(ts, values, grid, half=0.0, max_gap=None):
+    # Linear interpolation of the samples at grid or, with half > 0, the mean of the interpolant over
+    # [grid - half, grid + half]. NaN where the samples do not cover it, are NaN or more than max_gap apart
+    out = np.full((len(grid), values.shape[1]), np.nan)
+    if len(ts) < 2 or not len(grid):
+        return out
+    span = np.diff(ts)[:, np.newaxis]
+    bad = np.isnan(values[:-1]) | np.isnan(values[1:])
+    if max_gap is not None:
+        bad |= span > max_gap
+    clean = np.nan_to_num(values)
+    slope = np.divide(np.diff(clean, axis=0), span, out=np.zeros_like(bad, dtype=np.float64), where=span > 0)
+    last = len(ts) - 2
+    if half == 0:
+        idx = np.clip(np.searchsorted(ts, grid, 'right') - 1, 0, last)
+        value = clean[idx] + slope[idx] * (grid - ts[idx])[:, np.newaxis]
+        invalid = bad[idx] | ((grid < ts[0]) | (grid > ts[-1]))[:, np.newaxis]
+    else:
+        # integral of the interpolant from ts[0], exact for a piecewise linear signal
+        area = np.concatenate((np.zeros((1, values.shape[1])),
+                               np.cumsum(np.where(bad, 0.0, 0.5 * (clean[:-1] + clean[1:]) * span), axis=0)))
+        start, end = grid - half, grid + half
+        lo = np.clip(np.searchsorted(ts, start, 'right') - 1, 0, last)
+        hi = np.clip(np.searchsorted(ts, end, 'right') - 1, 0, last)
+
+        def integral(x, idx):
+            dx = (x - ts[idx])[:, np.newaxis]
+            return area[idx] + clean[idx] * dx + 0.5 * slope[idx] * dx * dx
+        value = (integral(end, hi) - integral(start, lo)) / (2 * half)
+        bad_count = np.concatenate((np.zeros((1, values.shape[1])), np.cumsum(bad, axis=0)))
+        invalid = (bad_count[hi + 1] - bad_count[lo] > 0) | ((start < ts[0]) | (end > ts[-1]))[:, np.newaxis]
+    return np.where(invalid, np.nan, value)
+
+
+class Track:
+    # Samples of one sensor's columns from the last one still needed onwards. For a held sensor only rows where
+    # its values change are samples, and its latest value is taken to hold until the newest row
+
+    def __init__(self, cols, held):
+        self.cols = cols
+        self.held = held
+        self.t = np.empty(0)
+        self.values = np.empty((0, len(cols)))
+        self.last = None
+        self.last_t = None
+
+    def add(self, t, values):
+        if self.held:
+            prev = np.concatenate((values[:1] if self.last is None else self.last, values[:-1]))
+            changed = (values != prev).any(axis=1)
+            if self.last is None:
+                changed[0] = True
+            # the value held up to a gap marker is valid until the row before it
+            gap = changed & np.isnan(values).any(axis=1) & ~np.isnan(prev).any(axis=1)
+            rows = changed | np.append(gap[1:], False)
+            if gap[0] and self.last is not None and self.last_t > self.t[-1]:
+                t = np.concatenate(([self.last_t], t))
+                values = np.concatenate((self.last, values))
+                rows = np.concatenate(([True], rows))
+            self.last = values[-1:]
+            self.last_t = t[-1]
+            t, values = t[rows], values[rows]
+        self.t = np.concatenate((self.t, t))
+        self.values = np.concatenate((self.values, values))
+
+    def ready(self, last_t, hold):
+        # Time up to which the samples are final
+        if not self.held or not len(self.t):
+            return last_t
+        return max(self.t[-1], last_t - hold)
+
+    def samples(self, ready):
+        if self.held and len(self.t) and ready > self.t[-1]:
+            return np.append(self.t, ready), np.concatenate((self.values, self.values[-1:]))
+        return self.t, self.values
+
+    def trim(self, t):
+        keep = max(0, np.searchsorted(self.t, t, 'right') - 1)
+        self.t = self.t[keep:]
+        self.values = self.values[keep:]
+
+
+class Resampler:
+    # held lists the channels that repeat their latest value between readings, by default every sensor but the
+    # first. A held value is assumed unchanged hold ms after the newest row, so a constant sensor does not stall
+    # the output. update() and flush() return (and pass to callback) the grid rows completed so far
+
+    def __init__(self, channels, rate, method='linear', max_gap=None, held=None, hold=2000.0, callback=None):
+        if method not in METHODS:
+            raise ValueError('Unknown resampling method: %r' % method)
+        self.channels = list(channels)
+        self.rate = rate
+        self.step = 1e3 / rate
+        self.half = self.step / 2 if method == 'antialias' else 0.0
+        self.max_gap = max_gap
+        self.hold = hold
+        self.callback = callback
+        groups = sensor_groups(self.channels)
+        if held is None:
+            held = [self.channels[idx] for cols in groups[1:] for idx in cols]
+        self.tracks = [Track(cols, any(self.channels[idx] in held for idx in cols)) for cols in groups]
+        self.next = None
+        self.last_t = None
+
+    def update(self, t, block):
+        t = np.asarray(t, dtype=np.float64)
+        block = np.asarray(block, dtype=np.float64)
+        if not len(t):
+            return self.emit(self.last_t, self.hold)
+        for track in self.tracks:
+            track.add(t, block[:, track.cols])
+        if self.next is None:
+            self.next = int(np.ceil((t[0] + self.half) / self.step))
+        self.last_t = float(t[-1])
+        return self.emit(self.last_t, self.hold)
+
+    def flush(self):
+        # Grid rows up to the last row received, held values extended to it
+        return self.emit(self.last_t, 0.0)
+
+    def emit(self, last_t, hold):
+        dim = len(self.channels)
+        if self.next is None:
+            return np.empty(0), np.empty((0, dim))
+        ready = min(track.ready(last_t, hold) for track in self.tracks)
+        last = int(np.floor((ready - self.half) / self.step))
+        if last < self.next:
+            return np.empty(0), np.empty((0, dim))
+        grid = np.arange(self.next, last + 1) * self.step
+        block = np.empty((len(grid), dim))
+        for track in self.tracks:
+            block[:, track.cols] = interpolate(*track.samples(ready), grid, self.half, self.max_gap)
+            track.trim((last + 1) * self.step - self.half)
+        self.next = last + 1
+        if self.callback is not None:
+            self.callback(grid, block)
+        return grid, block
+
+
+def resample(t, values, channels, rate, method='linear', max_gap=None, held=None):
+    # In-memory version: (grid times, values) of a whole recording
+    resampler = Resampler(channels, rate, method, max_gap, held)
+    parts = [resampler.update(t, values), resampler.flush()]
+    return np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts])
+
+
+def resample_file(src, dst, rate, method='linear', max_gap=None, chunk_size=65536):
+    # Resamples a recording (TSV or binary) into dst, binary if it ends in .bin. Only chunk_size rows are in memory
+    # at a time, binary sources are memory-mapped and TSV ones go through the loader's binary sidecar
+    header, records = load(src)
+    channels = header['channels']
+    resampler = Resampler(channels, rate, method, max_gap)
+    n = 0
+    binary = dst.endswith('.bin')
+    with open(dst, 'wb' if binary else 'w') as f:
+        if binary:
+            write_header(f, channels, rate=rate, start_time=header.get('start_time'),
+                         resampled_from=os.path.basename(src), method=method)
+            encode = RecordEncoder(channels)
+        else:
+            f.write('\t'.join(['time'] + channels) + '\n')
+            fmt = ['%.2f'] + ['%.3f'] * len(channels)
+
+        def write(t, block):
+            if binary:
+                f.write(encode(t, block))
+            else:
+                np.savetxt(f, np.column_stack((t, block)), fmt=fmt, delimiter='\t')
+            return len(t)
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start:start + chunk_size]
+            n += write(*resampler.update(chunk['time'], np.column_stack([chunk[name] for name in channels])))
+        n += write(*resampler.flush())
+    return n
+
+
+if __name__=='__main__':
+    # python resample.py recording output rate [linear|antialias]
+    method = sys.argv[4] if len(sys.argv) > 4 else 'linear'
+    n = resample_file(sys.argv[1], sys.argv[2], float(sys.argv[3]), method)
+    print('%d rows at %s Hz written to %s' % (n, sys.argv[3], sys.argv[2]))
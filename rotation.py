@@ -0,0 +1,139 @@
+import json
+import os
+import sys
+import numpy as np
+
+from recording import record_dtype
+
+# Rotation of a recording over segment files for long unattended runs: run.bin is written as run_0000.bin,
+# run_0001.bin, ... (TSV, binary or .blz, as the extension of run selects). Every segment is a complete recording
+# with its own header. A new segment starts once the current one reaches the next multiple of duration ms, so
+# segments line up with fixed periods of the run, or holds max_bytes. Times are relative to the same start in
+# every segment, so the segments join into one continuous stream. run.manifest.json lists the segments with
+# their time ranges, sample counts and sizes. It is rewritten whenever a segment is opened or closed, so a
+# manifest can be read while recording or after a crash. load() and iter_segments() read a manifest as one
+# recording, loader.load() accepts manifests too.
+
+MANIFEST_EXT = '.manifest.json'
+
+
+def segment_fname(fname, idx):
+    base, ext = os.path.splitext(fname)
+    return '%s_%04d%s' % (base, idx, ext)
+
+
+def manifest_fname(fname):
+    return os.path.splitext(fname)[0] + MANIFEST_EXT
+
+
+class Segments:
+    # Segment bookkeeping for StreamWriter(segments=...). open_segment(fname, idx) opens a segment and writes its
+    # header, returning (f, encode) like the arguments of StreamWriter. finish(f) runs before each segment is
+    # closed, as StreamWriter.close(finish) does for the last one. fields go in the manifest
+
+    def __init__(self, fname, open_segment, duration=None, max_bytes=None, finish=None, **fields):
+        if duration is None and max_bytes is None:
+            raise ValueError('Segments need a duration or max_bytes')
+        self.fname = fname
+        self.manifest = manifest_fname(fname)
+        self.open_segment = open_segment
+        self.duration = duration
+        self.max_bytes = max_bytes
+        self.finish = finish
+        self.fields = fields
+        self.segments = []
+        self.current = None
+        # time (ms) at which the current segment ends, set by its first sample
+        self.end = None
+
+    def open(self):
+        fname = segment_fname(self.fname, len(self.segments))
+        f, encode = self.open_segment(fname, len(self.segments))
+        self.current = {'file': os.path.basename(fname), 't0': None, 't1': None, 'samples': 0, 'bytes': f.tell(),
+                        'complete': False}
+        self.segments.append(self.current)
+        self.end = None
+        self.write_manifest()
+        return f, encode
+
+    def due(self, t):
+        # Whether a sample at t ms goes in a new segment
+        if not self.current['samples']:
+            return False
+        if self.max_bytes is not None and self.current['bytes'] >= self.max_bytes:
+            return True
+        return self.end is not None and t >= self.end
+
+    def cut(self, t):
+        # How many of the samples at t belong in the current segment
+        if self.duration is None:
+            return len(t)
+        if self.end is None:
+            self.end = (np.floor(t[0] / self.duration) + 1) * self.duration
+        return max(1, int(np.searchsorted(t, self.end)))
+
+    def add(self, t, size):
+        if self.current['t0'] is None:
+            self.current['t0'] = float(t[0])
+        self.current['t1'] = float(t[-1])
+        self.current['samples'] += len(t)
+        self.current['bytes'] += size
+
+    def closed(self):
+        self.current['bytes'] = os.path.getsize(os.path.join(os.path.dirname(self.fname), self.current['file']))
+        self.current['complete'] = True
+        self.write_manifest()
+
+    def write_manifest(self):
+        manifest = dict(self.fields, version=1, duration=self.duration, max_bytes=self.max_bytes,
+                        segments=self.segments)
+        tmp = self.manifest + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, self.manifest)
+
+
+def read_manifest(fname):
+    with open(fname) as f:
+        return json.load(f)
+
+
+def overlaps(entry, t0, t1):
+    # Segments still open (or left open by a crash) have no time range in the manifest and always overlap
+    if entry['t0'] is None:
+        return not entry['complete']
+    return (t0 is None or entry['t1'] >= t0) and (t1 is None or entry['t0'] <= t1)
+
+
+def iter_segments(fname, t0=None, t1=None):
+    # (header, records) of each segment with samples between t0 and t1 ms (None for open ends), one segment in
+    # memory at a time
+    from loader import load as load_recording
+    root = os.path.dirname(fname)
+    for entry in read_manifest(fname)['segments']:
+        if not overlaps(entry, t0, t1):
+            continue
+        header, records = load_recording(os.path.join(root, entry['file']))
+        keep = np.ones(len(records), dtype=bool)
+        if t0 is not None:
+            keep &= records['time'] >= t0
+        if t1 is not None:
+            keep &= records['time'] <= t1
+        yield header, records if keep.all() else records[keep]
+
+
+def load(fname, t0=None, t1=None):
+    # (header, records) like loader.load(), the segments between t0 and t1 ms joined. The header is the manifest
+    manifest = read_manifest(fname)
+    parts = [records for header, records in iter_segments(fname, t0, t1)]
+    if not parts:
+        return manifest, np.empty(0, dtype=record_dtype(manifest['channels'], '<f8'))
+    return manifest, np.concatenate(parts)
+
+
+if __name__=='__main__':
+    # python rotation.py run.manifest.json lists the segments of a rotated recording
+    manifest = read_manifest(sys.argv[1])
+    for entry in manifest['segments']:
+        print('%s\t%s\t%s\t%d samples\t%d bytes%s' % (entry['file'], entry['t0'], entry['t1'], entry['samples'],
+                                                      entry['bytes'], '' if entry['complete'] else '\t(open)'))
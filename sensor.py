@@ -1,117 +1,587 @@
 import datetime
+import threading
+import time
 import numpy as np
 from bluepy import btle
-from bluepy.btle import AssignedNumbers
-import matplotlib.pyplot as plt
+
+import chunked
+from gatt import CACHE_FILE, SAMPLE_INTERVAL_UUID, decode_rate, discover, encode_rate, resolve
+from packets import PacketLayout
+from profiling import StageProfiler
+from rotation import Segments
+from recording import RecordEncoder, update_header, write_header
+from store import RawArena, SampleStore
+from summary import WindowStats
+from timing import IntervalHistogram
+from writer import StreamWriter
 
 class RecordingDevice:
 
-    def __init__(self, address):
-        print("Connecting...")
-        self.dev = btle.Peripheral(address, "random")
-        print('Connected!')
+    def __init__(self, address, notify=True, notify_timeout=1.0, drain_interval=0.05, dev=None, raw=False,
+                 handle_cache=CACHE_FILE, reconnect=None, backoff=0.5, max_backoff=10.0, keep=True):
+        if dev is None:
+            print("Connecting...")
+            dev = btle.Peripheral(address, "random")
+            print('Connected!')
+        self.dev = dev
+        self.address = address if address is not None else getattr(dev, 'addr', None)
+        # GATT handles are resolved once per connection in enable() and shared by all sensors, from
+        # handle_cache when it still matches the device (None to always discover)
+        self.handle_cache = handle_cache
+        self.handles = None
+        # With reconnect (a callable returning a new connected peripheral, or None if it failed) read() survives
+        # link loss: it marks the gap in the output, retries with exponential backoff from backoff up to
+        # max_backoff seconds and re-enables the same sensors
+        self.reconnect = reconnect
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.gaps = []
+        self.enable_kwargs = {}
+        self.header = None
+        # In notify mode the delegate dispatches pushed payloads to each sensor's buffer and read() drains them,
+        # falling back to polling with data.read() if nothing arrives within notify_timeout. In raw mode payloads
+        # are only stored and are decoded in one pass per sensor at disconnect
+        self.notify = notify or raw
+        self.raw = raw
+        self.start_t = None
+        self.received = 0
+        self.first_sample_t = None
+        self.last_sample_t = None
+        self.notify_timeout = notify_timeout
+        self.drain_interval = drain_interval
         self.gyro_acc = GyroAccelSensor(self.dev)
         self.temp_press = TempPressureSensor(self.dev)
         self.ambient_light = AmbientLightSensor(self.dev)
+        self.sensors = [self.gyro_acc, self.temp_press, self.ambient_light]
+        self.delegate = SensorDelegate()
+        self.dev.withDelegate(self.delegate)
         self.data=[]
-        self.t_log=[]
-        self.data_log=[]
+        # rate is the sampling rate the device confirmed, requested_rate the one asked for in enable()
+        self.rate = None
+        self.requested_rate = None
+        self.calibration = None
+        # keep=False only counts samples instead of holding them in self.store, so memory stays constant on long
+        # runs that only need the file, listeners or summarize()
+        self.keep = keep
+        self.store = SampleStore(0)
+        self.writer = None
+        self.listeners = []
+        self.summary = None
+        # Per-stage latency histograms, see profile(). None costs one check per stage in the hot loop
+        self.profiler = None
+        self.running = False
+
+    def enable(self, gyro_acc=False, temp_press=False, ambient_light=False, rate=100):
+        self.enable_kwargs = {'gyro_acc': gyro_acc, 'temp_press': temp_press, 'ambient_light': ambient_light,
+                              'rate': rate}
+        if self.handles is None:
+            self.handles = resolve(self.dev, self.address, [sensor.dataUUID for sensor in self.sensors],
+                                   self.handle_cache)
+            for sensor in self.sensors:
+                sensor.use_handles(self.handles)
 
-    def enable(self, gyro_acc=False, temp_press=False, ambient_light=False):
-        # Set sampling rate to 100
         print('Setting sampling rate')
-        MPU6050Service = self.dev.getServiceByUUID('6a800001-b5a3-f393-e0a9-e50e24dcca9e')
-        SampIntChar = MPU6050Service.getCharacteristics('6a80ff0c-b5a3-f393-e0a9-e50e24dcca9e')[0]
-        self.dev.writeCharacteristic(SampIntChar.valHandle, b"\x00\x64")
+        if not self.running:
+            self.requested_rate = rate
+        self.set_rate(rate)
 
         print('Enabling sensors')
         dim=0
         if gyro_acc:
-            self.gyro_acc.enable()
+            self.gyro_acc.enable(notify=self.notify, raw=self.raw)
             dim=dim+6
         else:
             self.gyro_acc.disable()
         if temp_press:
-            self.temp_press.enable()
+            self.temp_press.enable(notify=self.notify, raw=self.raw)
             dim=dim+2
         else:
             self.temp_press.disable()
         if ambient_light:
-            self.ambient_light.enable()
+            self.ambient_light.enable(notify=self.notify, raw=self.raw)
             dim=dim+1
         else:
             self.ambient_light.disable()
-        self.data=np.zeros((1,dim))
-        self.data_log=[]#np.zeros((self.n,dim))
-
-    def read(self, fname=None):
+        self.delegate.handles = {}
+        for sensor in self.enabled_sensors():
+            self.delegate.add(sensor)
+        # Re-enabling after a reconnect keeps the samples recorded so far
+        if not self.running:
+            # NaN until each sensor has reported, rows are only emitted from then on (see drain())
+            self.data=np.full((1,dim), np.nan)
+            self.store = SampleStore(dim, keep=self.keep)
+
+    def set_rate(self, rate):
+        # Writes the sampling rate and reads it back, the device may settle on a different one
+        handle = self.handles[SAMPLE_INTERVAL_UUID]['value']
+        self.dev.writeCharacteristic(handle, encode_rate(rate), withResponse=True)
+        self.rate = decode_rate(self.dev.readCharacteristic(handle))
+        if self.rate != int(round(rate)):
+            print('Device set sampling rate to %d Hz instead of %d Hz' % (self.rate, rate))
+        return self.rate
+
+    def calibrate(self, duration=2.0, step_down=True, step=0.8, min_rate=10, max_dropped=0.01):
+        # Measures the rate actually delivered over a short capture that is not kept. With step_down the rate is
+        # lowered by step until at most max_dropped of the expected samples go missing or min_rate is reached
+        steps = []
+        while True:
+            timer = threading.Timer(duration, self.stop)
+            timer.start()
+            self.read()
+            if self.raw:
+                self.flush_raw()
+            stats = self.stats()
+            dropped = stats['dropped'] / max(stats['samples'] + stats['dropped'], 1)
+            steps.append({'rate': self.rate, 'achieved_rate': stats['rate'], 'dropped': dropped})
+            self.reset()
+            if not step_down or dropped <= max_dropped or self.rate <= min_rate:
+                break
+            self.set_rate(max(min_rate, int(self.rate * step)))
+        print('Sampling at %d Hz, %.1f Hz delivered' % (self.rate, steps[-1]['achieved_rate']))
+        self.enable_kwargs['rate'] = self.rate
+        self.calibration = steps
+        return steps[-1]
+
+    def reset(self):
+        # Forgets everything captured so far, e.g. during calibration
+        self.store.clear()
+        self.received = 0
+        self.first_sample_t = None
+        self.last_sample_t = None
+        self.gaps = []
+        for sensor in self.sensors:
+            sensor.jitter = IntervalHistogram()
+            sensor.jitter_n = 0
+            sensor.malformed = 0
+            if sensor.buffer is not None:
+                sensor.buffer.drain()
+            if sensor.arena is not None:
+                sensor.arena.clear()
+
+    def read(self, fname=None, start_t=None, segment_duration=None, segment_bytes=None):
         print('Recording data')
+        # Samples are timestamped with time.perf_counter_ns() relative to start_t, which several devices can share,
+        # and start_wall_t is the wall-clock anchor written to the file header (a '# start_time' line in TSV).
+        # With segment_duration (ms) or segment_bytes the file is rotated into numbered segments with a manifest,
+        # see rotation.py. keep=False then keeps memory bounded on unattended runs of any length
+        self.start_wall_t = time.time()
+        self.start_t = start_t if start_t is not None else time.perf_counter_ns()
+        self.resumed_t = self.start_t
+        self.running = True
+        self.header = None
         if fname is not None:
-            self.log_file=open(fname, 'w')
-            self.log_file.write('time')
-            if self.gyro_acc.enabled:
-                self.log_file.write('\tg_x\tg_y\tg_z\ta_x\ta_y\ta_z')
-            if self.temp_press.enabled:
-                self.log_file.write('\tt\tp')
-            if self.ambient_light.enabled:
-                self.log_file.write('\tl')
-            self.log_file.write('\n')
-
-        start_t = datetime.datetime.now()
-        #last_t=start_t
+            if segment_duration is None and segment_bytes is None:
+                log_file, encode = self.open_log(fname)
+                self.writer = StreamWriter(log_file, self.data.shape[1], encode=encode)
+            else:
+                segments = Segments(fname, self.open_log, segment_duration, segment_bytes, self.write_metadata,
+                                    channels=self.channels(), rate=self.rate, requested_rate=self.requested_rate,
+                                    start_time=self.start_wall_t)
+                self.writer = StreamWriter(None, self.data.shape[1], segments=segments)
+            self.writer.start()
+
         while True:
+            try:
+                self.acquire()
+                break
+            except btle.BTLEDisconnectError:
+                if self.reconnect is None:
+                    raise
+                self.recover()
+
+    def acquire(self):
+        if self.raw:
+            while self.running:
+                self.dev.waitForNotifications(self.notify_timeout)
+
+        elif self.notify:
+            self.read_notifications()
+
+        prof = self.profiler
+        while self.running:
+            if prof is not None:
+                sample_t = time.perf_counter_ns()
             idx=0
-            if self.gyro_acc.enabled:
-                (gyro, accel) = self.gyro_acc.read()
-                self.data[0,idx:idx+3]=gyro
-                self.data[0,idx+3:idx+6]=accel
-                idx=idx+6
-            if self.temp_press.enabled:
-                (temp, press) = self.temp_press.read()
-                self.data[0,idx+6]=temp
-                self.data[0,idx+7]=press
-                idx=idx+2
-            if self.ambient_light.enabled:
-                amb_light = self.ambient_light.read()
-                self.data[0,idx]=amb_light
-            t=datetime.datetime.now()
-            #dt=(t-last_t).total_seconds()*1000.0
-            #print('%.2f' % dt)
-            #last_t=t
-            #print('%.2f:' % ((t - start_t).total_seconds() * 1000.0))
-            #print(self.data)
-            self.t_log.append((t - start_t).total_seconds() * 1000.0)
-            self.data_log.append(np.copy(self.data))
-        # plt.figure()
-        # plt.hist(self.dts, 100)
-        # plt.show()
+            for sensor in self.enabled_sensors():
+                sensor.read()
+                if prof is not None:
+                    lap = time.perf_counter_ns()
+                sensor.fill(self.data[0, idx:idx+sensor.dim])
+                if prof is not None:
+                    prof.lap('fill', lap, sensor.name)
+                idx=idx+sensor.dim
+            t=time.perf_counter_ns()
+            for sensor in self.enabled_sensors():
+                sensor.jitter.add_one(t)
+            self.count_samples((t,))
+            t_ms = (t - self.start_t) / 1e6
+            if prof is not None:
+                lap = prof.lap('jitter', t)
+            self.store.append(t_ms, self.data[0])
+            if prof is not None:
+                lap = prof.lap('store', lap)
+            if self.writer is not None:
+                self.writer.append(t_ms, self.data[0])
+                if prof is not None:
+                    lap = prof.lap('write', lap)
+            for listener in self.listeners:
+                listener(np.array([t_ms]), self.data)
+            if prof is not None:
+                if self.listeners:
+                    prof.lap('listeners', lap)
+                prof.lap('sample', sample_t)
+
+    def open_log(self, fname, segment=None):
+        # Opens fname in the format its extension selects and writes its header, returns the file and the
+        # writer's encode step
+        channels = self.channels()
+        fields = {} if segment is None else {'segment': segment}
+        if fname.endswith('.bin'):
+            self.log_file=open(fname, 'wb')
+            self.header = write_header(self.log_file, channels, rate=self.rate, start_time=self.start_wall_t,
+                                       requested_rate=self.requested_rate, reserve=4096, **fields)
+            encode = RecordEncoder(channels)
+        elif fname.endswith(chunked.EXT):
+            # compressed chunks with a time index, see chunked.py
+            self.log_file=open(fname, 'wb')
+            self.header = chunked.write_header(self.log_file, channels, rate=self.rate, start_time=self.start_wall_t,
+                                               requested_rate=self.requested_rate, reserve=4096, **fields)
+            encode = chunked.ChunkEncoder(self.header)
+        else:
+            self.log_file=open(fname, 'w')
+            self.log_file.write('\t'.join(['time'] + channels) + '\n')
+            self.log_file.write('# start_time\t%.6f\n' % self.start_wall_t)
+            encode = None
+        return self.log_file, encode
+
+    def recover(self):
+        # Keeps what was received before the link dropped, marks the gap with a row of NaNs from the last sample
+        # received, then reconnects and re-enables the same sensors at the same rate
+        print('Link lost, reconnecting...')
+        if self.raw:
+            self.flush_raw()
+        elif self.notify:
+            self.publish(*self.drain())
+        lost_t = time.perf_counter_ns()
+        if self.last_sample_t is not None:
+            lost_t = int(max(self.last_sample_t, self.resumed_t))
+        self.mark_gap(lost_t)
+        try:
+            self.dev.disconnect()
+        except btle.BTLEException:
+            pass
+        delay = self.backoff
+        attempts = 0
+        dev = None
+        while self.running and dev is None:
+            attempts += 1
+            try:
+                dev = self.reconnect()
+            except btle.BTLEException:
+                dev = None
+            if dev is None:
+                time.sleep(delay)
+                delay = min(2 * delay, self.max_backoff)
+        if dev is not None:
+            self.dev = dev
+            self.dev.withDelegate(self.delegate)
+            for sensor in self.sensors:
+                sensor.periph = dev
+                sensor.handle = None
+            self.handles = None
+            self.enable(**self.enable_kwargs)
+        restored_t = time.perf_counter_ns()
+        self.resumed_t = restored_t
+        self.gaps.append({'lost': (lost_t - self.start_t) / 1e6, 'restored': (restored_t - self.start_t) / 1e6,
+                          'attempts': attempts})
+        if dev is not None:
+            print('Reconnected after %.2f s, %d attempts' % ((restored_t - lost_t) / 1e9, attempts))
+
+    def mark_gap(self, t):
+        t = np.array([(t - self.start_t) / 1e6])
+        block = np.full((1, self.data.shape[1]), np.nan)
+        self.store.extend(t, block)
+        if self.writer is not None:
+            self.writer.extend(t, block)
+
+    def downtime(self):
+        # Gap statistics of a supervised recording, durations in seconds
+        durations = [(gap['restored'] - gap['lost']) / 1e3 for gap in self.gaps]
+        return {'gaps': len(self.gaps), 'downtime': sum(durations), 'longest_gap': max(durations, default=0.0),
+                'reconnect_attempts': sum(gap['attempts'] for gap in self.gaps)}
+
+    def write_metadata(self, f):
+        # Requested, confirmed and achieved sampling rates and, if the link dropped, the gap list and downtime go
+        # in the reserved header space of binary files and in trailing '#' comment lines of TSV files
+        fields = {'requested_rate': self.requested_rate, 'rate': self.rate, 'achieved_rate': self.stats()['rate']}
+        if self.gaps:
+            fields.update(self.downtime())
+        if self.header is not None:
+            if not update_header(f, self.header, calibration=self.calibration, gap_list=self.gaps, **fields):
+                update_header(f, self.header, **fields)
+            return
+        f.write('# rate\t%d\t%d\t%.2f\n' % (fields['requested_rate'], fields['rate'], fields['achieved_rate']))
+        if self.gaps:
+            summary = self.downtime()
+            for gap in self.gaps:
+                f.write('# gap\t%.2f\t%.2f\t%d\n' % (gap['lost'], gap['restored'], gap['attempts']))
+            f.write('# downtime\t%.3f\t%d\t%.3f\t%d\n' % (summary['downtime'], summary['gaps'],
+                                                          summary['longest_gap'], summary['reconnect_attempts']))
+
+    def read_notifications(self):
+        received = False
+        while self.running:
+            drain_t = time.time() + self.drain_interval
+            while time.time() < drain_t:
+                if self.profiler is not None:
+                    lap = time.perf_counter_ns()
+                notified = self.dev.waitForNotifications(self.notify_timeout)
+                if self.profiler is not None:
+                    self.profiler.lap('wait', lap)
+                if notified:
+                    received = True
+                elif not received:
+                    print('No notifications received, falling back to polling')
+                    self.notify = False
+                    for sensor in self.enabled_sensors():
+                        sensor.buffer = None
+                    return
+            self.publish(*self.drain())
+        self.publish(*self.drain())
+
+    def publish(self, t, block):
+        if self.profiler is not None:
+            lap = time.perf_counter_ns()
+        if self.writer is not None:
+            self.writer.extend(t, block)
+            if self.profiler is not None:
+                lap = self.profiler.lap('write', lap)
+        for listener in self.listeners:
+            listener(t, block)
+        if self.profiler is not None and self.listeners:
+            self.profiler.lap('listeners', lap)
+
+    def add_listener(self, listener):
+        # listener(t, block) is called with every batch of new rows (times in ms, one row per sample)
+        self.listeners.append(listener)
+
+    def summarize(self, window=1000.0, step=None, callback=None, fname=None):
+        # Per-channel count/mean/std/min/max/RMS over tumbling windows of window ms and a window sliding by step ms,
+        # see summary.WindowStats. Call after enable(), the open window is emitted at disconnect
+        self.summary = WindowStats(self.channels(), window=window, step=step, callback=callback, fname=fname)
+        self.add_listener(self.summary.update)
+        return self.summary
+
+    def profile(self, fname=None, interval=10.0, format=None):
+        # Latency histograms of each stage of read() per sensor: the BLE round trip ('read'), payload decoding
+        # ('decode'), copying into the sample row ('fill'), timing bookkeeping ('jitter'), the sample store
+        # ('store', 'drain' for notification batches), the file writer ('write'), listeners ('listeners') and the
+        # whole polled sample ('sample'); in notify mode 'wait' is the time spent in waitForNotifications. With
+        # fname they are written every interval s and at disconnect, see profiling.StageProfiler
+        self.profiler = StageProfiler()
+        for sensor in self.sensors:
+            sensor.profiler = self.profiler
+        if fname is not None:
+            self.profiler.start(fname, interval, format)
+        return self.profiler
+
+    def stop(self):
+        self.running = False
+
+    def enabled_sensors(self):
+        return [sensor for sensor in self.sensors if sensor.enabled]
+
+    def channels(self):
+        return [column for sensor in self.enabled_sensors() for column in sensor.columns]
+
+    def drain(self):
+        # The first enabled sensor clocks the output rows, the other sensors hold their latest value received at
+        # or before each row. Rows from before every sensor has reported once are held back rather than filled with
+        # readings that were never taken
+        sensors = self.enabled_sensors()
+        if not sensors:
+            return np.empty(0), self.data[:0]
+        if self.profiler is not None:
+            lap = time.perf_counter_ns()
+        drained = [sensor.buffer.drain() for sensor in sensors]
+        t = drained[0][0]
+        block = np.empty((len(t), self.data.shape[1]))
+        idx=0
+        for sensor, (sensor_t, values) in zip(sensors, drained):
+            sensor.jitter.add(sensor_t)
+            if sensor is sensors[0]:
+                block[:, idx:idx+sensor.dim] = values
+            else:
+                pos = np.searchsorted(sensor_t, t, side='right') - 1
+                block[:, idx:idx+sensor.dim] = self.data[0, idx:idx+sensor.dim]
+                block[pos >= 0, idx:idx+sensor.dim] = values[pos[pos >= 0]]
+            if len(sensor_t):
+                self.data[0, idx:idx+sensor.dim] = values[-1]
+            idx=idx+sensor.dim
+        if len(t) and np.isnan(block[0]).any():
+            reported = ~np.isnan(block).any(axis=1)
+            t = t[reported]
+            block = block[reported]
+        self.count_samples(t)
+        t = (t - self.start_t) / 1e6
+        self.store.extend(t, block)
+        if self.profiler is not None:
+            self.profiler.lap('drain', lap)
+        return t, block
+
+    def decode_raw(self):
+        # One vectorized decode per sensor arena, rows are clocked by the first enabled sensor and the other
+        # sensors contribute the latest payload received at or before each row. As in drain(), rows from before
+        # every sensor has reported once are held back
+        sensors = self.enabled_sensors()
+        if not sensors:
+            return np.empty(0), self.data[:0]
+        self.update_jitter()
+        decoded = [sensor.decode_batch() for sensor in sensors]
+        t = decoded[0][0]
+        block = np.empty((len(t), self.data.shape[1]))
+        idx=0
+        for sensor, (sensor_t, values) in zip(sensors, decoded):
+            if sensor is sensors[0]:
+                block[:, idx:idx+sensor.dim] = values
+            else:
+                pos = np.searchsorted(sensor_t, t, side='right') - 1
+                block[:, idx:idx+sensor.dim] = self.data[0, idx:idx+sensor.dim]
+                block[pos >= 0, idx:idx+sensor.dim] = values[pos[pos >= 0]]
+            if len(sensor_t):
+                self.data[0, idx:idx+sensor.dim] = values[-1]
+            idx=idx+sensor.dim
+        if len(t) and np.isnan(block[0]).any():
+            reported = ~np.isnan(block).any(axis=1)
+            t = t[reported]
+            block = block[reported]
+        self.count_samples(t)
+        start_t = self.start_t
+        if start_t is None:
+            start_t = t[0] if len(t) else 0.0
+        return (t - start_t) / 1e6, block
+
+    def update_jitter(self):
+        # Raw arenas are only timestamped during capture, their intervals are added here on demand
+        if self.raw:
+            for sensor in self.enabled_sensors():
+                sensor.jitter.add(sensor.arena.t[sensor.jitter_n:len(sensor.arena)])
+                sensor.jitter_n = len(sensor.arena)
+
+    def jitter(self):
+        # Inter-sample interval statistics (ms) per enabled sensor, available while recording
+        self.update_jitter()
+        return {type(sensor).__name__: sensor.jitter.summary() for sensor in self.sensors
+                if sensor.enabled or sensor.jitter.n}
+
+    def count_samples(self, t):
+        if len(t):
+            if self.first_sample_t is None:
+                self.first_sample_t = t[0]
+            self.last_sample_t = t[-1]
+            self.received += len(t)
+
+    def stats(self):
+        # Drops are estimated from how many samples the configured rate should have produced between the
+        # first and last received sample, which is robust to notifications arriving in bursts. Time spent
+        # reconnecting is not counted as dropped samples
+        if self.received < 2:
+            return {'samples': self.received, 'rate': 0.0, 'dropped': 0, 'malformed': self.malformed()}
+        duration = float(self.last_sample_t - self.first_sample_t) / 1e9
+        downtime = self.downtime()
+        expected = int(round((duration - downtime['downtime']) * self.rate)) + 1
+        return {'samples': self.received, 'duration': duration, 'rate': (self.received - 1) / duration,
+                'dropped': max(0, expected - self.received), 'gaps': downtime['gaps'],
+                'downtime': downtime['downtime'], 'malformed': self.malformed()}
+
+    def malformed(self):
+        # Notifications too short for their sensor's layout, dropped on arrival
+        return sum(sensor.malformed for sensor in self.sensors)
+
+    def flush_raw(self):
+        if self.profiler is not None:
+            lap = time.perf_counter_ns()
+        t, block = self.decode_raw()
+        if self.profiler is not None:
+            lap = self.profiler.lap('decode_raw', lap)
+        self.store.extend(t, block)
+        if self.profiler is not None:
+            lap = self.profiler.lap('store', lap)
+        if self.writer is not None:
+            self.writer.extend(t, block)
+            if self.profiler is not None:
+                self.profiler.lap('write', lap)
+        for sensor in self.enabled_sensors():
+            sensor.arena.clear()
+            sensor.jitter_n = 0
 
     def disconnect(self):
 
-        for t,row in zip(self.t_log, self.data_log):
-            self.log_file.write('%.2f' % t)
-            idx=0
-            if self.gyro_acc.enabled:
-                self.log_file.write('\t%.3f\t%.3f\t%.3f\t%.3f\t%.3f\t%.3f' % (row[0,idx],row[0,idx+1],row[0,idx+2],row[0,idx+3],row[0,idx+4],row[0,idx+5]))
-                idx=idx+6
-            if self.temp_press.enabled:
-                self.log_file.write('\t%.3f\t%.3f' % (row[0, idx], row[0, idx + 1]))
-                idx=idx+2
-            if self.ambient_light.enabled:
-                self.log_file.write('\t%.3f' % (row[0, idx]))
-            self.log_file.write('\n')
-        self.log_file.close()
-        if self.gyro_acc is not None:
-            self.gyro_acc.disable()
-        if self.temp_press is not None:
-            self.temp_press.disable()
-        if self.ambient_light is not None:
-            self.ambient_light.disable()
-        if self.dev is not None:
-            self.dev.disconnect()
+        if self.raw:
+            self.flush_raw()
+        if self.writer is not None:
+            self.writer.close(finish=self.write_metadata)
+            self.writer = None
+        if self.summary is not None:
+            self.summary.close()
+        if self.profiler is not None:
+            self.profiler.stop()
+        try:
+            if self.gyro_acc is not None:
+                self.gyro_acc.disable()
+            if self.temp_press is not None:
+                self.temp_press.disable()
+            if self.ambient_light is not None:
+                self.ambient_light.disable()
+            if self.dev is not None:
+                self.dev.disconnect()
+        except btle.BTLEDisconnectError:
+            # the link was already lost, e.g. stopped while reconnecting
+            pass
+
+
+class SensorDelegate(btle.DefaultDelegate):
+
+    def __init__(self):
+        btle.DefaultDelegate.__init__(self)
+        self.handles = {}
+
+    def add(self, sensor):
+        self.handles[sensor.handle] = sensor
+
+    def handleNotification(self, cHandle, data):
+        sensor = self.handles.get(cHandle)
+        if sensor is not None:
+            sensor.collect_data(data)
+
+
+class SampleBuffer:
+
+    def __init__(self, dim, size=1024):
+        self.t = np.zeros(size, dtype=np.int64)
+        self.values = np.zeros((size, dim))
+        self.n = 0
+
+    def next_row(self, t):
+        if self.n == len(self.t):
+            self.t = np.resize(self.t, 2 * len(self.t))
+            self.values = np.resize(self.values, (2 * len(self.values), self.values.shape[1]))
+        self.t[self.n] = t
+        self.n += 1
+        return self.values[self.n - 1]
+
+    def drain(self):
+        t = self.t[:self.n].copy()
+        values = self.values[:self.n].copy()
+        self.n = 0
+        return t, values
 
 
 class SensorBase:
+    dim = 0
+    columns = []
+    layout = None
+    min_size = None
     sensorOn = b"\x19\x90"
     sensorOff = b"\x00\x00"
 
@@ -119,60 +589,114 @@ class SensorBase:
         self.periph = periph
         self.svcUUID = svcUUID
         self.dataUUID = dataUUID
-        self.service = None
-        self.ctrl = None
-        self.data = None
+        self.handle = None
+        self.cccd = None
         self.last_data_bytes = None
         self.last_t = datetime.datetime.now()
+        self.values = np.zeros((1, self.dim))
+        self.buffer = None
+        self.arena = None
+        self.jitter = IntervalHistogram()
+        self.jitter_n = 0
+        # shorter payloads cannot be decoded and are only counted in malformed, see collect_data()
+        if self.min_size is None:
+            self.min_size = self.layout.size
+        self.malformed = 0
+        self.name = type(self).__name__
+        self.profiler = None
         self.enabled=False
 
-    def enable(self):
-        if self.service is None:
-            self.service = self.periph.getServiceByUUID(self.svcUUID)
-        if self.data is None:
-            self.data = self.service.getCharacteristics(self.dataUUID)[0]
-        if self.ctrl is None:
-            self.ctrl = self.data.getDescriptors(AssignedNumbers.client_characteristic_configuration)[0]
+    def enable(self, notify=False, raw=False):
+        if self.handle is None:
+            self.use_handles(discover(self.periph, self.svcUUID, [self.dataUUID]))
+        if raw:
+            self.arena = self.new_arena()
+        elif notify:
+            self.buffer = SampleBuffer(self.dim)
         if self.sensorOn is not None:
-            self.ctrl.write(self.sensorOn, withResponse=True)
+            self.periph.writeCharacteristic(self.cccd, self.sensorOn, withResponse=True)
         self.enabled=True
 
+    def use_handles(self, handles):
+        self.handle = handles[self.dataUUID]['value']
+        self.cccd = handles[self.dataUUID]['cccd']
+
+    def collect_data(self, data):
+        # Raising here would end the recording from inside waitForNotifications, malformed payloads are counted
+        # and dropped
+        if len(data) < self.min_size:
+            self.malformed += 1
+            return
+        if self.arena is not None:
+            self.arena.append(time.perf_counter_ns(), data)
+        elif self.buffer is not None:
+            t = time.perf_counter_ns()
+            self.decode_into(data, self.buffer.next_row(t))
+            if self.profiler is not None:
+                self.profiler.lap('decode', t, self.name)
+
     def read(self):
-        return self.data.read()
+        if self.profiler is None:
+            return self.decode(self.periph.readCharacteristic(self.handle))
+        lap = time.perf_counter_ns()
+        data = self.periph.readCharacteristic(self.handle)
+        lap = self.profiler.lap('read', lap, self.name)
+        values = self.decode(data)
+        self.profiler.lap('decode', lap, self.name)
+        return values
+
+    def decode(self, data):
+        self.decode_into(data, self.values[0])
+
+    def decode_into(self, data, row):
+        self.layout.decode_into(data, row)
+
+    def fill(self, row):
+        row[:] = self.values[0]
+
+    def new_arena(self):
+        # Payloads are decoded field by field from their start, shorter ones cannot be
+        return RawArena(min_size=self.min_size)
+
+    def decode_batch(self):
+        return self.arena.t[:len(self.arena)], self.layout.decode_batch(self.arena.payloads(), self.arena.record_size)
 
     def disable(self):
-        if self.ctrl is not None:
-            self.ctrl.write(self.sensorOff)
+        if self.cccd is not None:
+            self.periph.writeCharacteristic(self.cccd, self.sensorOff)
+        self.buffer = None
         self.enabled=False
 
 
 class GyroAccelSensor(SensorBase):
+    dim = 6
+    columns = ['g_x', 'g_y', 'g_z', 'a_x', 'a_y', 'a_z']
     gyro_scale = 250.0 / 32768.0
     acc_scale_2_g = 2.0 / 32768.0
+    # Acceleration in bytes 0-6, gyro in bytes 6-12, big-endian int16
+    layout = PacketLayout([('a_x', 'h', acc_scale_2_g, None), ('a_y', 'h', acc_scale_2_g, None),
+                           ('a_z', 'h', acc_scale_2_g, None), ('g_x', 'h', gyro_scale, None),
+                           ('g_y', 'h', gyro_scale, None), ('g_z', 'h', gyro_scale, None)], columns)
 
     def __init__(self, periph):
         SensorBase.__init__(self, periph, '6a800001-b5a3-f393-e0a9-e50e24dcca9e',
                             '6a806050-b5a3-f393-e0a9-e50e24dcca9e')
-        self.gyro = np.zeros((1, 3))
-        self.accel = np.zeros((1, 3))
-
-    def read(self):
-        data = self.data.read()
-
-        # Compute gyro
-        for idx, iter in enumerate(range(6, 12, 2)):
-            self.gyro[0, idx] = int.from_bytes(data[iter:iter + 2], byteorder='big', signed=True) * self.gyro_scale
-
-        # Compute acceleraton
-        for idx, iter in enumerate(range(0, 6, 2)):
-            self.accel[0, idx] = int.from_bytes(data[iter:iter + 2], byteorder='big', signed=True) * self.acc_scale_2_g
+        self.gyro = self.values[:, 0:3]
+        self.accel = self.values[:, 3:6]
 
+    def decode(self, data):
+        SensorBase.decode(self, data)
         return self.gyro, self.accel
 
 
 
 class AmbientLightSensor(SensorBase):
+    dim = 1
+    columns = ['l']
     light_scale = 0.35
+    layout = PacketLayout([('l', 'H', light_scale, None)], columns)
+    # any length holds the whole value, only an empty payload has none
+    min_size = 1
 
     def __init__(self, periph):
         SensorBase.__init__(self, periph, '6a800001-b5a3-f393-e0a9-e50e24dcca9e',
@@ -180,18 +704,40 @@ class AmbientLightSensor(SensorBase):
 
         self.light=0
 
-    def read(self):
-        data = self.data.read()
-        self.light = int.from_bytes(data, byteorder='big', signed=False) * self.light_scale
-
+    def decode(self, data):
+        SensorBase.decode(self, data)
+        self.light = self.values[0, 0]
         return self.light
 
+    def decode_into(self, data, row):
+        # The whole payload is one unsigned value, only the usual 2 byte payload goes through the struct
+        if len(data) == self.layout.size:
+            self.layout.decode_into(data, row)
+        else:
+            row[0] = int.from_bytes(data, byteorder='big', signed=False) * self.light_scale
+
+    def new_arena(self):
+        return RawArena(align='right', min_size=self.min_size)
+
+    def decode_batch(self):
+        if self.arena.record_size in (None, self.layout.size):
+            return SensorBase.decode_batch(self)
+        raw = np.frombuffer(self.arena.payloads(), dtype=np.uint8).reshape(-1, self.arena.record_size)
+        value = np.zeros(len(raw), dtype=np.uint64)
+        for col in range(raw.shape[1]):
+            value = value * 256 + raw[:, col]
+        return self.arena.t[:len(self.arena)], (value.astype(np.float64) * self.light_scale)[:, np.newaxis]
+
 
 class TempPressureSensor(SensorBase):
+    dim = 2
+    columns = ['t', 'p']
     sensorOn = b"\x01\x01"
     sensorOff = b"\x00\x00"
     temp_scale=1/5120
     pressure_scale=1
+    # Temperature is the unsigned 24 bit value in bytes 1-4, pressure the unsigned 32 bit value in bytes 4-8
+    layout = PacketLayout([('t', 'I', temp_scale, 0xFFFFFF), ('p', 'I', pressure_scale, None)], columns)
 
     def __init__(self, periph):
         SensorBase.__init__(self, periph, '6a800001-b5a3-f393-e0a9-e50e24dcca9e',
@@ -199,10 +745,8 @@ class TempPressureSensor(SensorBase):
         self.temp=0
         self.pressure=0
 
-    def read(self):
-        data=self.data.read()
-        self.temp = int.from_bytes(data[1:4], byteorder='big', signed=False) * self.temp_scale
-
-        self.pressure=int.from_bytes(data[4:8], byteorder='big', signed=False)*self.pressure_scale
-
+    def decode(self, data):
+        SensorBase.decode(self, data)
+        self.temp, self.pressure = self.values[0]
         return self.temp, self.pressure
+
@@ -0,0 +1,140 @@
+import numpy as np
+
+
+class SampleStore:
+    # Growable columnar sample store: each chunk is one contiguous float64 block of values plus a timestamp
+    # column, so appending never copies what is already stored and export works on views of the chunks. With
+    # keep=False samples are only counted, for runs that only need a writer or listeners
+
+    def __init__(self, dim, chunk_size=65536, keep=True):
+        self.dim = dim
+        self.chunk_size = chunk_size
+        self.keep = keep
+        self.t_chunks = []
+        self.value_chunks = []
+        self.n = 0
+        self.chunk_n = chunk_size
+
+    def __len__(self):
+        return self.n
+
+    def add_chunk(self):
+        self.t_chunks.append(np.empty(self.chunk_size))
+        self.value_chunks.append(np.empty((self.chunk_size, self.dim)))
+        self.chunk_n = 0
+
+    def append(self, t, row):
+        if not self.keep:
+            self.n += 1
+            return
+        if self.chunk_n == self.chunk_size:
+            self.add_chunk()
+        self.t_chunks[-1][self.chunk_n] = t
+        self.value_chunks[-1][self.chunk_n] = row
+        self.chunk_n += 1
+        self.n += 1
+
+    def extend(self, t, values):
+        if not self.keep:
+            self.n += len(t)
+            return
+        start = 0
+        while start < len(t):
+            if self.chunk_n == self.chunk_size:
+                self.add_chunk()
+            count = min(len(t) - start, self.chunk_size - self.chunk_n)
+            self.t_chunks[-1][self.chunk_n:self.chunk_n + count] = t[start:start + count]
+            self.value_chunks[-1][self.chunk_n:self.chunk_n + count] = values[start:start + count]
+            self.chunk_n += count
+            self.n += count
+            start += count
+
+    def views(self):
+        # Yields (t, values) views of the filled part of each chunk without copying
+        for idx, (t, values) in enumerate(zip(self.t_chunks, self.value_chunks)):
+            if idx == len(self.t_chunks) - 1:
+                yield t[:self.chunk_n], values[:self.chunk_n]
+            else:
+                yield t, values
+
+    def arrays(self):
+        if len(self.t_chunks) == 1:
+            return next(self.views())
+        if not self.t_chunks:
+            return np.empty(0), np.empty((0, self.dim))
+        t, values = zip(*self.views())
+        return np.concatenate(t), np.concatenate(values)
+
+    def clear(self):
+        self.t_chunks = []
+        self.value_chunks = []
+        self.n = 0
+        self.chunk_n = self.chunk_size
+
+    def write_tsv(self, f):
+        fmt = ['%.2f'] + ['%.3f'] * self.dim
+        for t, values in self.views():
+            if len(t):
+                np.savetxt(f, np.column_stack((t, values)), fmt=fmt, delimiter='\t')
+
+
+class RawArena:
+    # Raw characteristic payloads back to back in one growable bytearray, with a receive time per payload.
+    # The record size is set by the first payload. With align='left' (fields at fixed offsets from the start)
+    # payloads shorter than min_size are rejected and other lengths are cut or zero padded on the right, which
+    # only touches bytes past the decoded fields. With align='right' (the whole payload is one unsigned
+    # big-endian value) shorter payloads are zero padded on the left and a longer one widens every record, so no
+    # value changes. Payloads of another length are counted in resized
+
+    def __init__(self, size=4096, align='left', min_size=0):
+        if align not in ('left', 'right'):
+            raise ValueError('Unknown alignment: %r' % align)
+        self.t = np.empty(size, dtype=np.int64)
+        self.align = align
+        self.min_size = min_size
+        self.data = None
+        self.record_size = None
+        self.n = 0
+        self.resized = 0
+
+    def __len__(self):
+        return self.n
+
+    def append(self, t, payload):
+        if len(payload) < self.min_size:
+            raise ValueError('Payload of %d bytes, at least %d expected' % (len(payload), self.min_size))
+        if self.record_size is None:
+            self.record_size = len(payload)
+            self.data = bytearray(len(self.t) * self.record_size)
+        if self.n == len(self.t):
+            self.t = np.resize(self.t, 2 * len(self.t))
+            self.data.extend(bytes(len(self.data)))
+        if len(payload) != self.record_size:
+            self.resized += 1
+            if self.align == 'left':
+                payload = bytes(payload[:self.record_size]).ljust(self.record_size, b'\x00')
+            elif len(payload) < self.record_size:
+                payload = bytes(payload).rjust(self.record_size, b'\x00')
+            else:
+                self.widen(len(payload))
+        start = self.n * self.record_size
+        self.data[start:start + self.record_size] = payload
+        self.t[self.n] = t
+        self.n += 1
+
+    def widen(self, record_size):
+        records = np.frombuffer(self.data, dtype=np.uint8).reshape(-1, self.record_size)
+        wide = np.zeros((len(records), record_size), dtype=np.uint8)
+        wide[:, record_size - self.record_size:] = records
+        self.data = bytearray(wide.tobytes())
+        self.record_size = record_size
+
+    def payloads(self):
+        if self.record_size is None:
+            return b''
+        return bytes(self.data[:self.n * self.record_size])
+
+    def clear(self):
+        self.data = None
+        self.record_size = None
+        self.n = 0
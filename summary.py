@@ -0,0 +1,159 @@
+import threading
+import numpy as np
+
+# Constant-memory per-channel summaries of a stream: count, mean, standard deviation, min, max and RMS over
+# tumbling windows of window ms and over a window sliding by step ms. The state is a ring of window / step panes,
+# each holding the Welford count/mean/M2 plus min, max and sum of squares of every channel, so memory does not
+# grow with the length of the run. Closed tumbling windows go to callback(summary) and, with fname, one TSV row
+# each (loadable with loader.load). Rows with NaNs (gap markers) are skipped.
+
+STATS = ['count', 'mean', 'std', 'min', 'max', 'rms']
+
+
+def combine(count, mean, m2, minimum, maximum, sumsq, axis=0):
+    # Merges Welford states along axis (Chan et al.), empty states are ignored
+    n = count.sum(axis=axis)
+    total = np.where(count > 0, count * mean, 0.0).sum(axis=axis)
+    merged_mean = np.divide(total, n, out=np.zeros_like(total), where=n > 0)
+    spread = np.where(count > 0, m2 + count * (mean - np.expand_dims(merged_mean, axis)) ** 2, 0.0)
+    return (n, merged_mean, spread.sum(axis=axis), minimum.min(axis=axis), maximum.max(axis=axis),
+            sumsq.sum(axis=axis))
+
+
+def finish(start, end, count, mean, m2, minimum, maximum, sumsq):
+    empty = count == 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {'start': start, 'end': end, 'count': count.astype(np.int64),
+                'mean': np.where(empty, np.nan, mean),
+                'std': np.where(count > 1, np.sqrt(m2 / np.maximum(count - 1, 1)), np.nan),
+                'min': np.where(empty, np.nan, minimum), 'max': np.where(empty, np.nan, maximum),
+                'rms': np.where(empty, np.nan, np.sqrt(sumsq / count))}
+
+
+class WindowStats:
+
+    def __init__(self, channels, window=1000.0, step=None, callback=None, fname=None):
+        step = window if step is None else step
+        self.panes = int(round(window / step))
+        if self.panes < 1 or abs(self.panes * step - window) > 1e-6 * window:
+            raise ValueError('window must be a multiple of step')
+        self.channels = list(channels)
+        self.window = float(window)
+        self.step = float(step)
+        self.callback = callback
+        dim = len(self.channels)
+        # slot k holds pane index self.pane_ids[k] (-1 empty), panes are counted in steps from t=0
+        self.pane_ids = np.full(self.panes, -1, dtype=np.int64)
+        self.count = np.zeros((self.panes, dim))
+        self.mean = np.zeros((self.panes, dim))
+        self.m2 = np.zeros((self.panes, dim))
+        self.min = np.full((self.panes, dim), np.inf)
+        self.max = np.full((self.panes, dim), -np.inf)
+        self.sumsq = np.zeros((self.panes, dim))
+        self.totals = [np.zeros((1, dim)), np.zeros((1, dim)), np.zeros((1, dim)), np.full((1, dim), np.inf),
+                       np.full((1, dim), -np.inf), np.zeros((1, dim))]
+        self.pane = -1
+        self.first_t = None
+        self.last_t = None
+        self.windows = 0
+        self.lock = threading.Lock()
+        self.file = None
+        if fname is not None:
+            self.file = open(fname, 'w')
+            self.file.write('\t'.join(['time', 'end'] + ['%s_%s' % (name, stat) for name in self.channels
+                                                          for stat in STATS]) + '\n')
+
+    def stack(self, rows):
+        # Welford state of a block of rows, with a leading axis of one to merge into the panes
+        count = np.full((1, rows.shape[1]), float(len(rows)))
+        mean = rows.mean(axis=0, keepdims=True)
+        return (count, mean, ((rows - mean) ** 2).sum(axis=0, keepdims=True), rows.min(axis=0, keepdims=True),
+                rows.max(axis=0, keepdims=True), (rows * rows).sum(axis=0, keepdims=True))
+
+    def slot_state(self, slots):
+        return self.count[slots], self.mean[slots], self.m2[slots], self.min[slots], self.max[slots], \
+            self.sumsq[slots]
+
+    def merge(self, slot, block):
+        merged = combine(*[np.concatenate((a, b)) for a, b in zip(self.slot_state([slot]), block)])
+        self.count[slot], self.mean[slot], self.m2[slot], self.min[slot], self.max[slot], self.sumsq[slot] = merged
+        self.totals = [np.asarray(a)[np.newaxis] for a in
+                       combine(*[np.concatenate((a, b)) for a, b in zip(self.totals, block)])]
+
+    def advance(self, pane):
+        # Moves on to pane, emitting the tumbling window being left and clearing the slots that are reused
+        if self.pane >= 0 and pane // self.panes != self.pane // self.panes:
+            self.emit(self.pane // self.panes)
+        for idx in range(max(self.pane + 1, pane - self.panes + 1), pane + 1):
+            slot = idx % self.panes
+            self.pane_ids[slot] = idx
+            self.count[slot] = 0.0
+            self.mean[slot] = 0.0
+            self.m2[slot] = 0.0
+            self.min[slot] = np.inf
+            self.max[slot] = -np.inf
+            self.sumsq[slot] = 0.0
+        self.pane = pane
+
+    def emit(self, window):
+        slots = np.flatnonzero(self.pane_ids // self.panes == window)
+        summary = finish(window * self.window, (window + 1) * self.window, *combine(*self.slot_state(slots)))
+        self.windows += 1
+        if self.file is not None:
+            row = np.column_stack([summary[stat] for stat in STATS]).ravel()
+            self.file.write('%.2f\t%.2f\t' % (summary['start'], summary['end']) + '\t'.join('%.6g' % value
+                                                                                         for value in row) + '\n')
+        if self.callback is not None:
+            self.callback(summary)
+
+    def update(self, t, block):
+        # RecordingDevice listener: t in ms, one row per sample
+        block = np.asarray(block, dtype=np.float64)
+        keep = ~np.isnan(block).any(axis=1)
+        t, block = np.asarray(t)[keep], block[keep]
+        if not len(t):
+            return
+        with self.lock:
+            # late rows (out of order, before the current pane) are counted in the current pane
+            panes = np.maximum.accumulate(np.maximum(np.floor(t / self.step).astype(np.int64), self.pane))
+            if self.first_t is None:
+                self.first_t = float(t[0])
+            self.last_t = float(t[-1])
+            bounds = np.concatenate(([0], np.flatnonzero(np.diff(panes)) + 1, [len(panes)]))
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                if panes[start] != self.pane:
+                    self.advance(int(panes[start]))
+                self.merge(self.pane % self.panes, self.stack(block[start:end]))
+
+    def sliding(self):
+        # The last window ms, up to the current step
+        with self.lock:
+            slots = np.flatnonzero(self.pane_ids >= 0)
+            return finish(max(0, self.pane + 1 - self.panes) * self.step, (self.pane + 1) * self.step,
+                          *combine(*self.slot_state(slots)))
+
+    def current(self):
+        # The tumbling window still being filled
+        with self.lock:
+            window = self.pane // self.panes
+            slots = np.flatnonzero((self.pane_ids // self.panes == window) & (self.pane_ids >= 0))
+            return finish(window * self.window, (window + 1) * self.window, *combine(*self.slot_state(slots)))
+
+    def total(self):
+        # Everything since the start of the run
+        with self.lock:
+            return finish(self.first_t, self.last_t, *[np.asarray(a)[0] for a in self.totals])
+
+    def by_channel(self, summary):
+        return {name: {stat: summary[stat][idx] for stat in STATS} for idx, name in enumerate(self.channels)}
+
+    def close(self):
+        # Emits the window still open and closes the summary file
+        with self.lock:
+            if self.pane >= 0:
+                self.emit(self.pane // self.panes)
+                self.pane_ids[:] = -1
+                self.pane = -1
+            if self.file is not None:
+                self.file.close()
+                self.file = None
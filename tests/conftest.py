@@ -0,0 +1,39 @@
+import importlib
+import os
+import sys
+import types
+import pytest
+
+# The tests run against the fakes, no hardware needed. The bluepy and bleak variants both have sensor, fake, gatt
+# and discovery modules of the same names, so each fixture imports one variant afresh with its directory first on
+# the path. Shared modules (store, writer, recording, ...) come from the repository root
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRANSPORT = ['sensor', 'fake', 'gatt', 'discovery', 'multi', 'shared', 'bench_decode']
+os.environ.setdefault('MPLBACKEND', 'Agg')
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def import_variant(path, names=('sensor', 'fake')):
+    for name in TRANSPORT:
+        sys.modules.pop(name, None)
+    sys.path.insert(0, path)
+    try:
+        return types.SimpleNamespace(**{name: importlib.import_module(name) for name in names})
+    finally:
+        sys.path.remove(path)
+        for name in TRANSPORT:
+            sys.modules.pop(name, None)
+
+
+@pytest.fixture
+def bluepy_variant():
+    pytest.importorskip('bluepy')
+    return import_variant(ROOT, ('sensor', 'fake', 'gatt'))
+
+
+@pytest.fixture
+def bleak_variant():
+    pytest.importorskip('bleak')
+    return import_variant(os.path.join(ROOT, 'bleak'), ('sensor', 'fake', 'gatt', 'multi'))
@@ -0,0 +1,43 @@
+import os
+import numpy as np
+import pytest
+
+from batch import analyze, find_recordings, is_recording, read_chunks
+from loader import cache_fname
+from summary import WindowStats
+
+
+def test_is_recording_skips_summaries(tmp_path):
+    recording = tmp_path / 'run.tsv'
+    recording.write_text('time\tg_x\tg_y\tg_z\n# start_time\t0.000000\n0.00\t1\t2\t3\n')
+    results = tmp_path / 'batch_results.tsv'
+    results.write_text('path\tsize\n')
+    stats = WindowStats(['g_x', 'g_y', 'g_z'], window=100.0, fname=str(tmp_path / 'run_summary.tsv'))
+    stats.update(np.arange(50) * 10.0, np.ones((50, 3)))
+    stats.close()
+    assert is_recording(str(recording))
+    assert not is_recording(str(results))
+    assert not is_recording(str(tmp_path / 'run_summary.tsv'))
+    assert find_recordings(str(tmp_path)) == [str(recording)]
+
+
+def test_uncached_tsv_streams_in_chunks(tmp_path):
+    fname = tmp_path / 'run.tsv'
+    t = np.arange(1000) * 10.0
+    values = np.column_stack((np.sin(t / 100), np.cos(t / 100)))
+    with open(fname, 'w') as f:
+        f.write('time\tt\tp\n# start_time\t1700000000.000000\n')
+        for row_t, row in zip(t, values):
+            f.write('%.2f\t%.6f\t%.6f\n' % (row_t, row[0], row[1]))
+        f.write('# rate\t100\t100\t100.00\n')
+    header, rows, chunks = read_chunks(str(fname), 64)
+    chunks = list(chunks)
+    assert rows == 1000
+    assert max(len(chunk) for chunk in chunks) <= 64
+    assert np.array_equal(np.concatenate(chunks)['time'], t)
+    assert not os.path.exists(cache_fname(str(fname)))
+    streamed = analyze(str(fname), str(tmp_path), chunk_size=64)
+    cached = analyze(str(fname), str(tmp_path), chunk_size=64, cache=True)
+    assert os.path.exists(cache_fname(str(fname)))
+    for key in ['samples', 'duration_s', 't_mean', 'p_max', 'interval_mean_ms']:
+        assert streamed[key] == pytest.approx(cached[key])
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import chunked
+import loader
+
+CHANNELS = ['g_x', 'g_y', 'g_z', 'a_x', 'a_y', 'a_z', 't', 'p', 'l', 'extra']
+
+
+def recording(n=1000, seed=0):
+    # values on each channel's raw integer grid, like decoded sensor data, with gap rows and a channel without
+    # a known scale
+    rng = np.random.default_rng(seed)
+    t = np.cumsum(rng.integers(9000, 11000, n)) / 1e3
+    raw = np.column_stack([rng.integers(-32768, 32768, (n, 6)), rng.integers(0, 1 << 23, n),
+                           rng.integers(90000, 110000, n), rng.integers(0, 1 << 16, n)])
+    values = np.column_stack((raw * np.array([chunked.SCALES[name] for name in CHANNELS[:-1]]),
+                              rng.normal(0, 1, n)))
+    values[[100, 101, 555]] = np.nan
+    return t, values
+
+
+def write(fname, t, values, codec='zlib', chunk_duration=1000.0, batch=37):
+    with open(fname, 'wb') as f:
+        encode = chunked.ChunkEncoder(chunked.write_header(f, CHANNELS, chunk_duration=chunk_duration,
+                                                           codec=codec))
+        for start in range(0, len(t), batch):
+            f.write(encode(t[start:start + batch], values[start:start + batch]))
+        f.write(encode.close())
+    return encode
+
+
+def check(records, t, values):
+    assert np.allclose(records['time'], t, rtol=0, atol=1e-9)
+    decoded = np.column_stack([records[name] for name in CHANNELS])
+    assert np.array_equal(np.isnan(decoded), np.isnan(values))
+    assert np.array_equal(decoded[~np.isnan(values)], values[~np.isnan(values)])
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'lzma'])
+def test_round_trip(tmp_path, codec):
+    fname = str(tmp_path / ('run' + chunked.EXT))
+    t, values = recording()
+    encode = write(fname, t, values, codec)
+    assert len(encode.index) == int(np.ceil((t[-1] - t[0]) / 1000.0))
+    header, records = chunked.load(fname)
+    assert header['codec'] == codec
+    check(records, t, values)
+    header, records = loader.load(fname)
+    check(records, t, values)
+
+
+def test_time_window(tmp_path):
+    fname = str(tmp_path / ('run' + chunked.EXT))
+    t, values = recording()
+    write(fname, t, values)
+    for t0, t1 in [(2500.0, 4200.0), (None, 1500.0), (8000.0, None), (t[10] - 1e-3, t[10] + 1e-3), (1e9, None)]:
+        keep = np.ones(len(t), dtype=bool)
+        if t0 is not None:
+            keep &= t >= t0 - 1e-9
+        if t1 is not None:
+            keep &= t <= t1 + 1e-9
+        header, records = chunked.load(fname, t0, t1)
+        check(records, t[keep], values[keep])
+
+
+def test_truncated_file(tmp_path):
+    # no index or footer and half a chunk at the end, as a crash leaves it: the index is rebuilt from the chunk
+    # headers and the complete chunks load
+    fname = str(tmp_path / ('run' + chunked.EXT))
+    t, values = recording()
+    encode = write(fname, t, values)
+    last = encode.index[-1]
+    with open(fname, 'r+b') as f:
+        f.truncate(int(last[2]) + int(last[5]) // 2)
+    header, records = chunked.load(fname)
+    n = sum(int(entry[3]) for entry in encode.index[:-1])
+    assert len(records) == n
+    check(records, t[:n], values[:n])
+    with open(fname, 'rb') as f:
+        index = chunked.read_index(f, chunked.read_header(f, chunked.MAGIC))
+    assert len(index) == len(encode.index) - 1
@@ -0,0 +1,20 @@
+import matplotlib.pyplot as plt
+import numpy as np
+
+import decimate
+
+
+def test_plot_limits_skip_gap_rows():
+    fig, ax = plt.subplots()
+    x = np.arange(1000.0)
+    y = 100 + 10 * np.sin(x / 50)
+    y[500] = np.nan
+    decimate.plot(ax, x, y)
+    low, high = ax.get_ylim()
+    assert low <= 90.5 and high >= 109.5
+    assert high - low < 40
+    # all gaps: nothing to scale to, and no NaN limits
+    fig, ax = plt.subplots()
+    decimate.plot(ax, x, np.full(1000, np.nan))
+    assert np.isfinite(ax.get_ylim()).all()
+    plt.close('all')
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+# decode_into() and the raw-mode decode_batch() must give exactly what the original int.from_bytes decoders of
+# each sensor's read() gave
+
+
+def legacy_gyro_accel(data):
+    gyro = [int.from_bytes(data[pos:pos + 2], byteorder='big', signed=True) * (250.0 / 32768.0)
+            for pos in range(6, 12, 2)]
+    accel = [int.from_bytes(data[pos:pos + 2], byteorder='big', signed=True) * (2.0 / 32768.0)
+             for pos in range(0, 6, 2)]
+    return gyro + accel
+
+
+def legacy_temp_pressure(data):
+    return [int.from_bytes(data[1:4], byteorder='big', signed=False) * (1 / 5120),
+            int.from_bytes(data[4:8], byteorder='big', signed=False) * 1]
+
+
+def legacy_light(data):
+    return [int.from_bytes(data, byteorder='big', signed=False) * 0.35]
+
+
+@pytest.fixture(params=['bluepy_variant', 'bleak_variant'])
+def variant(request):
+    return request.getfixturevalue(request.param)
+
+
+def payloads(variant, uuid, n=500):
+    rng = np.random.default_rng(1)
+    out = [variant.fake.make_payload(uuid, rng, t) for t in np.linspace(0, 100, n)]
+    size = len(out[0])
+    # the full range of raw values, including the sign bits
+    out += [rng.integers(0, 256, size, dtype=np.uint8).tobytes() for _ in range(n)]
+    return out
+
+
+def check(sensor, data, legacy):
+    expected = np.array([legacy(payload) for payload in data])
+    row = np.empty(sensor.dim)
+    rows = []
+    for payload in data:
+        sensor.decode_into(payload, row)
+        rows.append(row.copy())
+    assert np.array_equal(np.array(rows), expected)
+    sensor.arena = sensor.new_arena()
+    for idx, payload in enumerate(data):
+        sensor.arena.append(idx, payload)
+    t, batch = sensor.decode_batch()
+    assert list(t) == list(range(len(data)))
+    assert np.array_equal(batch, expected)
+
+
+def test_gyro_accel(variant):
+    sensor = variant.sensor.GyroAccelSensor(None)
+    check(sensor, payloads(variant, variant.fake.GYRO_ACC_UUID), legacy_gyro_accel)
+
+
+def test_temp_pressure(variant):
+    sensor = variant.sensor.TempPressureSensor(None)
+    check(sensor, payloads(variant, variant.fake.TEMP_PRESS_UUID), legacy_temp_pressure)
+
+
+def test_light(variant):
+    sensor = variant.sensor.AmbientLightSensor(None)
+    check(sensor, payloads(variant, variant.fake.AMBIENT_LIGHT_UUID), legacy_light)
+
+
+@pytest.mark.parametrize('lengths', [[3], [1], [2, 2, 1, 3, 2, 4, 1], [1, 2, 3, 4, 5, 6, 7, 8], [4, 3, 2, 1]])
+def test_light_odd_lengths(variant, lengths):
+    rng = np.random.default_rng(len(lengths))
+    data = [rng.integers(0, 256, length, dtype=np.uint8).tobytes() for length in lengths * 20]
+    check(variant.sensor.AmbientLightSensor(None), data, legacy_light)
+
+
+def test_longer_payloads_keep_their_fields(variant):
+    # trailing bytes past the fields are ignored by both decoders
+    rng = np.random.default_rng(2)
+    data = [rng.integers(0, 256, length, dtype=np.uint8).tobytes() for length in [12, 14, 13, 12] * 20]
+    check(variant.sensor.GyroAccelSensor(None), data, legacy_gyro_accel)
+
+
+def test_short_payloads_are_rejected(variant):
+    sensor = variant.sensor.TempPressureSensor(None)
+    sensor.arena = sensor.new_arena()
+    sensor.arena.append(0, bytes(8))
+    with pytest.raises(ValueError):
+        sensor.arena.append(1, bytes(6))
+
+
+def collect(variant, sensor, data):
+    # bleak notification callbacks also get the sender
+    if hasattr(variant, 'multi'):
+        sensor.collect_data(None, data)
+    else:
+        sensor.collect_data(data)
+
+
+@pytest.mark.parametrize('raw', [False, True])
+def test_malformed_notifications_are_dropped(variant, raw):
+    for sensor, good, bad in [(variant.sensor.TempPressureSensor(None), bytes(8), [bytes(6), b'']),
+                              (variant.sensor.AmbientLightSensor(None), bytes(2), [b''])]:
+        sensor.notify = True
+        if raw:
+            sensor.arena = sensor.new_arena()
+        else:
+            sensor.buffer = variant.sensor.SampleBuffer(sensor.dim)
+        for data in [good] + bad + [good]:
+            collect(variant, sensor, data)
+        assert sensor.malformed == len(bad)
+        assert len(sensor.arena if raw else sensor.buffer.drain()[0]) == 2
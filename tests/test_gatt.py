@@ -0,0 +1,66 @@
+import json
+import numpy as np
+
+from test_notify import record_bleak, record_bluepy
+
+
+def count_discoveries(variant, monkeypatch):
+    calls = []
+    discover = variant.gatt.discover
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return discover(*args, **kwargs)
+    monkeypatch.setattr(variant.gatt, 'discover', counted)
+    return calls
+
+
+def check_cache(variant, monkeypatch, cache, record, table):
+    # A firmware update that moves the GATT table (handle_offset) under an unchanged firmware revision: the cached
+    # handles fail validation, the table is discovered again and the recording uses the new handles
+    calls = count_discoveries(variant, monkeypatch)
+    dev = record({})
+    assert len(calls) == 1
+    with open(cache) as f:
+        entries = json.load(f)
+    assert list(entries) == ['AA:BB/1.0']
+    assert {uuid: entry['value'] for uuid, entry in entries['AA:BB/1.0'].items()} == table(dev)
+    # same table: the cache is used as is
+    dev = record({})
+    assert len(calls) == 1
+    dev = record({'handle_offset': 3})
+    assert len(calls) == 2
+    assert {uuid: entry['value'] for uuid, entry in dev.handles.items()} == table(dev)
+    assert all(dev.handles[sensor.dataUUID]['cccd'] == dev.handles[sensor.dataUUID]['value'] + 1
+               for sensor in dev.sensors)
+    t, values = dev.store.arrays()
+    assert len(t) > 20
+    assert not np.isnan(values).any()
+    with open(cache) as f:
+        assert json.load(f)['AA:BB/1.0'] == dev.handles
+    # and the moved table is cached in turn
+    record({'handle_offset': 3})
+    assert len(calls) == 2
+
+
+def test_bleak_handle_cache(bleak_variant, monkeypatch, tmp_path):
+    cache = str(tmp_path / 'gatt.json')
+
+    def record(client_kwargs):
+        return record_bleak(bleak_variant, duration=0.3, client_kwargs=client_kwargs, handle_cache=cache)
+
+    def table(dev):
+        return {char.uuid: char.handle for service in dev.client.services for char in service.characteristics
+                if service.uuid == bleak_variant.gatt.SERVICE_UUID}
+    check_cache(bleak_variant, monkeypatch, cache, record, table)
+
+
+def test_bluepy_handle_cache(bluepy_variant, monkeypatch, tmp_path):
+    cache = str(tmp_path / 'gatt.json')
+
+    def record(periph_kwargs):
+        return record_bluepy(bluepy_variant, duration=0.3, periph_kwargs=periph_kwargs, handle_cache=cache)
+
+    def table(dev):
+        return {char.uuid: char.valHandle for char in dev.dev.characteristics}
+    check_cache(bluepy_variant, monkeypatch, cache, record, table)
@@ -0,0 +1,32 @@
+import numpy as np
+
+from liveview import LivePlot, RangeTracker
+
+CHANNELS = ['g_x', 'g_y', 'g_z', 'a_x', 'a_y', 'a_z', 't', 'p']
+
+
+def test_range_tracker_ignores_nan():
+    tracker = RangeTracker()
+    assert tracker.update(1.0, 2.0, 1.0, 2.0)
+    limits = tracker.limits
+    assert not tracker.update(np.nan, np.nan, 1.0, 2.0)
+    assert not tracker.update(np.inf, -np.inf, np.nan, np.nan)
+    assert tracker.limits == limits
+
+
+def test_live_plot_limits_across_gap():
+    live = LivePlot(CHANNELS, size=50)
+    block = np.tile(np.arange(len(CHANNELS), dtype=float) + 20, (10, 1))
+    gap = np.full((5, len(CHANNELS)), np.nan)
+    live.extend(None, block)
+    live.update()
+    live.extend(None, gap)
+    live.update()
+    live.extend(None, np.vstack((gap, block + 1)))
+    live.update()
+    for ax, cols, lines, tracker in live.panels:
+        if tracker.fixed:
+            continue
+        assert np.isfinite(ax.get_ylim()).all()
+        low, high = tracker.limits
+        assert low < 20 + min(cols) and high > 21 + max(cols)
@@ -0,0 +1,90 @@
+import time
+import numpy as np
+import pytest
+
+import loader
+from recording import is_binary
+from test_notify import record_bleak, record_bluepy
+
+
+def check_tsv_log(dev, fname):
+    with open(fname) as f:
+        lines = f.read().splitlines()
+    assert lines[0].startswith('time\t')
+    assert lines[1] == '# start_time\t%.6f' % dev.start_wall_t
+    assert abs(dev.start_wall_t - time.time()) < 60
+    header, records = loader.load(str(fname), cache=False)
+    assert len(records) == len(dev.store)
+    assert abs(header['start_time'] - dev.start_wall_t) < 1e-6
+    header, records = loader.load(str(fname))
+    assert is_binary(loader.cache_fname(str(fname)))
+    assert abs(header['start_time'] - dev.start_wall_t) < 1e-6
+
+
+def test_bleak_tsv_start_time(bleak_variant, tmp_path):
+    fname = tmp_path / 'run.tsv'
+    dev = record_bleak(bleak_variant, duration=0.3, fname=str(fname))
+    check_tsv_log(dev, fname)
+
+
+def test_bluepy_tsv_start_time(bluepy_variant, tmp_path):
+    fname = tmp_path / 'run.tsv'
+    dev = record_bluepy(bluepy_variant, duration=0.3, fname=str(fname))
+    check_tsv_log(dev, fname)
+
+
+DROPS = {'drop_every': 0.4, 'down_time': 0.2}
+
+
+def check_gaps(dev, t, values):
+    gap_rows = np.isnan(values).all(axis=1)
+    assert len(dev.gaps) >= 2
+    assert gap_rows.sum() == len(dev.gaps)
+    assert not np.isnan(values[~gap_rows]).any()
+    assert (np.diff(t) >= 0).all()
+    # samples resume after each gap
+    assert not gap_rows[-1]
+
+
+def check_tsv_gaps(dev, fname):
+    with open(fname) as f:
+        comments = [line.split('\t') for line in f if line.startswith('#')]
+    assert len([c for c in comments if c[0] == '# gap']) == len(dev.gaps)
+    downtime = [c for c in comments if c[0] == '# downtime']
+    assert len(downtime) == 1
+    assert int(downtime[0][2]) == len(dev.gaps)
+    header, records = loader.load(str(fname), cache=False)
+    check_gaps(dev, records['time'], np.column_stack([records[name] for name in header['channels']]))
+
+
+def check_bin_gaps(dev, fname):
+    header, records = loader.load(str(fname))
+    assert len(header['gap_list']) == len(dev.gaps)
+    assert header['gaps'] == len(dev.gaps)
+    assert header['downtime'] > 0
+    assert header['reconnect_attempts'] >= len(dev.gaps)
+    check_gaps(dev, records['time'], np.column_stack([records[name] for name in header['channels']]))
+
+
+@pytest.mark.parametrize('ext', ['.tsv', '.bin'])
+def test_bleak_drop_and_reconnect(bleak_variant, tmp_path, ext):
+    fname = tmp_path / ('run' + ext)
+    dev = record_bleak(bleak_variant, duration=1.5, client_kwargs=DROPS, fname=str(fname), supervised=True,
+                       backoff=0.05, max_backoff=0.1)
+    check_gaps(dev, *dev.store.arrays())
+    if ext == '.tsv':
+        check_tsv_gaps(dev, fname)
+    else:
+        check_bin_gaps(dev, fname)
+
+
+@pytest.mark.parametrize('ext', ['.tsv', '.bin'])
+def test_bluepy_drop_and_reconnect(bluepy_variant, tmp_path, ext):
+    fname = tmp_path / ('run' + ext)
+    dev = record_bluepy(bluepy_variant, duration=1.5, periph_kwargs=DROPS, fname=str(fname), supervised=True,
+                        backoff=0.05, max_backoff=0.1)
+    check_gaps(dev, *dev.store.arrays())
+    if ext == '.tsv':
+        check_tsv_gaps(dev, fname)
+    else:
+        check_bin_gaps(dev, fname)
@@ -0,0 +1,17 @@
+import asyncio
+
+from loader import load
+
+
+def test_every_sample_reaches_the_files(bleak_variant, tmp_path):
+    multi = bleak_variant.multi
+    pattern = str(tmp_path / 'm_%s.bin')
+    recorder = multi.MultiRecorder(['AA:01', 'AA:02'], fname_pattern=pattern, handle_cache=None,
+                                   client_factory=lambda address: bleak_variant.fake.FakeBleakClient(address, seed=1))
+    report = asyncio.run(recorder.run(duration=1.0))
+    for address, dev in zip(recorder.addresses, recorder.devices):
+        header, records = load(multi.device_fname(address, pattern))
+        # stopped, not cancelled: the samples buffered since the last drain are drained and written too
+        assert not dev.running
+        assert len(records) == report[address]['samples']
+        assert records['time'][-1] > 970.0
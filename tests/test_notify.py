@@ -0,0 +1,167 @@
+import asyncio
+import numpy as np
+
+
+def record_bleak(variant, duration=1.0, client_kwargs={}, enable_kwargs={'gyro_acc': True}, fname=None,
+                 supervised=False, read_kwargs={}, **kwargs):
+    # supervised reconnects the same fake client after it drops the link
+    async def run():
+        client = variant.fake.FakeBleakClient('AA:BB', **dict({'latency': 0.001, 'seed': 0}, **client_kwargs))
+
+        async def reconnect():
+            await client.connect()
+            return client
+
+        await client.connect()
+        if supervised:
+            kwargs['reconnect'] = reconnect
+        dev = variant.sensor.RecordingDevice(client, **dict({'handle_cache': None}, **kwargs))
+        await dev.enable(**enable_kwargs)
+        task = asyncio.ensure_future(dev.read(fname, **read_kwargs))
+        await asyncio.sleep(duration)
+        dev.stop()
+        await task
+        await dev.disconnect()
+        return dev
+    return asyncio.run(run())
+
+
+def test_bleak_notify_rate(bleak_variant):
+    dev = record_bleak(bleak_variant, enable_kwargs={'gyro_acc': True, 'temp_press': True, 'rate': 100})
+    stats = dev.stats()
+    assert abs(stats['rate'] - 100) < 5
+    assert stats['dropped'] <= 2
+    t, values = dev.store.arrays()
+    assert values.shape[1] == 8
+    assert (np.diff(t) > 0).all()
+    assert not np.isnan(values).any()
+
+
+def record_bluepy(variant, duration=1.0, periph_kwargs={}, enable_kwargs={'gyro_acc': True}, fname=None,
+                  supervised=False, read_kwargs={}, **kwargs):
+    import threading
+    periph = variant.fake.FakePeripheral('AA:BB', latency=0.001, seed=0, **periph_kwargs)
+
+    def reconnect():
+        periph.connect()
+        return periph
+
+    if supervised:
+        kwargs['reconnect'] = reconnect
+    dev = variant.sensor.RecordingDevice(None, dev=periph, **dict({'handle_cache': None}, **kwargs))
+    dev.enable(**enable_kwargs)
+    timer = threading.Timer(duration, dev.stop)
+    timer.start()
+    try:
+        dev.read(fname, **read_kwargs)
+    finally:
+        timer.cancel()
+        dev.disconnect()
+    return dev
+
+
+def test_bluepy_notify_rate(bluepy_variant):
+    dev = record_bluepy(bluepy_variant, enable_kwargs={'gyro_acc': True, 'temp_press': True, 'rate': 100})
+    stats = dev.stats()
+    assert dev.notify
+    assert abs(stats['rate'] - 100) < 5
+    assert stats['dropped'] <= 2
+    t, values = dev.store.arrays()
+    assert (np.diff(t) > 0).all()
+    assert not np.isnan(values).any()
+
+
+def test_bluepy_polling_fallback(bluepy_variant):
+    # firmware that never notifies: read() gives up on notifications after notify_timeout and polls instead
+    dev = record_bluepy(bluepy_variant, duration=1.5, periph_kwargs={'notify': False}, notify_timeout=0.3)
+    assert not dev.notify
+    assert all(sensor.buffer is None for sensor in dev.sensors)
+    assert dev.stats()['samples'] > 50
+    t, values = dev.store.arrays()
+    assert (np.diff(t) > 0).all()
+    assert np.abs(values[:, 3:6]).max() > 0.5
+
+
+def check_drain_merge(variant, dev):
+    # rows are clocked by the IMU, the temperature/pressure reading that arrives between rows only shows up from
+    # the next row on. Rows before it are held back, there is no reading to give them
+    dev.start_t = 0
+    for t, value in [(10, 1.0), (20, 2.0), (30, 3.0)]:
+        dev.gyro_acc.buffer.next_row(t * 1000000)[:] = value
+    dev.temp_press.buffer.next_row(25 * 1000000)[:] = 7.0
+    t, block = dev.drain()
+    assert list(t) == [30.0]
+    assert list(block[:, 0]) == [3.0]
+    assert list(block[:, 6]) == [7.0]
+    dev.gyro_acc.buffer.next_row(40 * 1000000)[:] = 4.0
+    t, block = dev.drain()
+    assert list(block[:, 6]) == [7.0]
+    assert len(dev.store) == 2
+    assert not np.isnan(dev.store.arrays()[1]).any()
+
+
+def test_bluepy_drain_merges_by_time(bluepy_variant):
+    periph = bluepy_variant.fake.FakePeripheral('AA:BB', latency=0.0, seed=0)
+    dev = bluepy_variant.sensor.RecordingDevice(None, dev=periph, handle_cache=None)
+    dev.enable(gyro_acc=True, temp_press=True)
+    check_drain_merge(bluepy_variant, dev)
+
+
+def test_bleak_drain_merges_by_time(bleak_variant):
+    async def run():
+        client = bleak_variant.fake.FakeBleakClient('AA:BB', latency=0.0, seed=0)
+        await client.connect()
+        dev = bleak_variant.sensor.RecordingDevice(client, handle_cache=None)
+        await dev.enable(gyro_acc=True, temp_press=True)
+        for sensor in dev.sensors:
+            sensor.notify = False
+        check_drain_merge(bleak_variant, dev)
+        await client.disconnect()
+    asyncio.run(run())
+
+
+def check_raw_merge(variant, dev):
+    # raw mode merges like drain(): no row before the first temperature/pressure payload, and no zeros for it
+    dev.start_t = 0
+    imu = variant.fake.make_payload(variant.fake.GYRO_ACC_UUID, np.random.default_rng(0))
+    for t in [10, 20, 30]:
+        dev.gyro_acc.arena.append(t * 1000000, imu)
+    dev.temp_press.arena.append(25 * 1000000, variant.fake.make_payload(variant.fake.TEMP_PRESS_UUID,
+                                                                        np.random.default_rng(0)))
+    t, block = dev.decode_raw()
+    assert list(t) == [30.0]
+    assert block[0, 6] > 19
+    assert not np.isnan(block).any()
+
+
+def test_bluepy_raw_merge_holds_back_rows(bluepy_variant):
+    periph = bluepy_variant.fake.FakePeripheral('AA:BB', latency=0.0, seed=0)
+    dev = bluepy_variant.sensor.RecordingDevice(None, dev=periph, handle_cache=None, raw=True)
+    dev.enable(gyro_acc=True, temp_press=True)
+    check_raw_merge(bluepy_variant, dev)
+
+
+def test_bleak_raw_merge_holds_back_rows(bleak_variant):
+    async def run():
+        client = bleak_variant.fake.FakeBleakClient('AA:BB', latency=0.0, seed=0)
+        await client.connect()
+        dev = bleak_variant.sensor.RecordingDevice(client, handle_cache=None, raw=True)
+        await dev.enable(gyro_acc=True, temp_press=True)
+        check_raw_merge(bleak_variant, dev)
+        await client.disconnect()
+    asyncio.run(run())
+
+
+def test_bleak_polling_shares_the_bearer(bleak_variant):
+    # reads are serialized by the fake. The IMU is polled at the device rate and the slow sensors at 10 Hz, so the
+    # IMU beats reading all three in turn (about 66 Hz at 5 ms per read) without reading faster than it samples
+    fake = bleak_variant.fake
+    dev = record_bleak(bleak_variant, duration=1.5, client_kwargs={'latency': 0.005}, notify=False,
+                       enable_kwargs={'gyro_acc': True, 'temp_press': True, 'ambient_light': True, 'rate': 100})
+    duration = (dev.last_sample_t - dev.first_sample_t) / 1e9
+    reads = dev.client.reads
+    assert not dev.client.sent
+    assert 80 < reads[fake.GYRO_ACC_UUID] / duration < 102
+    assert dev.stats()['rate'] < 102
+    for uuid in [fake.TEMP_PRESS_UUID, fake.AMBIENT_LIGHT_UUID]:
+        assert 7 < reads[uuid] / duration < 13
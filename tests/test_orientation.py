@@ -0,0 +1,49 @@
+import numpy as np
+
+from orientation import ACCEL, GYRO, ComplementaryFilter, MadgwickFilter, euler, madgwick
+
+
+def motion(n, rate=100.0, seed=0):
+    # The fake SENSOR_PRO's IMU signal: slow rotation on the gyro, gravity plus a little motion on the accelerometer
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) * 1e3 / rate
+    phase = 2 * np.pi * 0.5 * t[:, np.newaxis] / 1e3 + np.array([0.0, 2.0, 4.0])
+    gyro = 30.0 * np.sin(phase) + rng.normal(0, 0.5, (n, 3))
+    accel = np.array([0.0, 0.0, 1.0]) + 0.05 * np.sin(phase) + rng.normal(0, 0.01, (n, 3))
+    return t, gyro, accel
+
+
+def sequential(t, gyro, accel, beta):
+    f = MadgwickFilter(beta=beta)
+    return np.array([f.update(row_t, g, a) for row_t, g, a in zip(t.tolist(), gyro.tolist(), accel.tolist())])
+
+
+def test_madgwick_matches_sequential_when_warmup_is_short():
+    # with beta=0.01 the 2000 sample warmup does not converge, the offline filter must still match
+    t, gyro, accel = motion(7000)
+    gyro[3000] = accel[3000] = np.nan
+    t[3001:] += 1000
+    for beta in [0.1, 0.01]:
+        diff = (euler(madgwick(t, gyro, accel, beta=beta)) - sequential(t, gyro, accel, beta) + 180) % 360 - 180
+        assert np.isnan(diff[3000]).all()
+        assert np.nanmax(np.abs(diff)) < 0.01
+
+
+def test_listener_calibrates_gyro_bias():
+    n = 1000
+    rng = np.random.default_rng(1)
+    t = np.arange(n) * 10.0
+    bias = np.array([1.5, -0.5, 2.0])
+    gyro = bias + rng.normal(0, 0.2, (n, 3))
+    accel = np.array([0.0, 0.0, 1.0]) + rng.normal(0, 0.01, (n, 3))
+    block = np.column_stack((gyro, accel))
+    f = ComplementaryFilter()
+    update = f.listener(GYRO + ACCEL, calibrate=2.0)
+    for start in range(0, n, 50):
+        update(t[start:start + 50], block[start:start + 50])
+        if t[start + 49] < 2000:
+            assert f.bias_window is None
+    assert f.bias_window is not None
+    assert np.allclose(f.bias, bias, atol=0.1)
+    # without the bias yaw would have drifted by 2 deg/s for 10 s
+    assert abs(f.angles()[2]) < 1
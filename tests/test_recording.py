@@ -0,0 +1,35 @@
+import numpy as np
+
+from loader import read_tsv
+from recording import binary_to_tsv, open_recording, tsv_to_binary
+
+HEADER = 'time\tg_x\tg_y\n# start_time\t1700000000.000000\n'
+TRAILER = '# rate\t100\t100\t99.50\n'
+
+
+def test_tsv_to_binary_empty_recording(tmp_path):
+    # stopped before the first sample: only the header and comment lines
+    (tmp_path / 'run.tsv').write_text(HEADER + TRAILER)
+    tsv_to_binary(str(tmp_path / 'run.tsv'), str(tmp_path / 'run.bin'))
+    header, records = open_recording(str(tmp_path / 'run.bin'))
+    assert header['channels'] == ['g_x', 'g_y']
+    assert header['start_time'] == 1700000000.0
+    assert len(records) == 0
+
+
+def test_tsv_to_binary_trailer_alone_in_last_chunk(tmp_path):
+    rows = '0.00\t1\t2\n10.00\t3\t4\n'
+    (tmp_path / 'run.tsv').write_text(HEADER + rows + TRAILER)
+    tsv_to_binary(str(tmp_path / 'run.tsv'), str(tmp_path / 'run.bin'), chunk_size=2)
+    header, records = open_recording(str(tmp_path / 'run.bin'))
+    assert np.array_equal(records['time'], [0, 10])
+    assert np.array_equal(records['g_y'], [2, 4])
+
+
+def test_binary_to_tsv_keeps_start_time(tmp_path):
+    (tmp_path / 'run.tsv').write_text(HEADER + '0.00\t1\t2\n10.00\t3\t4\n' + TRAILER)
+    tsv_to_binary(str(tmp_path / 'run.tsv'), str(tmp_path / 'run.bin'))
+    binary_to_tsv(str(tmp_path / 'run.bin'), str(tmp_path / 'back.tsv'))
+    header, records = read_tsv(str(tmp_path / 'back.tsv'))
+    assert header['start_time'] == 1700000000.0
+    assert np.array_equal(records['g_x'], [1, 3])
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from loader import load
+from recording import RecordEncoder, write_header
+from resample import Resampler, resample, resample_file
+
+
+def imu(n=3000, rate=100.0, seed=0):
+    # irregular rows of a g_x channel clocking a held temperature that changes every 50 rows
+    rng = np.random.default_rng(seed)
+    t = np.cumsum(rng.uniform(0.5, 1.5, n)) * 1e3 / rate
+    g = np.sin(2 * np.pi * t / 1e3) + rng.normal(0, 0.01, n)
+    temp = np.repeat(20 + rng.normal(0, 1, n // 50 + 1), 50)[:n]
+    return t, np.column_stack((g, temp))
+
+
+@pytest.mark.parametrize('method', ['linear', 'antialias'])
+def test_streaming_matches_whole(method):
+    t, values = imu()
+    values[1000] = np.nan
+    whole_t, whole = resample(t, values, ['g_x', 't'], 50.0, method)
+    resampler = Resampler(['g_x', 't'], 50.0, method)
+    parts = []
+    rng = np.random.default_rng(1)
+    start = 0
+    while start < len(t):
+        stop = start + int(rng.integers(1, 200))
+        parts.append(resampler.update(t[start:stop], values[start:stop]))
+        start = stop
+    parts.append(resampler.flush())
+    grid = np.concatenate([part[0] for part in parts])
+    block = np.concatenate([part[1] for part in parts])
+    # the same grid and, up to the rounding of the running integrals, the same values
+    assert np.array_equal(grid, whole_t)
+    assert np.allclose(block, whole, rtol=0, atol=1e-9, equal_nan=True)
+    assert np.all(np.diff(grid) > 0)
+
+
+def test_linear_and_antialias_on_known_signals():
+    rng = np.random.default_rng(2)
+    t = np.cumsum(rng.uniform(0.5, 1.5, 5000))
+    # a linear signal is reproduced exactly by both
+    values = (3 * t + 1)[:, np.newaxis]
+    for method in ['linear', 'antialias']:
+        grid, out = resample(t, values, ['g_x'], 50.0, method)
+        assert np.allclose(out[:, 0], 3 * grid + 1)
+    # the box filter of a sine scales it by sinc of the half width, here 20 ms at 5 Hz
+    w = 2 * np.pi * 5.0 / 1e3
+    values = np.sin(w * t)[:, np.newaxis]
+    grid, out = resample(t, values, ['g_x'], 50.0, 'antialias')
+    half = 10.0
+    assert np.allclose(out[:, 0], np.sin(w * grid) * np.sin(w * half) / (w * half), atol=1e-3)
+    grid, out = resample(t, values, ['g_x'], 50.0, 'linear')
+    assert np.allclose(out[:, 0], np.sin(w * grid), atol=1e-3)
+
+
+def test_gaps_become_nan():
+    t = np.arange(0, 2000, 10.0)
+    values = np.column_stack((t / 10,))
+    values[100] = np.nan
+    grid, out = resample(t, values, ['g_x'], 100.0)
+    # the grid points next to the gap marker are NaN, the rest untouched
+    nan = grid[np.isnan(out[:, 0])]
+    assert 1000.0 in nan and set(nan) <= {990.0, 1000.0, 1010.0}
+    assert np.allclose(out[~np.isnan(out[:, 0]), 0], grid[~np.isnan(out[:, 0])] / 10)
+    # samples more than max_gap apart: nothing between them, the sample opening the span included
+    keep = (t < 500) | (t >= 800)
+    grid, out = resample(t[keep], t[keep, np.newaxis] / 10, ['g_x'], 100.0, max_gap=50.0)
+    missing = (grid >= 490) & (grid < 800)
+    assert np.isnan(out[missing, 0]).all()
+    assert not np.isnan(out[~missing & (grid < 900), 0]).any()
+
+
+def test_held_sensor_interpolates_between_readings():
+    # the temperature only changes every second: it is interpolated between the rows where it changed, not as
+    # a staircase
+    t = np.arange(0, 3000, 10.0)
+    temp = np.floor(t / 1000) * 10
+    values = np.column_stack((np.zeros(len(t)), temp))
+    grid, out = resample(t, values, ['g_x', 't'], 10.0)
+    inside = grid <= 2000
+    assert np.allclose(out[inside, 1], grid[inside] / 100)
+    # held to the end after the last change
+    assert np.allclose(out[grid >= 2000, 1], 20)
+
+
+@pytest.mark.parametrize('ext', ['.bin', '.tsv'])
+def test_resample_file(tmp_path, ext):
+    t, values = imu(1000)
+    src = str(tmp_path / 'run.bin')
+    with open(src, 'wb') as f:
+        write_header(f, ['g_x', 't'], start_time=1700000000.0, value_dtype='<f8')
+        f.write(RecordEncoder(['g_x', 't'], '<f8')(t, values))
+    dst = str(tmp_path / ('out' + ext))
+    n = resample_file(src, dst, 50.0, chunk_size=97)
+    grid, expected = resample(t, values, ['g_x', 't'], 50.0)
+    header, records = load(dst, cache=False)
+    assert n == len(grid) == len(records)
+    assert np.allclose(records['time'], grid)
+    assert np.allclose(records['g_x'], expected[:, 0], atol=1e-3 if ext == '.tsv' else 1e-6)
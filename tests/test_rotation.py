@@ -0,0 +1,88 @@
+import io
+import os
+import numpy as np
+import pytest
+
+import loader
+import rotation
+from rotation import Segments, manifest_fname, segment_fname
+from test_notify import record_bleak, record_bluepy
+
+
+def segments(tmp_path, **kwargs):
+    def open_segment(fname, idx):
+        return io.BytesIO(b'header'), None
+    return Segments(str(tmp_path / 'run.bin'), open_segment, **kwargs)
+
+
+def test_segments_due_and_cut(tmp_path):
+    seg = segments(tmp_path, duration=1000.0)
+    seg.open()
+    t = np.arange(900.0, 1100.0, 10.0)
+    # an empty segment is never due, and ends at the next multiple of duration after its first sample
+    assert not seg.due(t[0])
+    assert seg.cut(t) == 10
+    seg.add(t[:10], 80)
+    assert not seg.due(990.0)
+    assert seg.due(1000.0)
+    # a batch past the end still puts one sample in the current segment
+    assert seg.cut(np.array([1500.0, 1510.0])) == 1
+    seg = segments(tmp_path, max_bytes=100)
+    seg.open()
+    assert seg.cut(t) == len(t)
+    seg.add(t[:10], 80)
+    assert not seg.due(t[10])
+    seg.add(t[10:15], 40)
+    assert seg.due(t[15])
+    with pytest.raises(ValueError):
+        segments(tmp_path)
+
+
+def check_rotation(dev, fname, read_kwargs):
+    manifest = rotation.read_manifest(manifest_fname(fname))
+    entries = manifest['segments']
+    assert len(entries) >= 3
+    channels = manifest['channels']
+    assert channels[:6] == ['g_x', 'g_y', 'g_z', 'a_x', 'a_y', 'a_z']
+    assert manifest['duration'] == read_kwargs.get('segment_duration')
+    assert manifest['max_bytes'] == read_kwargs.get('segment_bytes')
+    assert [entry['file'] for entry in entries] == [os.path.basename(segment_fname(fname, idx))
+                                                    for idx in range(len(entries))]
+    assert all(entry['complete'] for entry in entries)
+    assert sum(entry['samples'] for entry in entries) == len(dev.store)
+    for entry in entries:
+        path = os.path.join(os.path.dirname(fname), entry['file'])
+        assert entry['bytes'] == os.path.getsize(path)
+        header, records = loader.load(path)
+        assert len(records) == entry['samples']
+        assert records['time'][0] == pytest.approx(entry['t0'])
+        assert records['time'][-1] == pytest.approx(entry['t1'])
+        if 'segment_duration' in read_kwargs:
+            period = np.floor(entry['t0'] / read_kwargs['segment_duration'])
+            assert np.floor(entry['t1'] / read_kwargs['segment_duration']) == period
+    # contiguous segments
+    assert all(a['t1'] < b['t0'] for a, b in zip(entries, entries[1:]))
+    # joined back, the segments are the recording
+    header, records = rotation.load(manifest_fname(fname))
+    t, values = dev.store.arrays()
+    assert np.allclose(records['time'], t)
+    assert np.allclose(np.column_stack([records[name] for name in channels]), values, rtol=1e-6)
+    header, records = rotation.load(manifest_fname(fname), t0=t[len(t) // 2])
+    assert np.allclose(records['time'], t[len(t) // 2:])
+
+
+ROTATIONS = [{'segment_duration': 300.0}, {'segment_bytes': 4096}]
+
+
+@pytest.mark.parametrize('read_kwargs', ROTATIONS)
+def test_bleak_rotation(bleak_variant, tmp_path, read_kwargs):
+    fname = str(tmp_path / 'run.bin')
+    dev = record_bleak(bleak_variant, duration=1.2, fname=fname, read_kwargs=read_kwargs)
+    check_rotation(dev, fname, read_kwargs)
+
+
+@pytest.mark.parametrize('read_kwargs', ROTATIONS)
+def test_bluepy_rotation(bluepy_variant, tmp_path, read_kwargs):
+    fname = str(tmp_path / 'run.bin')
+    dev = record_bluepy(bluepy_variant, duration=1.2, fname=fname, read_kwargs=read_kwargs)
+    check_rotation(dev, fname, read_kwargs)
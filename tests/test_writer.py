@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+
+from writer import AsyncStreamWriter, StreamWriter
+
+
+class FullDisk:
+    # A file that fails once limit bytes have been written
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+        self.closed = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit:
+            raise OSError(28, 'No space left on device')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def batches(n=200, rows=10):
+    for idx in range(n):
+        yield np.arange(idx * rows, (idx + 1) * rows, dtype=np.float64), np.zeros((rows, 3))
+
+
+def test_write_error_is_raised_from_put_and_close():
+    f = FullDisk(1000)
+    writer = StreamWriter(f, 3, max_batches=2)
+    writer.start()
+    raised = threading.Event()
+
+    def acquire():
+        with pytest.raises(OSError):
+            for t, values in batches():
+                writer.extend(t, values)
+        raised.set()
+    thread = threading.Thread(target=acquire, daemon=True)
+    thread.start()
+    # without the fix acquisition blocks on the full queue forever
+    assert raised.wait(5.0)
+    with pytest.raises(OSError):
+        writer.close()
+    assert f.closed
+
+
+def test_async_write_error_is_raised_from_put_and_close():
+    async def run():
+        f = FullDisk(1000)
+        writer = AsyncStreamWriter(f, 3, max_batches=2)
+        writer.start()
+
+        async def acquire():
+            for t, values in batches():
+                await writer.extend(t, values)
+        with pytest.raises(OSError):
+            await asyncio.wait_for(acquire(), 5.0)
+        with pytest.raises(OSError):
+            await writer.close()
+        assert f.closed
+    asyncio.run(run())
+
+
+def test_writes_all_batches():
+    import io
+    f = io.StringIO()
+    f.close = lambda: None
+    writer = StreamWriter(f, 3, max_batches=2)
+    writer.start()
+    for t, values in batches(20):
+        writer.extend(t, values)
+    writer.close()
+    assert len(f.getvalue().splitlines()) == 200
@@ -0,0 +1,96 @@
+import math
+import numpy as np
+
+
+class IntervalHistogram:
+    # Running histogram of inter-sample intervals with log spaced bins (bins_per_decade from 1 us to 100 s),
+    # fed with integer nanosecond timestamps so percentiles can be read at any time during a recording
+
+    def __init__(self, bins_per_decade=40, min_ns=1e3, max_ns=1e11):
+        decades = int(round(np.log10(max_ns / min_ns)))
+        self.edges = np.logspace(np.log10(min_ns), np.log10(max_ns), decades * bins_per_decade + 1)
+        # counts[0] holds intervals below min_ns, counts[-1] those above max_ns
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.last_t = None
+        self.n = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, t):
+        # t is an array of increasing timestamps in ns, continuing from the previous call
+        if not len(t):
+            return
+        if self.last_t is None:
+            intervals = np.diff(t)
+        else:
+            intervals = np.diff(t, prepend=self.last_t)
+        self.last_t = t[-1]
+        if not len(intervals):
+            return
+        self.counts += np.bincount(np.searchsorted(self.edges, intervals, side='right'), minlength=len(self.counts))
+        self.n += len(intervals)
+        self.total += int(intervals.sum())
+        low = int(intervals.min())
+        high = int(intervals.max())
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def add_one(self, t):
+        if self.last_t is not None:
+            interval = t - self.last_t
+            self.counts[np.searchsorted(self.edges, interval, side='right')] += 1
+            self.n += 1
+            self.total += interval
+            self.min = interval if self.min is None else min(self.min, interval)
+            self.max = interval if self.max is None else max(self.max, interval)
+        self.last_t = t
+
+    def percentile(self, q):
+        # Geometric centre of the bin holding the q-th percentile, in ns
+        if not self.n:
+            return None
+        idx = int(np.searchsorted(np.cumsum(self.counts), q / 100.0 * self.n))
+        if idx == 0:
+            return self.min
+        if idx >= len(self.edges):
+            return self.max
+        return float(np.sqrt(self.edges[idx - 1] * self.edges[idx]))
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        # Interval statistics in ms
+        if not self.n:
+            return {'count': 0}
+        summary = {'count': self.n, 'mean': self.total / self.n / 1e6, 'min': self.min / 1e6, 'max': self.max / 1e6}
+        for q in percentiles:
+            summary['p%g' % q] = self.percentile(q) / 1e6
+        return summary
+
+
+class LatencyHistogram(IntervalHistogram):
+    # Durations in ns (e.g. of one stage of the acquisition loop) on the same log spaced bins, from 100 ns by
+    # default. record() is called per sample in the hot loop, so it finds the bin arithmetically and counts in a
+    # plain list rather than a numpy array
+
+    def __init__(self, bins_per_decade=40, min_ns=1e2, max_ns=1e11):
+        IntervalHistogram.__init__(self, bins_per_decade, min_ns, max_ns)
+        self.counts = [0] * len(self.counts)
+        self.bins_per_decade = bins_per_decade
+        self.log_min = math.log10(min_ns)
+        self.min_ns = min_ns
+        self.max_ns = max_ns
+
+    def record(self, duration):
+        if duration < self.min_ns:
+            idx = 0
+        elif duration >= self.max_ns:
+            idx = len(self.counts) - 1
+        else:
+            idx = int((math.log10(duration) - self.log_min) * self.bins_per_decade) + 1
+        self.counts[idx] += 1
+        self.n += 1
+        self.total += duration
+        if self.min is None or duration < self.min:
+            self.min = duration
+        if self.max is None or duration > self.max:
+            self.max = duration
@@ -0,0 +1,209 @@
+import asyncio
+import queue
+import threading
+import time
+import numpy as np
+
+
+class StreamWriter:
+    # Appends batches of samples to an open TSV file from a background thread. Rows are collected into a
+    # pending batch, batches go through a bounded queue and each batch is formatted with a single % operation.
+    # stalls counts how often acquisition had to wait for a full queue. encode replaces the TSV formatting,
+    # e.g. with a recording.RecordEncoder for binary files. With segments (a rotation.Segments) the output rolls
+    # over to a new file by duration or size, f and encode are then taken from its first segment. If writing
+    # fails (e.g. a full disk) the error is kept, later batches are dropped and it is raised from the next put() or
+    # close(), so acquisition stops instead of blocking on a queue nobody empties
+
+    def __init__(self, f, dim, batch_size=256, max_batches=64, encode=None, segments=None):
+        self.segments = segments
+        if segments is not None:
+            f, encode = segments.open()
+        self.f = f
+        self.dim = dim
+        self.encode = encode if encode is not None else self.format
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.row_fmt = '%.2f' + '\t%.3f' * dim + '\n'
+        self.pending_t = np.empty(batch_size)
+        self.pending_values = np.empty((batch_size, dim))
+        self.pending_n = 0
+        self.queue = queue.Queue(max_batches)
+        self.thread = None
+        self.bytes_written = 0
+        self.samples_written = 0
+        self.batches_written = 0
+        self.stalls = 0
+        self.max_queue_depth = 0
+        self.flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_time = 0.0
+        self.error = None
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return {'queue_depth': self.queue_depth, 'max_queue_depth': self.max_queue_depth,
+                'bytes_written': self.bytes_written, 'samples_written': self.samples_written,
+                'batches_written': self.batches_written, 'stalls': self.stalls,
+                'flush_latency': self.flush_latency, 'max_flush_latency': self.max_flush_latency,
+                'mean_flush_latency': self.total_flush_time / max(self.batches_written, 1)}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def take_pending(self):
+        batch = (self.pending_t[:self.pending_n].copy(), self.pending_values[:self.pending_n].copy())
+        self.pending_n = 0
+        return batch
+
+    def append(self, t, row):
+        self.pending_t[self.pending_n] = t
+        self.pending_values[self.pending_n] = row
+        self.pending_n += 1
+        if self.pending_n == self.batch_size:
+            self.put(*self.take_pending())
+
+    def extend(self, t, values):
+        if self.pending_n:
+            self.put(*self.take_pending())
+        self.put(t, values)
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def put(self, t, values):
+        self.check()
+        if not len(t):
+            return
+        try:
+            self.queue.put_nowait((t, values))
+        except queue.Full:
+            self.stalls += 1
+            self.queue.put((t, values))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    def format(self, t, values):
+        return (self.row_fmt * len(t)) % tuple(np.column_stack((t, values)).ravel().tolist())
+
+    def write_batch(self, t, values):
+        if self.segments is None:
+            self.write_data(t, values)
+            return
+        while len(t):
+            if self.segments.due(t[0]):
+                self.finish_file(self.segments.finish)
+                self.f, encode = self.segments.open()
+                self.encode = encode if encode is not None else self.format
+            cut = self.segments.cut(t)
+            self.segments.add(t[:cut], self.write_data(t[:cut], values[:cut]))
+            t, values = t[cut:], values[cut:]
+
+    def write_data(self, t, values):
+        start = time.perf_counter()
+        data = self.encode(t, values)
+        self.f.write(data)
+        self.f.flush()
+        self.flush_latency = time.perf_counter() - start
+        self.max_flush_latency = max(self.max_flush_latency, self.flush_latency)
+        self.total_flush_time += self.flush_latency
+        self.bytes_written += len(data)
+        self.samples_written += len(t)
+        self.batches_written += 1
+        return len(data)
+
+    def run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            self.write_safely(*batch)
+
+    def write_safely(self, t, values):
+        if self.error is None:
+            try:
+                self.write_batch(t, values)
+            except Exception as e:
+                self.error = e
+
+    def close(self, finish=None):
+        # finish(f) runs once every batch is written, just before the file is closed
+        if self.pending_n and self.error is None:
+            self.put(*self.take_pending())
+        self.queue.put(None)
+        self.thread.join()
+        self.close_failed()
+        self.finish_file(finish)
+
+    def close_failed(self):
+        # After a write error the file is closed as it is and the error raised
+        if self.error is not None:
+            try:
+                self.f.close()
+            except OSError:
+                pass
+            raise self.error
+
+    def finish_file(self, finish=None):
+        if hasattr(self.encode, 'close'):
+            # e.g. the last chunk and the index of a chunked recording
+            self.f.write(self.encode.close())
+        if finish is not None:
+            finish(self.f)
+        self.f.close()
+        if self.segments is not None:
+            self.segments.closed()
+
+
+class AsyncStreamWriter(StreamWriter):
+    # Same writer for asyncio acquisition: a task pulls batches off an asyncio.Queue and formats/writes
+    # them in the default executor so the event loop keeps servicing notifications
+
+    def __init__(self, f, dim, batch_size=256, max_batches=64, encode=None, segments=None):
+        StreamWriter.__init__(self, f, dim, batch_size, max_batches, encode, segments)
+        self.queue = None
+        self.task = None
+
+    def start(self):
+        self.queue = asyncio.Queue(self.max_batches)
+        self.task = asyncio.ensure_future(self.run_async())
+
+    async def append(self, t, row):
+        self.pending_t[self.pending_n] = t
+        self.pending_values[self.pending_n] = row
+        self.pending_n += 1
+        if self.pending_n == self.batch_size:
+            await self.put(*self.take_pending())
+
+    async def extend(self, t, values):
+        if self.pending_n:
+            await self.put(*self.take_pending())
+        await self.put(t, values)
+
+    async def put(self, t, values):
+        self.check()
+        if not len(t):
+            return
+        if self.queue.full():
+            self.stalls += 1
+        await self.queue.put((t, values))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    async def run_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.queue.get()
+            if batch is None:
+                break
+            await loop.run_in_executor(None, self.write_safely, *batch)
+
+    async def close(self, finish=None):
+        if self.pending_n and self.error is None:
+            await self.put(*self.take_pending())
+        await self.queue.put(None)
+        await self.task
+        self.close_failed()
+        self.finish_file(finish)